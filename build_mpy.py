@@ -0,0 +1,51 @@
+""" Cross-compiles the controller modules listed in manifest.py to .mpy bytecode.
+
+    python build_mpy.py [--mpy-cross PATH] [--out DIR] [-O LEVEL]
+
+Copy the .mpy files from DIR to the board in place of the .py sources (boot.py and main.py stay source), or freeze
+the modules into the firmware with manifest.py. mpy-cross must match the bytecode version of the firmware
+(pip install mpy-cross, or build it from micropython/mpy-cross).
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def manifest_modules(path):
+    '''Source files named by module() in a MicroPython manifest'''
+    modules = []
+    env = {
+        'include': lambda *args, **kwargs: None,
+        'module': lambda name, *args, **kwargs: modules.append(name),
+    }
+    with open(path) as manifest:
+        exec(manifest.read(), env)
+    return modules
+
+
+def build(mpy_cross, out, opt=0):
+    os.makedirs(out, exist_ok=True)
+    for name in manifest_modules(os.path.join(HERE, 'manifest.py')):
+        target = os.path.join(out, name[:-3] + '.mpy')
+        subprocess.check_call([mpy_cross, '-march=xtensawin', '-O%d' % opt, '-o', target, name], cwd=HERE)
+        print('%s -> %s (%d bytes)' % (name, target, os.path.getsize(target)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mpy-cross', default='mpy-cross', help='mpy-cross executable')
+    parser.add_argument('--out', default=os.path.join(HERE, 'build'), help='output directory')
+    parser.add_argument('-O', dest='opt', type=int, default=0, help='mpy-cross optimisation level')
+    args = parser.parse_args()
+    try:
+        build(args.mpy_cross, args.out, args.opt)
+    except FileNotFoundError:
+        sys.exit('%s not found, install it with pip install mpy-cross' % args.mpy_cross)
+
+
+if __name__ == '__main__':
+    main()
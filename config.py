@@ -1,80 +1,137 @@
 from collections import OrderedDict
 
 SETTINGS = {
-            'get_ready_time': 5
+            'get_ready_time': 5,
+            'all_red_time': 2, # all-red clearance after a yellow, before a conflicting green
+            'preempt_hold_time': 20, # green held for an emergency vehicle, extended by repeated calls
+            'preempt_latency_budget': 8, # worst-case seconds from preempt request to green
+            'min_green_time': 10, # seconds a green is kept before a waiting approach can take over
+            'level_weight': 100, # score of one request level (e.g. bus priority)
+            'queue_weight': 5, # score of one queued vehicle
+            'aging_rate': 1, # score gained per second of waiting, keeps quiet approaches from starving
+            'detector_debounce_ms': 30, # edges closer than this to the previous one are ignored
+            'detector_buffer': 64, # edges buffered per detector pin, power of 2
+            'detector_period_ms': 200, # how often the buffers are drained
+            'detector_window': 60, # seconds over which counts and occupancy are published
+            'walk_time': 7, # seconds of steady walk
+            'ped_clearance_time': 12, # seconds of flashing don't walk after the walk
+            'ped_recall': False, # True serves the walk in every green whether it was called or not
+            'flash_rate': 1, # flashes per second of flashing lamps
+            'power_saver_window': 600, # seconds without any detection before the controller light-sleeps
+            'power_saver_flash': False, # flash while asleep instead of going dark
+            'power_saver_check': 10, # longest light-sleep in seconds between checks of the detectors
+            'fixed_green_time': 30, # seconds of green per approach in the fixed-time plan used without WiFi
+            'wifi_timeout': 20, # seconds to wait for WiFi before the join is restarted
+            'snapshot': 'rtc', # where the restart snapshot is kept: 'rtc' memory, 'file' in flash or None
+            'snapshot_file_interval': 300, # least seconds between phase snapshots written to flash
+            'plan_transition_step': 5, # seconds a green may change per cycle when the time-of-day plan changes
+            'time_plan_check': 20, # seconds between checks of the calendar
+            'intersection': None, # name of this intersection in the corridor timing published by corridor.py
+            'cycle_length': None, # seconds of the corridor's common cycle, None when not coordinated
+            'offset': 0, # seconds from the corridor's cycle start to the start of this intersection's first slot
+            'offset_correction': 10, # most seconds the coordinated green is changed per cycle to keep the offset
+            'time_server': 'ntp.ntsc.ac.cn', # NTP server, an IP address (e.g. the Rpi's, running chrony) needs no DNS lookup
+            'time_sync_interval': 64, # seconds between NTP bursts
+            'time_sync_timeout': 1, # seconds to wait for an NTP reply
+            'time_step_threshold': 1, # seconds of offset set into the RTC at once, smaller ones are slewed
+            'slew_rate': 5, # most ms per second the synchronised clock is corrected by
+            'utc_offset': 0, # hours the local time kept in the RTC is ahead of UTC
+            'mqtt_server': '192.168.100.204', # MQTT broker, the Rpi
+            'mqtt_poll_ms': 100, # ms between polls of the MQTT connection for messages
+            'mqtt_retry': 10, # seconds to wait before connecting to the broker again
+            'mqtt_hello_interval': 5 # seconds between hello messages to the Rpi
 
 }
 
-SCENARIOS = OrderedDict([
-            (
-                1,
-                    [
+# With a scenarios_packed module (see pack_scenarios.py) SCENARIOS is read from the packed blob, the scenario
+# sets below are then never built on the heap.
+try:
+    from scenarios_packed import BLOB
+    from scenario_blob import Scenarios
+    SCENARIOS = Scenarios(BLOB)
+except ImportError:
+    SCENARIOS = OrderedDict([
+                (
+                    1,
+                        [
+                            {
+                                'name': 'North',
+                                'bulbs': 3,
+                                'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
+                                'initial': 'Green',
+                                'status': 'On',
+                                'throughput': 1
+                            },
+
+                            {
+                                'name': 'South',
+                                'bulbs': 3,
+                                'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
+                                'initial': 'Green',
+                                'status': 'On',
+                                'throughput': 1
+                            }
+                        ]
+                ),
+
+                (
+                    2,
+
                         {
-                            'name': 'North',
-                            'bulbs': 3,
-                            'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
-                            'initial': 'Green',
+                            'name': 'Southx',
+                            'bulbs': 2,
+                            'states': ['Red', 'Green'],
+                            'initial': 'Red',
                             'status': 'On',
                             'throughput': 1
-                        },
+                        }
+
+
+                ),
+
+                (
+                    3,
 
                         {
-                            'name': 'South',
+                            'name': 'West',
                             'bulbs': 3,
                             'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
-                            'initial': 'Green',
+                            'initial': 'Red',
                             'status': 'On',
                             'throughput': 1
                         }
-                    ]
-            ),
-
-            (
-                2,
-
-                    {
-                        'name': 'Southx',
-                        'bulbs': 2,
-                        'states': ['Red', 'Green'],
-                        'initial': 'Red',
-                        'status': 'On',
-                        'throughput': 1
-                    }
-
 
-            ),
 
-            (
-                3,
+                ),
 
-                    {
-                        'name': 'West',
-                        'bulbs': 3,
-                        'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
-                        'initial': 'Red',
-                        'status': 'On',
-                        'throughput': 1
-                    }
+                (
+                    4,
 
+                        {
+                            'name': 'East',
+                            'bulbs': 3,
+                            'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
+                            'initial': 'Red',
+                            'status': 'Off',
+                            'throughput': 1
+                        }
 
-            ),
 
-            (
-                4,
+                )
 
-                    {
-                        'name': 'East',
-                        'bulbs': 3,
-                        'states': ['Red', 'Yellow_Red', 'Green', 'Yellow_Green'],
-                        'initial': 'Red',
-                        'status': 'Off',
-                        'throughput': 1
-                    }
+    ])
 
+# Time-of-day plans (see timeplans.py): plan name -> seconds of green per approach, approaches left out get
+# fixed_green_time. 'flash': True puts the intersection in flash instead. The plan 'fixed' is always defined.
+# e.g {'am_peak': {'North': 45, 'South': 45, 'Southx': 20, 'West': 25}, 'night': {'flash': True}}
+TIME_PLANS = {}
 
-            )
+# (days, 'HH:MM', plan) entries, the plan runs from that time until the next entry. days is 'Mon'..'Sun',
+# a range such as 'Mon-Fri', 'All' or 'Hol' for the dates in HOLIDAYS
+# e.g [('Mon-Fri', '07:00', 'am_peak'), ('Mon-Fri', '09:30', 'fixed'), ('All', '23:00', 'night'), ('All', '05:30', 'fixed')]
+CALENDAR = []
 
-])
+HOLIDAYS = [] # (month, day) dates that run the 'Hol' entries, or Sunday's without any, e.g [(1, 1), (12, 25)]
 
 PINS = OrderedDict([
     (
@@ -83,6 +140,19 @@ PINS = OrderedDict([
         "GPIO_POOL",
         [13,14,12,27,33,26,15,4,18,23,22,25] #for esp32 30 pin config
 
+    ),
+    (
+        "PREEMPT",
+        {} # approach name -> GPIO of its emergency vehicle detector e.g {'North': 34, 'West': 35}
+    ),
+    (
+        "DETECTORS",
+        {} # approach name -> GPIO or list of GPIOs of its vehicle detectors e.g {'North': [36, 39], 'West': 32}
+    ),
+    (
+        "PEDESTRIAN",
+        {} # approach whose green the crossing walks with -> GPIOs of the crossing
+           # e.g {'North': {'button': 35, 'walk': 2, 'dont_walk': 5}}
     )
 
 
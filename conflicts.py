@@ -0,0 +1,57 @@
+# conflicts.py Conflict monitor: approaches that don't share a slot never show green together
+# Usage:
+# masks = compile_masks(scenarios, names)  # conflict bitmask of every approach, bit i for names[i]
+# check_slots(models)                      # first slot of the compiled plan with conflicting greens, or None
+#
+# Approaches listed in the same slot of SCENARIOS may be green together. An 'x' approach (e.g. 'Southx') extends
+# the green of its base approach ('South') into its own slot, so the base approach may also be green with the
+# slot of the 'x' approach. Every other pair conflicts.
+# The masks are compiled with the plan, so a reloaded plan brings its own. Each lamp model keeps its bit and its
+# mask; the machine keeps the bits of the greens on in one int, and a green is only put on if that int and the
+# mask have no bit in common: one AND per green, with small ints that are never allocated. A conflict puts the
+# intersection in flash and keeps it there until ClearFault (see StateMachine.conflict).
+
+MAX_APPROACHES = 30 # bits of a MicroPython small int
+
+
+def slot_groups(scenarios):
+    '''Names of the approaches that may be green in each slot'''
+    groups = []
+    for value in scenarios.values():
+        group = set()
+        for val in (value if isinstance(value, list) else [value]):
+            if val['status'] == 'On':
+                group.add(val['name'])
+                if val['name'].endswith('x'):
+                    group.add(val['name'].rstrip('x'))
+        groups.append(group)
+    return groups
+
+
+def compile_masks(scenarios, names):
+    '''Returns the conflict mask of every approach of names, in the same order'''
+    if len(names) > MAX_APPROACHES:
+        raise ValueError("At most {} approaches".format(MAX_APPROACHES))
+    groups = slot_groups(scenarios)
+    masks = []
+    for a in names:
+        mask = 0
+        for j, b in enumerate(names):
+            if a != b and not any(a in group and b in group for group in groups):
+                mask |= 1 << j
+        masks.append(mask)
+    return masks
+
+
+def check_slots(models):
+    '''Index of the first slot where the ordered states of models give conflicting greens, None if there is none.
+       models have their bit and conflicts set'''
+    slots = max(len(model.ordered_states) for model in models) if models else 0
+    for slot in range(slots):
+        greens = 0
+        for model in models:
+            if slot < len(model.ordered_states) and model.ordered_states[slot] == 'Green':
+                if greens & model.conflicts:
+                    return slot
+                greens |= model.bit
+    return None
@@ -0,0 +1,80 @@
+# coordination.py Green-wave coordination of the intersections along a corridor
+# Usage:
+# coordinator = Coordinator(now, log)            # now() returns wall-clock ms
+# client.set_callback(coordinator.on_message)    # offsets published by corridor.py on CORRIDOR_TOPIC
+# green_ms += coordinator.correction(green_ms)   # as the first slot of a cycle starts
+#
+# All intersections of a corridor run SETTINGS['cycle_length'] seconds. The first slot of this intersection's
+# cycle (its coordinated green) should start SETTINGS['offset'] seconds after every multiple of the cycle
+# length in wall-clock time, so the anchor is the same on every controller whose clock is synchronised.
+# At each cycle start the distance to that schedule is measured and the coordinated green is stretched or cut
+# by up to SETTINGS['offset_correction'] seconds, never below min_green_time. Larger errors, e.g. after a new
+# offset, take several cycles. SETTINGS['cycle_length'] = None leaves the intersection uncoordinated.
+# The greens of the plan should add up to about the cycle length. The difference, measured over the last
+# cycle, is taken off the coordinated green as well, else it would remain as a constant error.
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from config import SETTINGS
+
+CORRIDOR_TOPIC = b'corridor'
+
+
+class Coordinator(object):
+    """ Keeps the cycle of the intersection on the corridor's wall-clock schedule.
+    Attributes:
+        error (int): ms the last cycle started after its scheduled time (negative: before it), None if
+            uncoordinated.
+        last_correction (int): ms added to the last coordinated green.
+    """
+
+    def __init__(self, now, log):
+        self.now = now
+        self.log = log
+        self.error = None
+        self.last_correction = 0
+        self._last_start = None
+
+    def on_message(self, topic, msg):
+        '''MQTT callback. The message is the JSON corridor.py publishes:
+           {"cycle": seconds, "offsets": {intersection name: seconds}}'''
+        if topic != CORRIDOR_TOPIC:
+            return
+        try:
+            timing = json.loads(msg)
+            cycle = timing['cycle']
+            offset = timing['offsets'][SETTINGS['intersection']]
+            if not cycle > 0:
+                raise ValueError("cycle must be > 0")
+        except (ValueError, KeyError, TypeError) as e:
+            self.log.error("Corridor timing ignored: {}".format(repr(e)))
+            return
+        SETTINGS['cycle_length'] = cycle
+        SETTINGS['offset'] = offset % cycle
+        self.log.info("Corridor cycle {} s, offset {} s".format(cycle, SETTINGS['offset']))
+
+    def correction(self, green_ms):
+        '''ms to add to the coordinated green of the cycle starting now'''
+        cycle = SETTINGS['cycle_length']
+        if not cycle:
+            self.error = None
+            return 0
+        cycle = int(cycle * 1000)
+        now = self.now()
+        error = (now - int(SETTINGS['offset'] * 1000)) % cycle
+        if error > cycle // 2:
+            error -= cycle # early rather than late by most of a cycle
+        # how much longer than the cycle length the plan ran last cycle, without the last correction
+        excess = 0
+        if self._last_start is not None and now - self._last_start < 2 * cycle:
+            excess = now - self._last_start - self.last_correction - cycle
+        self._last_start = now
+        limit = int(SETTINGS['offset_correction'] * 1000)
+        correction = max(-limit, min(limit, -error - excess))
+        correction = max(correction, int(SETTINGS['min_green_time'] * 1000) - green_ms)
+        self.error = error
+        self.last_correction = correction
+        return correction
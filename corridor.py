@@ -0,0 +1,133 @@
+""" Finds green-wave offsets for the intersections of a corridor and publishes them to the controllers.
+
+    python corridor.py MODEL.json [--step S] [--starts N] [--broker HOST]
+
+MODEL.json describes the corridor:
+    {"cycle": 90, "speed": 13.9,
+     "intersections": [{"name": "A", "position": 0, "green": 40}, {"name": "B", "position": 420, "green": 35}, ...]}
+position is in metres along the arterial, green the seconds of its coordinated green (the first slot of each
+controller's cycle), speed the progression speed in m/s. Platoons are released over the green of the first
+intersection in one direction and of the last in the other, at one vehicle per headway, and driven through
+the corridor. A vehicle that meets red waits for the next green.
+
+Offsets are found by coordinate descent: one intersection at a time, the platoon delay of every candidate offset
+(0 to cycle in steps of --step seconds) is evaluated at once as an array, the best one is kept, until a sweep
+changes nothing. The first intersection stays at offset 0. Descent stops in local optima, so it is started from
+all offsets 0, from the progression of either direction and from --starts random offsets; the best result wins.
+
+The result is published as {"cycle": ..., "offsets": {name: seconds}} on the topic the controllers subscribe
+to (coordination.CORRIDOR_TOPIC), if paho-mqtt is installed and --broker is given, else printed. Each
+controller picks its own offset by SETTINGS['intersection']. Needs numpy.
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+CORRIDOR_TOPIC = 'corridor' # coordination.CORRIDOR_TOPIC
+HEADWAY = 2.0 # seconds between the vehicles of a platoon
+
+
+def platoon_delay(offsets, positions, greens, cycle, speed, reverse=False):
+    '''Total delay in seconds of the platoon for every row of offsets (candidates x intersections)'''
+    order = np.arange(len(positions))[::-1] if reverse else np.arange(len(positions))
+    first = order[0]
+    departures = np.arange(0, greens[first], HEADWAY)
+    t = offsets[:, first, None] + departures[None, :]
+    delay = np.zeros(len(offsets))
+    for previous, j in zip(order[:-1], order[1:]):
+        t = t + abs(positions[j] - positions[previous]) / speed
+        phase = (t - offsets[:, j, None]) % cycle
+        wait = np.where(phase >= greens[j], cycle - phase, 0.0)
+        delay += wait.sum(axis=1)
+        t = t + wait
+    return delay
+
+
+def corridor_delay(offsets, positions, greens, cycle, speed):
+    return (platoon_delay(offsets, positions, greens, cycle, speed)
+            + platoon_delay(offsets, positions, greens, cycle, speed, reverse=True))
+
+
+def descend(offsets, positions, greens, cycle, speed, candidates, sweeps=20):
+    offsets = offsets.copy()
+    for _ in range(sweeps):
+        changed = False
+        for j in range(1, len(positions)):
+            rows = np.tile(offsets, (len(candidates), 1))
+            rows[:, j] = candidates
+            delay = corridor_delay(rows, positions, greens, cycle, speed)
+            best = candidates[np.argmin(delay)]
+            if best != offsets[j]:
+                offsets[j] = best
+                changed = True
+        if not changed:
+            break
+    return offsets, corridor_delay(offsets[None, :], positions, greens, cycle, speed)[0]
+
+
+def optimise(positions, greens, cycle, speed, step=1.0, starts=20, seed=0):
+    '''Returns (offsets, delay) with offsets[0] == 0'''
+    positions = np.asarray(positions, dtype=float)
+    greens = np.asarray(greens, dtype=float)
+    candidates = np.arange(0, cycle, step)
+    travel = (positions - positions[0]) / speed
+    initial = [np.zeros(len(positions)), np.round(travel % cycle / step) * step,
+               np.round(-travel % cycle / step) * step]
+    random = np.random.default_rng(seed)
+    for _ in range(starts):
+        offsets = random.choice(candidates, len(positions))
+        offsets[0] = 0
+        initial.append(offsets)
+    return min((descend(offsets, positions, greens, cycle, speed, candidates) for offsets in initial),
+               key=lambda result: result[1])
+
+
+def publish(message, broker):
+    try:
+        import paho.mqtt.publish as mqtt_publish
+    except ImportError:
+        mqtt_publish = None
+    if broker is None or mqtt_publish is None:
+        print(message)
+        if broker is not None:
+            print('paho-mqtt is not installed, publish the line above on topic %s' % CORRIDOR_TOPIC)
+        return
+    mqtt_publish.single(CORRIDOR_TOPIC, message, hostname=broker, retain=True)
+    print('published on %s@%s' % (CORRIDOR_TOPIC, broker))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('model', help='corridor model, JSON')
+    parser.add_argument('--step', type=float, default=1.0, help='offset resolution in seconds')
+    parser.add_argument('--starts', type=int, default=20, help='random starting points of the descent')
+    parser.add_argument('--broker', help='MQTT broker to publish the offsets to')
+    args = parser.parse_args()
+    with open(args.model) as f:
+        model = json.load(f)
+    intersections = model['intersections']
+    if len(intersections) < 2:
+        sys.exit('A corridor needs at least 2 intersections')
+    cycle, speed = float(model['cycle']), float(model['speed'])
+    positions = [intersection['position'] for intersection in intersections]
+    greens = [intersection['green'] for intersection in intersections]
+    if max(greens) > cycle:
+        sys.exit('A green is longer than the cycle')
+
+    offsets, delay = optimise(positions, greens, cycle, speed, args.step, args.starts)
+    start = corridor_delay(np.zeros((1, len(positions))), np.asarray(positions, dtype=float),
+                           np.asarray(greens, dtype=float), cycle, speed)[0]
+    for intersection, offset in zip(intersections, offsets):
+        print('%-12s %8.0f m  green %5.1f s  offset %5.1f s' % (intersection['name'], intersection['position'],
+                                                               intersection['green'], offset))
+    print('platoon delay %.0f s per cycle, %.0f s with all offsets 0' % (delay, start))
+    publish(json.dumps({'cycle': model['cycle'],
+                        'offsets': {intersection['name']: float(offset)
+                                    for intersection, offset in zip(intersections, offsets)}}), args.broker)
+
+
+if __name__ == '__main__':
+    main()
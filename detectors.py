@@ -0,0 +1,197 @@
+# detectors.py Vehicle detector inputs (inductive loops, IR beams)
+# Usage:
+# from detectors import DetectorBank
+# bank = DetectorBank(listener=callback)  # pins from PINS['DETECTORS']
+#
+# Every detector pin gets a hard IRQ on both edges. The handler debounces, stamps ticks_ms and the pin level
+# into a preallocated ring buffer, keeps the shortest interval between two edges and returns; it allocates
+# nothing. A uasyncio task drains the buffers every detector_period_ms into vehicle counts and occupied time
+# and publishes them per approach every detector_window seconds.
+# DetectorBank.lightsleep() sleeps the whole chip until a detector turns occupied, for idle periods.
+
+from array import array
+from machine import Pin, lightsleep
+import uasyncio as asyncio
+from utime import ticks_add, ticks_diff, ticks_ms
+
+from config import PINS, SETTINGS
+
+NO_GAP = 0x3fffffff # min_gap before two edges were seen, a small int on the board
+
+
+class Detector:
+    """ One detector pin. The ring buffer is written by the IRQ handler (head) and read by drain() (tail) only,
+        so neither side needs a lock. Edges arriving while the buffer is full are counted in dropped.
+    Attributes:
+        count (int): Vehicles seen since start-up (occupied edges).
+        occupied (int): ms occupied in the current window.
+        min_gap (int): Shortest ms between two edges seen by the IRQ handler so far, NO_GAP before the second.
+        peak_rate (int): Highest edge rate seen on the pin so far, 1000 // min_gap edges per second.
+        dropped (int): Edges lost to a full buffer.
+    """
+
+    def __init__(self, name, gpio, size=64, debounce_ms=30):
+        if size < 2 or size & (size - 1):
+            raise ValueError("Detector buffer size must be a power of 2, got {}".format(size))
+        self.name = name
+        self.debounce = debounce_ms
+
+        self._times = array('I', [0] * size)
+        self._levels = bytearray(size)
+        self._mask = size - 1
+        self._head = 0
+        self._tail = 0
+        self._last = ticks_add(ticks_ms(), -debounce_ms)
+        self._on_since = None
+        self._seen = False # the first edge has no interval
+
+        self.count = 0
+        self.occupied = 0
+        self.min_gap = NO_GAP
+        self.peak_rate = 0
+        self.dropped = 0
+
+        self.pin = Pin(gpio, Pin.IN)
+        self.pin.irq(handler=self._isr, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)
+
+    def _isr(self, pin):
+        now = ticks_ms()
+        gap = ticks_diff(now, self._last)
+        if gap < self.debounce: # contact bounce or loop chatter
+            return
+        if self._seen and gap < self.min_gap:
+            self.min_gap = gap
+        self._seen = True
+        self._last = now
+        head = self._head
+        nxt = (head + 1) & self._mask
+        if nxt == self._tail:
+            self.dropped += 1
+            return
+        self._times[head] = now
+        self._levels[head] = pin.value()
+        self._head = nxt
+
+    def drain(self):
+        '''Moves the buffered edges into count and occupied, returns how many there were'''
+        head = self._head
+        tail = self._tail
+        edges = 0
+        while tail != head:
+            if self._levels[tail]:
+                if self._on_since is None: # repeated levels come from edges lost to debouncing
+                    self._on_since = self._times[tail]
+                    self.count += 1
+            elif self._on_since is not None:
+                self.occupied += ticks_diff(self._times[tail], self._on_since)
+                self._on_since = None
+            tail = (tail + 1) & self._mask
+            edges += 1
+        self._tail = tail
+        if self.min_gap < NO_GAP:
+            self.peak_rate = 1000 // max(self.min_gap, 1)
+        return edges
+
+    def close_window(self, now):
+        '''Returns the ms occupied in the window ending now and starts a new window'''
+        if self._on_since is not None: # still occupied, split the occupation at the window boundary
+            self.occupied += ticks_diff(now, self._on_since)
+            self._on_since = now
+        occupied, self.occupied = self.occupied, 0
+        return occupied
+
+
+class DetectorBank:
+    """ The detectors of an intersection grouped by approach.
+    Attributes:
+        detectors (dict): Approach name -> list of Detector.
+        counts (dict): Approach name -> vehicles counted in the last window.
+        occupancy (dict): Approach name -> fraction of the last window its detectors were occupied (0..1).
+    """
+
+    def __init__(self, pins=None, listener=None):
+        if pins is None:
+            pins = PINS.get('DETECTORS', {})
+        size = SETTINGS.get('detector_buffer', 64)
+        debounce = SETTINGS.get('detector_debounce_ms', 30)
+        self.period = SETTINGS.get('detector_period_ms', 200)
+        self.window = int(SETTINGS.get('detector_window', 60) * 1000)
+        self.listener = listener # called with the bank after every drain pass
+
+        self.detectors = {}
+        for name, gpios in pins.items():
+            if isinstance(gpios, int):
+                gpios = [gpios]
+            self.detectors[name] = [Detector(name, gpio, size, debounce) for gpio in gpios]
+
+        self.counts = {name: 0 for name in self.detectors}
+        self.occupancy = {name: 0 for name in self.detectors}
+        self._window_counts = {name: 0 for name in self.detectors}
+        self.last_activity = ticks_ms()
+
+        self._task = asyncio.create_task(self._run()) if self.detectors else None
+
+    def total(self, name):
+        '''Vehicles counted on the approach since start-up'''
+        return sum(detector.count for detector in self.detectors[name])
+
+    def peak_rate(self, name):
+        '''Highest edge rate seen on one pin of the approach, edges per second'''
+        return max(detector.peak_rate for detector in self.detectors[name])
+
+    def dropped(self, name):
+        return sum(detector.dropped for detector in self.detectors[name])
+
+    def drain(self):
+        edges = 0
+        for detectors in self.detectors.values():
+            for detector in detectors:
+                edges += detector.drain()
+        if edges:
+            self.last_activity = ticks_ms()
+
+    def idle(self):
+        '''ms since the last edge on any detector'''
+        return ticks_diff(ticks_ms(), self.last_activity)
+
+    def lightsleep(self, flasher=None):
+        '''Light-sleeps until a detector is occupied and returns ticks_ms at wake-up. The detector pins are armed
+           as ext1 wake sources, which needs RTC GPIOs; other pins are polled at every wake-up. The timer of a
+           flasher does not run in light sleep, its lamps are toggled between sleeps of half a flash period.'''
+        import esp32
+        pins = [detector.pin for detectors in self.detectors.values() for detector in detectors]
+        try:
+            esp32.wake_on_ext1(pins=pins, level=esp32.WAKEUP_ANY_HIGH)
+        except ValueError:
+            pass # not all RTC GPIOs, only the timed wake-ups are left
+        check = int(SETTINGS.get('power_saver_check', 10) * 1000)
+        while not any(pin.value() for pin in pins):
+            if flasher is not None and flasher.mask:
+                flasher._toggle(None)
+                lightsleep(int(500 / flasher.rate))
+            else:
+                lightsleep(check)
+        self.last_activity = ticks_ms()
+        return self.last_activity
+
+    def close_window(self, window_ms):
+        '''Publishes counts and occupancy of the window that just ended'''
+        now = ticks_ms()
+        for name, detectors in self.detectors.items():
+            total = self.total(name)
+            self.counts[name] = total - self._window_counts[name]
+            self._window_counts[name] = total
+            occupied = sum(detector.close_window(now) for detector in detectors)
+            self.occupancy[name] = min(1, occupied / (window_ms * len(detectors)))
+
+    async def _run(self):
+        window_start = ticks_ms()
+        while True:
+            await asyncio.sleep_ms(self.period)
+            now = ticks_ms()
+            self.drain()
+            if ticks_diff(now, window_start) >= self.window:
+                self.close_window(ticks_diff(now, window_start))
+                window_start = now
+            if self.listener is not None:
+                self.listener(self)
@@ -0,0 +1,59 @@
+# flasher.py Flashing lamps driven by one shared hardware timer
+# Usage:
+# from flasher import flasher
+# flasher.add(pin)     # pin flashes in phase with every other flashing pin
+# flasher.remove(pin)  # pin stops flashing and is left off
+#
+# The timer callback toggles every pin whose bit is set in Flasher.mask, so the uasyncio loop is not woken
+# for flashing lamps and all of them flash in phase. The timer only runs while at least one pin flashes.
+# LEDC/PWM channels are not used because separate channels do not flash in phase.
+
+from machine import Timer
+
+from config import SETTINGS
+
+
+class Flasher:
+
+    def __init__(self, timer_id=0, rate=1):
+        self.timer_id = timer_id
+        self.rate = rate # flashes per second
+        self.pins = [] # slot -> Pin, slots are kept so the mask stays valid
+        self.mask = 0 # bit i set while pins[i] flashes
+        self._lit = 0
+        self._timer = None
+
+    def add(self, pin):
+        if pin in self.pins:
+            slot = self.pins.index(pin)
+        else:
+            slot = len(self.pins)
+            self.pins.append(pin)
+        pin.value(self._lit)
+        self.mask |= 1 << slot
+        if self._timer is None:
+            self._timer = Timer(self.timer_id)
+            self._timer.init(mode=Timer.PERIODIC, period=int(500 / self.rate), callback=self._toggle)
+
+    def remove(self, pin):
+        if pin not in self.pins:
+            return
+        self.mask &= ~(1 << self.pins.index(pin))
+        pin.value(0)
+        if not self.mask and self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    def flashing(self, pin):
+        return pin in self.pins and bool(self.mask & (1 << self.pins.index(pin)))
+
+    def _toggle(self, timer):
+        self._lit ^= 1
+        mask = self.mask
+        pins = self.pins
+        for slot in range(len(pins)):
+            if mask & (1 << slot):
+                pins[slot].value(self._lit)
+
+
+flasher = Flasher(rate=SETTINGS.get('flash_rate', 1))
@@ -0,0 +1,26 @@
+# Frozen-module manifest for the controller. Build the firmware with
+#   make BOARD=ESP32_GENERIC FROZEN_MANIFEST=/path/to/Traffic-system/manifest.py
+# in micropython/ports/esp32. Frozen modules are imported from flash as bytecode, nothing is compiled at boot.
+# The filesystem comes first on sys.path, so a config.py copied to the board still overrides the frozen one.
+# build_mpy.py reads the same list to cross-compile .mpy files instead.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("profiler.py")
+module("scenario_blob.py")
+module("config.py")
+module("conflicts.py")
+module("coordination.py")
+module("delay_ms.py")
+module("detectors.py")
+module("flasher.py")
+module("mqtt_link.py")
+module("plans.py")
+module("snapshot.py")
+module("timeplans.py")
+module("timesync.py")
+module("ulogger.py")
+module("state_machine.py")
+module("state_machine_priority.py")
+# after python pack_scenarios.py, so the packed scenario sets are read from flash (see config.py):
+# module("scenarios_packed.py")
@@ -0,0 +1,106 @@
+# mqtt_link.py MQTT connection of the controller, kept by a uasyncio task
+# Usage:
+# link = MqttLink({plans.PLAN_TOPIC: loader.on_message}, log)  # in the controller's main(), once the loop runs
+# link.publish(b'topic', b'message')                          # dropped while the broker is unreachable
+#
+# The task waits for the WiFi association boot.py started, connects to SETTINGS['mqtt_server'] and subscribes
+# to the topics of handlers, then polls the client with check_msg() every mqtt_poll_ms, so the lamps never
+# wait on the broker. A message is handed to the handler of its topic, handler(topic, msg). A lost connection
+# is dropped and made again mqtt_retry seconds later instead of resetting the board, the lamps keep running.
+# Every mqtt_hello_interval seconds 'Hello #n' is published on HELLO_TOPIC, as the Rpi expects.
+
+from binascii import hexlify
+import uasyncio as asyncio
+from utime import ticks_diff, ticks_ms
+
+from config import SETTINGS
+
+HELLO_TOPIC = b'hello Rpi, how are you doing'
+REPLY_TOPIC = b'lighttime'
+
+
+def client_id():
+    import machine
+    return hexlify(machine.unique_id())
+
+
+class MqttLink(object):
+    """ MQTT client of the controller.
+    Attributes:
+        handlers (dict): topic -> handler(topic, msg).
+        client (MQTTClient): The connected client, None while disconnected.
+        connects (int): Connections made so far.
+    """
+
+    def __init__(self, handlers, log):
+        self.handlers = handlers
+        self.log = log
+        self.client = None
+        self.connects = 0
+        self._hello = 0
+        self._task = asyncio.create_task(self._run())
+
+    def on_message(self, topic, msg):
+        handler = self.handlers.get(topic)
+        if handler is not None:
+            handler(topic, msg)
+        elif topic == REPLY_TOPIC and msg == b'received':
+            self.log.info("Rpi received the hello message")
+
+    def publish(self, topic, msg):
+        if self.client is None:
+            return False
+        try:
+            self.client.publish(topic, msg)
+        except OSError as e:
+            self._drop(e)
+            return False
+        return True
+
+    def connect(self):
+        '''Connects and subscribes, blocks for the TCP and MQTT handshakes'''
+        from umqttsimple import MQTTClient
+        client = MQTTClient(client_id(), SETTINGS['mqtt_server'])
+        client.set_callback(self.on_message)
+        client.connect()
+        client.subscribe(REPLY_TOPIC)
+        for topic in self.handlers:
+            client.subscribe(topic)
+        self.client = client
+        self.connects += 1
+        self.log.info("Connected to MQTT broker {}, {} topics".format(SETTINGS['mqtt_server'], len(self.handlers) + 1))
+
+    def _drop(self, e):
+        self.log.error("MQTT connection lost: {}".format(repr(e)))
+        try:
+            self.client.disconnect()
+        except (OSError, AttributeError):
+            pass
+        self.client = None
+
+    async def _run(self):
+        import network
+        station = network.WLAN(network.STA_IF)
+        last_hello = ticks_ms()
+        while True:
+            if self.client is None:
+                if not station.isconnected():
+                    await asyncio.sleep_ms(500)
+                    continue
+                try:
+                    self.connect()
+                except OSError as e:
+                    self.log.error("MQTT connect to {} failed: {}".format(SETTINGS['mqtt_server'], repr(e)))
+                    await asyncio.sleep(SETTINGS['mqtt_retry'])
+                    continue
+            try:
+                self.client.check_msg()
+            except OSError as e:
+                self._drop(e)
+                await asyncio.sleep(SETTINGS['mqtt_retry'])
+                continue
+            if ticks_diff(ticks_ms(), last_hello) >= SETTINGS['mqtt_hello_interval'] * 1000:
+                last_hello = ticks_ms()
+                self.publish(HELLO_TOPIC, b'Hello #%d' % self._hello)
+                self._hello += 1
+            await asyncio.sleep_ms(SETTINGS['mqtt_poll_ms'])
@@ -0,0 +1,63 @@
+""" Packs validated scenario sets into scenarios_packed.py, which config.py then reads through scenario_blob.py.
+
+    python pack_scenarios.py [--plan NAME=FILE ...] [--out FILE]
+
+The first plan is SCENARIOS of config.py, named 'default'. Every --plan adds the 'scenarios' of a JSON plan file
+as published to a controller (see plans.py). Freeze scenarios_packed.py into the firmware with manifest.py so the
+blob stays in flash; a copied .py or .mpy file is loaded into RAM.
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import scenario_blob
+
+
+def config_scenarios():
+    '''SCENARIOS as written in config.py, not an earlier scenarios_packed.py'''
+    sys.modules['scenarios_packed'] = None # makes the import in config.py fail
+    import config
+    return config.SCENARIOS
+
+
+def file_scenarios(path):
+    with open(path) as f:
+        return OrderedDict((slot, value) for slot, value in json.load(f)['scenarios'])
+
+
+def write(plans, out):
+    blob = scenario_blob.pack(plans)
+    with open(out, 'w') as f:
+        f.write('# Generated by pack_scenarios.py, do not edit\n')
+        f.write('BLOB = %r\n' % blob)
+    return blob
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--plan', action='append', default=[], metavar='NAME=FILE', help='JSON plan to add')
+    parser.add_argument('--out', default=os.path.join(HERE, 'scenarios_packed.py'), help='module to write')
+    args = parser.parse_args()
+    plans = [('default', config_scenarios())]
+    for plan in args.plan:
+        name, _, path = plan.partition('=')
+        if not path:
+            sys.exit('--plan takes NAME=FILE, got %s' % plan)
+        plans.append((name, file_scenarios(path)))
+    try:
+        blob = write(plans, args.out)
+    except ValueError as e:
+        sys.exit('Not packed: %s' % e)
+    approaches = sum(len(value) if isinstance(value, list) else 1 for _, scenarios in plans
+                     for value in scenarios.values())
+    print('%d plans, %d approaches -> %s (%d bytes)' % (len(plans), approaches, args.out, len(blob)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# plans.py Runtime updates of SCENARIOS and SETTINGS without a reflash
+# Usage:
+# loader = PlanLoader(fsm, log)       # StateMachine creates one as fsm.plan_loader
+# client.set_callback(loader.on_message)  # JSON plan published on PLAN_TOPIC
+# loader.load_file('new_plan.json')   # or a JSON plan copied to the flash
+#
+# A plan is a JSON object with 'scenarios' and/or 'settings':
+#   {"scenarios": [[1, [{"name": "North", "bulbs": 3, "states": [...], "initial": "Green", "status": "On"}, ...]],
+#                  [2, {...}], ...],
+#    "settings": {"fixed_green_time": 25, ...}}
+# scenarios is a list of [slot, approach or list of approaches] pairs, as SCENARIOS is ordered. A missing part
+# keeps the running one, settings only name the keys they change.
+# The plan is validated and compiled into models, slots and transitions by a uasyncio task while the running
+# plan goes on. The machine swaps it in at the end of the next phase without a green, through all-red, and
+# restarts from its first slot (see StateMachine._swap_plan). The accepted plan is kept in PLAN_FILE and
+# used again after a reset.
+
+import gc
+from collections import OrderedDict
+import uasyncio as asyncio
+from utime import ticks_diff, ticks_ms
+try:
+    import ujson as json
+except ImportError:
+    import json
+try:
+    from gc import mem_alloc
+except ImportError:
+    def mem_alloc():
+        return 0
+
+from config import SETTINGS
+from scenario_blob import validate_scenarios
+
+PLAN_TOPIC = b'plan'
+PLAN_FILE = 'plan.json'
+
+
+def decode(raw, scenarios):
+    '''Returns (scenarios, settings) of a JSON plan. scenarios is the running set, kept if the plan has none'''
+    plan = json.loads(raw)
+    if not isinstance(plan, dict):
+        raise ValueError("A plan is a JSON object")
+    if 'scenarios' in plan:
+        if not isinstance(plan['scenarios'], list):
+            raise ValueError("scenarios must be a list of [slot, approaches] pairs")
+        try:
+            scenarios = OrderedDict((slot, value) for slot, value in plan['scenarios'])
+        except (TypeError, ValueError):
+            raise ValueError("scenarios must be a list of [slot, approaches] pairs")
+    settings = plan.get('settings', {})
+    if not isinstance(settings, dict):
+        raise ValueError("settings must be a JSON object")
+    return scenarios, settings
+
+
+def validate_settings(settings):
+    '''Raises ValueError unless every key is a known setting and its value has the type of the running one'''
+    for key, value in settings.items():
+        if key not in SETTINGS:
+            raise ValueError("Unknown setting {}".format(key))
+        current = SETTINGS[key]
+        if isinstance(current, bool):
+            if not isinstance(value, bool):
+                raise ValueError("Setting {} must be true or false".format(key))
+        elif isinstance(current, (int, float)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError("Setting {} must be a number >= 0".format(key))
+        elif value is not None and current is not None and not isinstance(value, type(current)):
+            raise ValueError("Setting {} must be a {}".format(key, type(current).__name__))
+
+
+def saved(scenarios):
+    '''(scenarios, settings) of the plan accepted before the last reset, None if there is no usable one'''
+    try:
+        with open(PLAN_FILE) as f:
+            raw = f.read()
+    except OSError:
+        return None
+    try:
+        scenarios, settings = decode(raw, scenarios)
+        validate_scenarios(scenarios)
+        validate_settings(settings)
+    except ValueError:
+        return None
+    return scenarios, settings
+
+
+class PlanLoader(object):
+    """ Takes plan updates from MQTT or a file and stages them on the machine.
+    Attributes:
+        swap_us (int): µs the last swap held the machine, from the end of the yellow to the new all-red.
+        wait_ms (int): ms from the last plan being staged to its swap.
+        high_water (int): Most heap bytes the last reload had allocated on top of the running plan, sampled
+            after each build step. 0 where gc.mem_alloc is not available.
+        error (str): Why the last plan was rejected, None if it was accepted.
+    """
+
+    def __init__(self, machine, log):
+        self.machine = machine
+        self.log = log
+        self.swap_us = None
+        self.wait_ms = None
+        self.high_water = None
+        self._base = 0
+        self.error = None
+        self.settings = {} # settings changed by plans, on top of config.py
+        self.staged_at = None
+        self._raw = None
+        self._flag = asyncio.ThreadSafeFlag()
+        self._task = asyncio.create_task(self._run())
+
+    def on_message(self, topic, msg):
+        '''MQTT callback. The message is a JSON plan'''
+        if topic != PLAN_TOPIC:
+            return
+        self._raw = msg
+        self._flag.set()
+
+    def load_file(self, file_name):
+        with open(file_name) as f:
+            self._raw = f.read()
+        self._flag.set()
+
+    async def _run(self):
+        while True:
+            await self._flag.wait()
+            raw, self._raw = self._raw, None
+            if raw is not None:
+                await self._load(raw)
+
+    async def _load(self, raw):
+        machine = self.machine
+        gc.collect()
+        self._base = mem_alloc()
+        self.high_water = 0
+        start = ticks_ms()
+        try:
+            scenarios, settings = decode(raw, machine.scenarios)
+            self._sample()
+            validate_scenarios(scenarios)
+            validate_settings(settings)
+            self._sample()
+            await asyncio.sleep_ms(0)
+            plan = await machine.compile_plan(scenarios, self._sample)
+        except ValueError as e:
+            self.error = str(e)
+            self.log.error("Plan rejected: {}".format(e))
+            return
+        self._sample()
+        self.error = None
+        self.settings.update(settings)
+        self.save(scenarios)
+        machine.pending_plan = (plan, settings)
+        self.staged_at = ticks_ms()
+        self.log.info("Plan {:08x} compiled in {} ms, {} bytes, waiting for the next clearance".format(
+                      plan.plan_version, ticks_diff(self.staged_at, start), self.high_water))
+
+    def _sample(self):
+        # a collection between two samples can hide a peak, so this is a lower bound of the real one
+        self.high_water = max(self.high_water, mem_alloc() - self._base)
+
+    def save(self, scenarios):
+        '''Keeps scenarios and every setting changed since the firmware's config.py in PLAN_FILE'''
+        # dict() also copies the approaches of a packed scenario set (see scenario_blob.py)
+        scenarios = [[slot, [dict(val.items()) for val in value] if isinstance(value, list) else dict(value.items())]
+                     for slot, value in scenarios.items()]
+        try:
+            with open(PLAN_FILE, 'w') as f:
+                json.dump({'scenarios': scenarios, 'settings': self.settings}, f)
+        except OSError as e:
+            self.log.error("Plan not saved, a reset goes back to the previous one: {}".format(e))
@@ -0,0 +1,30 @@
+# profiler.py Boot-phase timing
+# Usage:
+# import profiler
+# profiler.mark('imports')  # end of a phase, in ms after reset
+# profiler.report(log)      # one line per phase once the first lamp is on
+#
+# ticks_ms counts from reset on the ESP32, so the first phase also covers the interpreter start and boot.py.
+
+from utime import ticks_diff, ticks_ms
+
+marks = []
+
+
+def mark(phase):
+    marks.append((phase, ticks_ms()))
+
+
+def phases():
+    '''List of (phase, ms it took, ms after reset at its end)'''
+    result = []
+    last = 0
+    for phase, at in marks:
+        result.append((phase, ticks_diff(at, last), at))
+        last = at
+    return result
+
+
+def report(log):
+    for phase, took, at in phases():
+        log.info("Startup {}: {} ms (at {} ms)".format(phase, took, at))
@@ -1,3 +1,15 @@
+try:
+    from utime import ticks_diff, ticks_ms
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(new, old):
+        return new - old
+
+
 class State(object):
     """A persistent representation of a state managed by a ``Machine``.
     Attributes:
@@ -33,6 +45,8 @@ class State(object):
     @property
     def name(self):
         """ The name of the state. """
+        if type(self._name) is str:  # isinstance(name, Enum) allocates in EnumMeta.__instancecheck__
+            return self._name
         if isinstance(self._name, Enum):
             return self._name.name
         return self._name
@@ -68,6 +82,251 @@ class State(object):
         return "<%s('%s')@%s>" % (type(self).__name__, self.name, id(self))
 
 
+# shared, read-only kwargs of pooled EventData instances for argument-less triggers
+_NO_KWARGS = {}
+
+# what TransitionQueue.append does when the queue is full
+OVERFLOW_REJECT = 'reject'  # refuse the new trigger
+OVERFLOW_DROP_OLDEST = 'drop_oldest'  # discard the oldest pending trigger
+OVERFLOW_COALESCE = 'coalesce'  # merge with an identical pending trigger, refuse otherwise
+
+
+class TransitionQueue(object):
+    """ Fixed-capacity ring buffer of triggers queued on a ``Machine``. All slots are allocated up front so
+    a trigger storm cannot grow the heap.
+    Attributes:
+        capacity (int): Maximum number of queued triggers, including the one currently executed.
+        overflow (str): OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST or OVERFLOW_COALESCE.
+        high_water (int): Largest queue depth seen so far.
+        dropped (int): Pending triggers discarded to make room for new ones.
+        coalesced (int): Triggers merged into an identical pending trigger.
+        rejected (int): Triggers refused because the queue was full.
+    """
+
+    def __init__(self, capacity=32, overflow=OVERFLOW_REJECT):
+        if capacity < 1:
+            raise ValueError("Queue capacity must be at least 1.")
+        if overflow not in (OVERFLOW_REJECT, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE):
+            raise ValueError("Unknown overflow policy '%s'." % overflow)
+        self.capacity = capacity
+        self.overflow = overflow
+        self._items = [None] * capacity
+        self._head = 0
+        self._len = 0
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        return self._items[(self._head + index) % self.capacity]
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._items[(self._head + i) % self.capacity]
+
+    def append(self, item, skip_head=False):
+        """ Queue item according to the overflow policy.
+        Args:
+            item (callable): The trigger to queue.
+            skip_head (bool): True if the first entry is being executed and must not be dropped or merged.
+        Returns:
+            bool: False if item has been refused.
+        """
+        first = 1 if skip_head else 0
+        if self.overflow == OVERFLOW_COALESCE:
+            for i in range(first, self._len):
+                if _same_trigger(self._items[(self._head + i) % self.capacity], item):
+                    self.coalesced += 1
+                    return True
+        if self._len == self.capacity:
+            if self.overflow != OVERFLOW_DROP_OLDEST or self._len <= first:
+                self.rejected += 1
+                return False
+            self._remove_at(first)
+            self.dropped += 1
+        self._items[(self._head + self._len) % self.capacity] = item
+        self._len += 1
+        if self._len > self.high_water:
+            self.high_water = self._len
+        return True
+
+    def extend(self, items):
+        """ Queue every item of items, as append does. """
+        for item in items:
+            self.append(item)
+
+    def popleft(self):
+        """ Remove and return the oldest trigger. """
+        if not self._len:
+            raise IndexError("pop from an empty queue")
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._len -= 1
+        return item
+
+    def clear(self):
+        for i in range(self.capacity):
+            self._items[i] = None
+        self._head = 0
+        self._len = 0
+
+    def retain(self, predicate, keep_head=False):
+        """ Drop all triggers for which predicate returns False. The first entry is kept if keep_head is set. """
+        i = 1 if keep_head else 0
+        while i < self._len:
+            if predicate(self._items[(self._head + i) % self.capacity]):
+                i += 1
+            else:
+                self._remove_at(i)
+
+    def _remove_at(self, index):
+        for i in range(index, self._len - 1):
+            self._items[(self._head + i) % self.capacity] = self._items[(self._head + i + 1) % self.capacity]
+        self._items[(self._head + self._len - 1) % self.capacity] = None
+        self._len -= 1
+
+
+def _same_trigger(queued, trigger):
+    # queued triggers are partials of Event._trigger on an EventData of their own; identical means same event,
+    # model and arguments
+    try:
+        old, new = queued.args[0], trigger.args[0]
+        return queued.func == trigger.func and old.event is new.event and old.model is new.model \
+            and old.args == new.args and old.kwargs == new.kwargs
+    except (AttributeError, IndexError):
+        return queued is trigger
+
+
+class AutoTransitions(defaultdict):
+    """ Event.transitions of an auto trigger ('to_<state>') whose transitions are created lazily (see
+    Machine.add_states). Looking up a source creates the transition leaving it, reading the whole mapping
+    creates all of them, so code inspecting the event sees every transition as if it had been added eagerly.
+    Attributes:
+        machine (Machine): The machine owning the trigger.
+        trigger (str): Name of the auto trigger.
+    """
+
+    def __init__(self, machine, trigger):
+        super(AutoTransitions, self).__init__(list)
+        self.machine = machine
+        self.trigger = trigger
+
+    def __getitem__(self, source):
+        self.machine._materialize_auto(self.trigger, source)
+        return defaultdict.__getitem__(self, source)
+
+    def __contains__(self, source):
+        self.machine._materialize_auto(self.trigger, source)
+        return dict.__contains__(self, source)
+
+    def get(self, source, default=None):
+        self.machine._materialize_auto(self.trigger, source)
+        return dict.get(self, source, default)
+
+    def __iter__(self):
+        self.machine._materialize_auto(self.trigger)
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.machine._materialize_auto(self.trigger)
+        return dict.__len__(self)
+
+    def keys(self):
+        self.machine._materialize_auto(self.trigger)
+        return dict.keys(self)
+
+    def values(self):
+        self.machine._materialize_auto(self.trigger)
+        return dict.values(self)
+
+    def items(self):
+        self.machine._materialize_auto(self.trigger)
+        return dict.items(self)
+
+    def __reduce__(self):
+        return type(self), (self.machine, self.trigger), None, None, iter(dict.items(self))
+
+
+# class attribute marking the classes a machine serves its models' convenience methods on, see Machine.model_class
+SERVED_BY = '_transition_machine'
+
+
+class ModelMethod(object):
+    """ Class level descriptor serving a convenience method (trigger, may_<trigger>, is_<state>) to the models of
+    one machine. It sits on the subclass the machine made of the models' class (see Machine.model_class), so a
+    model takes no memory for the methods of its machine: each access binds func to the model, the way a
+    method is bound, and nothing is stored on the model.
+    Attributes:
+        func (callable): Called with the model as first argument.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return partial(self.func, obj)
+
+
+class _ServedClasses(dict):
+    """ Model class -> the class a machine serves it on. The classes are made at run time and can't be pickled,
+        so the map pickles empty and served models are moved again when they are unpickled.
+    """
+
+    def __reduce__(self):
+        return type(self), ()
+
+
+def _reduce_served_model(self, protocol):
+    """ __reduce_ex__ of the classes made by Machine.model_class: a model is pickled as an instance of the
+        class it was made from, along with the machines serving it, which move it back in _restore_model.
+    """
+    cls = type(self)
+    base = cls
+    machines = []
+    while SERVED_BY in vars(base):
+        machines.insert(0, vars(base)[SERVED_BY])
+        base = base.__bases__[0]
+    reduced = base.__reduce_ex__(self, protocol)
+    if not isinstance(reduced, tuple):
+        return reduced
+    func, args = reduced[0], tuple(base if arg is cls else arg for arg in reduced[1])
+    if getattr(func, '__name__', None) == '__newobj__':  # it insists on args[0] being the class of self
+        func = _new_model
+    rest = reduced[2:] + (None,) * (5 - len(reduced))
+    return (func, args, (rest[0], machines)) + rest[1:3] + (_restore_model,)
+
+
+def _new_model(cls, *args):
+    return cls.__new__(cls, *args)
+
+
+def _restore_model(model, state):
+    state, machines = state
+    if isinstance(state, tuple):  # (__dict__, slots) of classes with __slots__
+        state, slots = state
+        for name, value in (slots or {}).items():
+            setattr(model, name, value)
+    setstate = getattr(model, '__setstate__', None)
+    if setstate is not None and state is not None:
+        setstate(state)
+    elif state:
+        model.__dict__.update(state)
+    for machine in machines:
+        if '_model_classes' in vars(machine) and machine._register_model(model):  # else its __setstate__ does it
+            machine._serve_model(model)
+
 
 class Machine(object):
     """ Machine manages states, transitions and models. In case it is initialized without a specific model
@@ -103,6 +362,7 @@ class Machine(object):
     state_cls = State
     transition_cls = Transition
     event_cls = Event
+    model_method_cls = ModelMethod
     self_literal = 'self'
 
     def __init__(self, model=self_literal, states=None, initial='initial', transitions=None,
@@ -110,7 +370,7 @@ class Machine(object):
                  ordered_transitions=False, ignore_invalid_triggers=None,
                  before_state_change=None, after_state_change=None, name=None,
                  queued=False, prepare_event=None, finalize_event=None, model_attribute='state', on_exception=None,
-                 **kwargs):
+                 queue_capacity=32, queue_overflow=OVERFLOW_REJECT, drain_budget_ms=None, **kwargs):
         """
         Args:
             model (object or list): The object(s) whose states we want to manage. If set to `Machine.self_literal`
@@ -150,6 +410,12 @@ class Machine(object):
                 executed in a state callback function will be queued and executed later.
                 Due to the nature of the queued processing, all transitions will
                 _always_ return True since conditional checks cannot be conducted at queueing time.
+                A trigger refused by a full queue returns False.
+            queue_capacity (int): Number of slots preallocated for queued triggers.
+            queue_overflow (str): Policy applied when the queue is full: OVERFLOW_REJECT (default),
+                OVERFLOW_DROP_OLDEST or OVERFLOW_COALESCE (identical pending triggers are merged).
+            drain_budget_ms (int): If set, queued triggers are processed until this many milliseconds have
+                passed; the remainder is left for the next call to drain().
             prepare_event: A callable called on for before possible transitions will be processed.
                 It receives the very same args as normal callbacks.
             finalize_event: A callable called on for each triggered event after transitions have been processed.
@@ -168,13 +434,32 @@ class Machine(object):
 
         # initialize protected attributes first
         self._queued = queued
-        self._transition_queue = deque()
+        self._transition_queue = TransitionQueue(queue_capacity, queue_overflow)
+        self._draining = False
+        self.drain_budget_ms = drain_budget_ms
         self._before_state_change = []
         self._after_state_change = []
         self._prepare_event = []
         self._finalize_event = []
         self._on_exception = []
         self._initial = None
+        # (source, trigger) -> (all transitions, transitions with a registered dest)
+        self._transition_index = {}
+        # source -> OrderedDict of triggers leaving that source
+        self._source_triggers = {}
+        # dest name -> set of (source, trigger) keys waiting for dest to be added
+        self._unresolved = {}
+        # model -> {callback name: (class attribute, callable)}, see _cached_callable
+        self._callable_cache = {}
+        # auto trigger -> dest name; lazy auto trigger -> set of sources already materialized;
+        # auto triggers that have been frozen into regular triggers
+        self._auto_dests = {}
+        self._lazy_auto = {}
+        self._frozen_auto = []
+        # released EventData instances, see _acquire_event_data; states and transitions of other classes than
+        # State and Transition (e.g. Timeout) may keep the EventData they are given, which is never pooled then
+        self._event_data_pool = []
+        self._keeps_event_data = self.transition_cls is not Transition
 
         self.states = OrderedDict()
         self.events = {}
@@ -190,6 +475,8 @@ class Machine(object):
         self.model_attribute = model_attribute
 
         self.models = []
+        # model class -> the subclass of it this machine serves convenience methods on, see model_class
+        self._model_classes = _ServedClasses()
 
         if states is not None:
             self.add_states(states)
@@ -218,29 +505,37 @@ class Machine(object):
         for mod in models:
             mod = self if mod is self.self_literal else mod
             if mod not in self.models:
-                self._checked_assignment(mod, 'trigger', partial(self._get_trigger, mod))#set trigger attr of mod and set its value to _get_trigger
+                self._serve_model(mod)
+                self.set_state(initial, model=mod)
+                self.models.append(mod)
+                self._bind_callables(mod)
 
-                for trigger in self.events:
-                    self._add_trigger_to_model(trigger, mod)
+    def _serve_model(self, model):
+        """ Give model the convenience methods of the machine's events and states. """
+        self._register_model(model)
+        self._shared_assignment(model, 'trigger', self._get_trigger)#serve model.trigger from _get_trigger
 
-                for state in self.states.values():
-                    self._add_model_to_state(state, mod)
+        for trigger in self.events:
+            self._add_trigger_to_model(trigger, model)
 
-                self.set_state(initial, model=mod)
-                self.models.append(mod)
+        for state in self.states.values():
+            self._add_model_to_state(state, model)
 
     def remove_model(self, model):
-        """ Remove a model from the state machine. The model will still contain all previously added triggers
-        and callbacks, but will not receive updates when states or transitions are added to the Machine.
+        """ Remove a model from the state machine. The model's callbacks and convenience methods remain untouched.
         If an event queue is used, all queued events of that model will be removed."""
         models = listify(model)
 
         for mod in models:
             self.models.remove(mod)
+            try:
+                self._callable_cache.pop(mod, None)
+            except TypeError:  # unhashable models are not cached
+                pass
         if len(self._transition_queue) > 0:
-            # the first element of the list is currently executed. Keeping it for further Machine._process(ing)
-            self._transition_queue = deque(
-                [self._transition_queue[0]] + [e for e in self._transition_queue if e.args[0].model not in models])
+            # the first element of the queue is currently executed while draining. Keeping it for further
+            # Machine._process(ing)
+            self._transition_queue.retain(lambda e: e.args[0].model not in models, keep_head=self._draining)
 
     @classmethod
     def _create_transition(cls, *args, **kwargs):
@@ -278,6 +573,18 @@ class Machine(object):
         """ Return boolean indicating if machine has queue or not """
         return self._queued
 
+    @property
+    def queue_depth(self):
+        """ Number of triggers waiting in the transition queue, including the one being executed. """
+        return len(self._transition_queue)
+
+    @property
+    def queue_stats(self):
+        """ Depth, high water mark and overflow counters of the transition queue. """
+        queue = self._transition_queue
+        return {'depth': len(queue), 'capacity': queue.capacity, 'high_water': queue.high_water,
+                'dropped': queue.dropped, 'coalesced': queue.coalesced, 'rejected': queue.rejected}
+
     @property
     def model(self):
         """ List of models attached to the machine. For backwards compatibility, the property will
@@ -343,7 +650,7 @@ class Machine(object):
 
     def get_state(self, state):
         """ Return the State instance with the passed name. """
-        if isinstance(state, Enum):
+        if type(state) is not str and isinstance(state, Enum):
             state = state.name
         if state not in self.states:
             raise ValueError("State '%s' is not a registered state." % state)
@@ -353,7 +660,7 @@ class Machine(object):
     # pickling down the chain.
     def is_state(self, state, model):
         """ Check whether the current state matches the named state. This function is not called directly
-            but assigned as partials to model instances (e.g. is_A -> partial(_is_state, 'A', model)).
+            but served to model instances by a ModelMethod (e.g. is_A -> partial(is_state, 'A')(model)).
         Args:
             state (str or Enum): name of the checked state or Enum
             model: model to be checked
@@ -381,7 +688,10 @@ class Machine(object):
         """
         if not isinstance(state, State):
             state = self.get_state(state)
-        models = self.models if model is None else listify(model)
+        if model is not None and not isinstance(model, (list, tuple)):
+            setattr(model, self.model_attribute, state.value)
+            return
+        models = self.models if model is None else model
 
         for mod in models:
             setattr(mod, self.model_attribute, state.value)
@@ -429,37 +739,59 @@ class Machine(object):
                     state['ignore_invalid_triggers'] = ignore
                 state = self._create_state(**state)
             self.states[state.name] = state
+            if type(state) is not State:
+                self._keeps_event_data = True
+            for source, trigger in self._unresolved.pop(state.name, ()):
+                self._index_transitions(trigger, source)
             for model in self.models:
                 self._add_model_to_state(state, model)
             if self.auto_transitions:
-                for a_state in self.states.keys():
-                    # add all states as sources to auto transitions 'to_<state>' with dest <state>
-                    if a_state == state.name:
-                        if self.model_attribute == 'state':
-                            method_name = 'to_%s' % a_state
-                        else:
-                            method_name = 'to_%s_%s' % (self.model_attribute, a_state)
-                        self.add_transition(method_name, self.wildcard_all, a_state)
-
-                    # add auto transition with source <state> to <a_state>
-                    else:
-                        if self.model_attribute == 'state':
-                            method_name = 'to_%s' % a_state
-                        else:
-                            method_name = 'to_%s_%s' % (self.model_attribute, a_state)
+                # auto transitions that are no longer lazy (see _freeze_auto) get <state> as source right away
+                for method_name in self._frozen_auto:
+                    a_state = self._auto_dests[method_name]
+                    if a_state != state.name:
                         self.add_transition(method_name, state.name, a_state)
 
+                # 'to_<state>' from every state is only created when it is first used
+                if self.model_attribute == 'state':
+                    method_name = 'to_%s' % state.name
+                else:
+                    method_name = 'to_%s_%s' % (self.model_attribute, state.name)
+                if method_name not in self._auto_dests:
+                    self._auto_dests[method_name] = state.name
+                    self._lazy_auto[method_name] = set()
+                    self._add_event(method_name)
+                    self.events[method_name].transitions = AutoTransitions(self, method_name)
+
+    def _materialize_auto(self, trigger, source=None):
+        """ Create the pending auto transition of trigger leaving source (from all states if None). """
+        done = self._lazy_auto.get(trigger)
+        if done is None or source in done:
+            return
+        dest = self._auto_dests[trigger]
+        for state in list(self.states) if source is None else (source, ):
+            if state not in done and state in self.states:
+                done.add(state)
+                self.events[trigger].add_transition(self._create_transition(state, dest))
+                self._index_transitions(trigger, state)
+
+    def _freeze_auto(self, trigger):
+        """ Materialize every transition of a lazy auto trigger and treat it as a regular trigger from now on. """
+        if trigger in self._lazy_auto:
+            self._materialize_auto(trigger)
+            del self._lazy_auto[trigger]
+            self._frozen_auto.append(trigger)
+
     def _add_model_to_state(self, state, model):
         # Add convenience function 'is_<state_name>' (e.g. 'is_A') to the model.
         # When model_attribute has been customized, add 'is_<model_attribute>_<state_name>' instead
         # to potentially support multiple states on one model (e.g. 'is_custom_state_A' and 'is_my_state_B').
 
-        func = partial(self.is_state, state.value, model)
         if self.model_attribute == 'state':
             method_name = 'is_%s' % state.name
         else:
             method_name = 'is_%s_%s' % (self.model_attribute, state.name)
-        self._checked_assignment(model, method_name, func)
+        self._shared_assignment(model, method_name, partial(self.is_state, state.value))
 
         # Add dynamic method callbacks (enter/exit) if there are existing bound methods in the model
         # except if they are already mentioned in 'on_enter/exit' of the defined state
@@ -475,31 +807,249 @@ class Machine(object):
         else:
             setattr(model, name, func)
 
+    def model_class(self, cls):
+        """ Return the subclass of cls this machine serves the convenience methods of its models on, made on
+            first use. Instances of it take no per-model memory for the triggers, may_<trigger> and is_<state>
+            methods of the machine, and cls itself is left untouched. add_model moves models of other classes
+            to it where the interpreter allows it (CPython); on MicroPython, instantiate it directly, e.g.
+            ``Lamp = machine.model_class(Lamp)``. Models that are not moved get one partial per method.
+        """
+        if vars(cls).get(SERVED_BY) is self:
+            return cls
+        served = self._model_classes.get(cls)
+        if served is None:
+            served = type(cls)(cls.__name__, (cls,), {'__slots__': (), SERVED_BY: self,
+                                                       '__reduce_ex__': _reduce_served_model})
+            served.__module__ = cls.__module__
+            self._model_classes[cls] = served
+        return served
+
+    def _register_model(self, model):
+        """ Move model to the class this machine serves its convenience methods on. False if it can't be. """
+        cls = type(model)
+        if vars(cls).get(SERVED_BY) is self:
+            return True
+        try:
+            model.__class__ = self.model_class(cls)
+        except (AttributeError, TypeError):
+            return False
+        return True
+
+    def _shared_assignment(self, model, name, func):
+        """ Serve name to model through a ModelMethod on its class, which _register_model made a class of this
+            machine. func is called with the model as first argument. Models of other classes get a partial.
+        """
+        cls = type(model)
+        if vars(cls).get(SERVED_BY) is not self:
+            self._checked_assignment(model, name, partial(func, model))
+            return
+        attrs = getattr(model, '__dict__', ())
+        if name not in attrs and name in vars(cls):  # served to another model of the class already
+            return
+        if hasattr(model, name):
+            _LOGGER.warning("%sModel already contains an attribute '%s'. Skip binding.", self.name, name)
+            return
+        setattr(cls, name, self.model_method_cls(func))
+
+    def _remove_from_models(self, name):
+        """ Stop serving name to the models of this machine. """
+        for served in self._model_classes.values():
+            if isinstance(vars(served).get(name), ModelMethod):
+                delattr(served, name)
+        for model in self.models:
+            try:
+                delattr(model, name)  # a per-model partial
+            except AttributeError:
+                pass
+
     def _can_trigger(self, model, trigger, *args, **kwargs):
-        evt = EventData(None, None, self, model, args, kwargs)
         state = self.get_model_state(model).name
+        if trigger in self._lazy_auto:
+            self._materialize_auto(trigger, state)
+        try:
+            transitions = self._transition_index[(state, trigger)][1]
+        except KeyError:
+            return False
+        if not transitions:
+            return False
 
-        for trigger_name in self.get_triggers(state):
-            if trigger_name != trigger:
-                continue
-            for transition in self.events[trigger_name].transitions[state]:
-                try:
-                    _ = self.get_state(transition.dest)
-                except ValueError:
-                    continue
+        evt = self._acquire_event_data(None, None, model, args, kwargs)
+        try:
+            for transition in transitions:
                 self.callbacks(self.prepare_event, evt)
                 self.callbacks(transition.prepare, evt)
-                if all(c.check(evt) for c in transition.conditions):
+                for cond in transition.conditions:
+                    if not cond.check(evt):
+                        break
+                else:
                     return True
-        return False
+            return False
+        finally:
+            self._release_event_data(evt)
+
+    def _acquire_event_data(self, state, event, model, args, kwargs):
+        """ Take an EventData from the machine's pool, or create one if the pool is empty. With send_event the
+            callbacks receive the EventData and may keep it, and so may states and transitions of other classes
+            than State and Transition, so a new one is created every time then.
+        """
+        if self.send_event or self._keeps_event_data or not self._event_data_pool:
+            return EventData(state, event, self, model, args, kwargs)
+        evt = self._event_data_pool.pop()
+        evt.state = state
+        evt.event = event
+        evt.model = model
+        evt.args = args
+        evt.kwargs = kwargs
+        return evt
+
+    def _release_event_data(self, evt):
+        """ Reset evt in place and return it to the pool, unless it may have been kept (see _acquire_event_data). """
+        if self.send_event or self._keeps_event_data:
+            return
+        evt.state = evt.event = evt.model = evt.transition = evt.error = None
+        evt.args = ()
+        evt.kwargs = _NO_KWARGS
+        evt.result = False
+        self._event_data_pool.append(evt)
+
+    def _index_transitions(self, trigger, source):
+        """ Rebuild the (source, trigger) lookup entry from the event's transition list.
+            Transitions whose destination is not (yet) a registered state are kept out of the
+            validated tuple and re-indexed once that state is added.
+        """
+        key = (source, trigger)
+        event = self.events.get(trigger)
+        transitions = tuple(event.transitions.get(source, ())) if event is not None else ()
+        if not transitions:
+            self._transition_index.pop(key, None)
+            triggers = self._source_triggers.get(source)
+            if triggers is not None:
+                triggers.pop(trigger, None)
+                if not triggers:
+                    del self._source_triggers[source]
+            return
+        valid = []
+        for transition in transitions:
+            if transition.dest in self.states:
+                valid.append(transition)
+            elif transition.dest is not None:
+                self._unresolved.setdefault(transition.dest, set()).add(key)
+        self._transition_index[key] = (transitions, tuple(valid))
+        self._source_triggers.setdefault(source, OrderedDict())[trigger] = None
 
     def _add_may_transition_func_for_trigger(self, trigger, model):
-        self._checked_assignment(model, "may_%s" % trigger, partial(self._can_trigger, model, trigger))
+        self._shared_assignment(model, "may_%s" % trigger, partial(self._may_trigger, trigger))
 
     def _add_trigger_to_model(self, trigger, model):
-        self._checked_assignment(model, trigger, partial(self.events[trigger].trigger, model))
+        self._shared_assignment(model, trigger, partial(self._trigger_event, trigger))
         self._add_may_transition_func_for_trigger(trigger, model)
 
+    def _may_trigger(self, trigger, model, *args, **kwargs):
+        return self._can_trigger(model, trigger, *args, **kwargs)
+
+    def _trigger_event(self, trigger, model, *args, **kwargs):
+        """ Shared entry point of the model triggers. Lazy auto transitions are created on first use. """
+        state = self.get_model_state(model)
+        if trigger in self._lazy_auto:
+            self._materialize_auto(trigger, state.name)
+        event = self.events[trigger]
+        if args or kwargs or self._queued or type(event) is not Event:
+            return event.trigger(model, *args, **kwargs)
+        return self._trigger_fast(event, model, state)
+
+    def _trigger_fast(self, event, model, state):
+        """ Equivalent of Event.trigger for argument-less triggers on unqueued machines. Runs on a
+            pooled EventData instead of allocating a partial and an EventData per call.
+        """
+        if self._transition_queue:
+            raise MachineError("Attempt to process events synchronously while transition queue is not empty!")
+        return self._run_event(event, model, state, (), _NO_KWARGS)
+
+    def _reject_source(self, event, state):
+        """ Ignore or raise like Event.trigger for an event without transitions leaving state. """
+        msg = "%sCan't trigger event %s from state %s!" % (self.name, event.name, state.name)
+        ignore = state.ignore_invalid_triggers if state.ignore_invalid_triggers is not None \
+            else self.ignore_invalid_triggers
+        if ignore:
+            _LOGGER.warning(msg)
+            return
+        raise MachineError(msg)
+
+    def _run_event(self, event, model, state, args, kwargs, transitions=None):
+        """ Event._trigger for model in state, on a pooled EventData: an invalid source, prepare_event and the
+            transitions are handled by on_exception, finalize_event runs in any case and its errors are logged.
+            transitions are those of event leaving state if already looked up, False if there are none
+            (see batch_dispatch).
+        """
+        evt = self._acquire_event_data(state, event, model, args, kwargs)
+        try:
+            try:
+                if transitions is None:
+                    transitions = event.transitions.get(state.name, False)
+                if transitions is False:
+                    self._reject_source(event, state)
+                else:
+                    self.callbacks(self.prepare_event, evt)
+                    index = 0
+                    while index < len(transitions):  # iterating the list would allocate an iterator
+                        transition = evt.transition = transitions[index]
+                        if self._execute(transition, evt):
+                            evt.result = True
+                            break
+                        index += 1
+            except Exception as err:
+                evt.error = err
+                if self.on_exception:
+                    self.callbacks(self.on_exception, evt)
+                else:
+                    raise
+            finally:
+                try:
+                    self.callbacks(self.finalize_event, evt)
+                except Exception as err:
+                    _LOGGER.error("%sWhile executing finalize callbacks a %s occurred: %s.",
+                                  self.name, type(err).__name__, str(err))
+            return evt.result
+        finally:
+            self._release_event_data(evt)
+
+    def _execute(self, transition, evt):
+        """ Transition.execute for plain transitions, without the allocations of chaining callback lists and
+            binding the condition checks. Transitions of other classes execute themselves.
+        """
+        if type(transition) is not Transition:
+            return transition.execute(evt)
+        _LOGGER.debug("%sInitiating transition from state %s to state %s...", self.name, transition.source,
+                      transition.dest)
+        self.callbacks(transition.prepare, evt)
+        conditions = transition.conditions
+        index = 0
+        while index < len(conditions):
+            cond = conditions[index]
+            predicate = self._cached_callable(cond.func, evt.model)
+            if self.send_event:
+                passed = predicate(evt) == cond.target
+            else:
+                passed = predicate(*evt.args, **evt.kwargs) == cond.target
+            if not passed:
+                _LOGGER.debug("%sTransition condition failed: %s() does not return %s. Transition halted.",
+                              self.name, cond.func, cond.target)
+                return False
+            index += 1
+        self.callbacks(self.before_state_change, evt)
+        self.callbacks(transition.before, evt)
+        if transition.dest:  # None for internal transitions
+            transition._change_state(evt)
+        self.callbacks(transition.after, evt)
+        self.callbacks(self.after_state_change, evt)
+        return True
+
+    def _add_event(self, trigger):
+        if trigger not in self.events:
+            self.events[trigger] = self._create_event(trigger, self)
+            for model in self.models:
+                self._add_trigger_to_model(trigger, model)
+
     def _get_trigger(self, model, trigger_name, *args, **kwargs):
         """Convenience function added to the model to trigger events by name.
         Args:
@@ -519,6 +1069,8 @@ class Machine(object):
             if not ignore:
                 raise AttributeError("Do not know event named '%s'." % trigger_name)
             return False
+        if trigger_name in self._lazy_auto:
+            self._materialize_auto(trigger_name, self.get_model_state(model).name)
         return event.trigger(model, *args, **kwargs)
 
     def get_triggers(self, *args):
@@ -528,8 +1080,15 @@ class Machine(object):
         Returns:
             list of transition/trigger names.
         """
+        if len(args) == 1 and not self._lazy_auto:
+            state = args[0]
+            return list(self._source_triggers.get(state.name if hasattr(state, 'name') else state, ()))
         names = {state.name if hasattr(state, 'name') else state for state in args}
-        return [t for (t, ev) in self.events.items() if any(name in ev.transitions for name in names)]
+        # pending auto transitions leave every registered state
+        any_state = any(name in self.states for name in names)
+        return [t for t in self.events
+                if (any_state and t in self._lazy_auto) or
+                any(t in self._source_triggers.get(name, ()) for name in names)]
 
     def add_transition(self, trigger, source, dest, conditions=None,
                        unless=None, before=None, after=None, prepare=None, **kwargs):
@@ -563,10 +1122,7 @@ class Machine(object):
         """
         if trigger == self.model_attribute:
             raise ValueError("Trigger name cannot be same as model attribute name.")
-        if trigger not in self.events:
-            self.events[trigger] = self._create_event(trigger, self)
-            for model in self.models:
-                self._add_trigger_to_model(trigger, model)
+        self._add_event(trigger)
 
         if source == self.wildcard_all:
             source = list(self.states.keys())
@@ -577,6 +1133,9 @@ class Machine(object):
                       s for s in listify(source)]
 
         for state in source:
+            # keep the auto transition ahead of custom ones sharing its trigger, as if it was created eagerly
+            if trigger in self._lazy_auto:
+                self._materialize_auto(trigger, state)
             if dest == self.wildcard_same:
                 _dest = state
             elif dest is not None:
@@ -588,6 +1147,7 @@ class Machine(object):
             _trans = self._create_transition(state, _dest, conditions, unless, before,
                                              after, prepare, **kwargs)
             self.events[trigger].add_transition(_trans)
+            self._index_transitions(trigger, state)
 
     def add_transitions(self, transitions):
         """ Add several transitions.
@@ -681,19 +1241,31 @@ class Machine(object):
             source (str, Enum or State): Limits list to transitions from a certain state.
             dest (str, Enum or State): Limits list to transitions to a certain state.
         """
+        target_source = source.name if hasattr(source, 'name') else source if source != "*" else ""
+        target_dest = dest.name if hasattr(dest, 'name') else dest if dest != "*" else ""
+        if trigger and target_source:
+            if trigger in self._lazy_auto:
+                self._materialize_auto(trigger, target_source)
+            # direct hit on the (source, trigger) index
+            entry = self._transition_index.get((target_source, trigger))
+            if entry is None:
+                return []
+            return [transition for transition in entry[0]
+                    if not target_dest or transition.dest == target_dest]
         if trigger:
             try:
                 events = (self.events[trigger], )
             except KeyError:
                 return []
+            self._materialize_auto(trigger)
         else:
+            for lazy in self._lazy_auto:
+                self._materialize_auto(lazy)
             events = self.events.values()
         transitions = []
         for event in events:
             transitions.extend(
                 itertools.chain.from_iterable(event.transitions.values()))
-        target_source = source.name if hasattr(source, 'name') else source if source != "*" else ""
-        target_dest = dest.name if hasattr(dest, 'name') else dest if dest != "*" else ""
         return [transition
                 for transition in transitions
                 if (transition.source, transition.dest) == (target_source or transition.source,
@@ -706,6 +1278,7 @@ class Machine(object):
             source (str, Enum or State): Limits removal to transitions from a certain state.
             dest (str, Enum or State): Limits removal to transitions to a certain state.
         """
+        self._freeze_auto(trigger)
         source = listify(source) if source != "*" else source
         dest = listify(dest) if dest != "*" else dest
         # outer comprehension, keeps events if inner comprehension returns lists with length > 0
@@ -717,14 +1290,16 @@ class Machine(object):
                    # for the outer comprehension (see first line of comment)
                 for k, v in self.events[trigger].transitions.items()}.items()
                if len(value) > 0}
+        sources = list(self.events[trigger].transitions.keys())
         # convert dict back to defaultdict in case tmp is not empty
         if tmp:
             self.events[trigger].transitions = defaultdict(list, **tmp)
         # if no transition is left remove the trigger from the machine and all models
         else:
-            for model in self.models:
-                delattr(model, trigger)
+            self._remove_from_models(trigger)
             del self.events[trigger]
+        for state in sources:
+            self._index_transitions(trigger, state)
 
     def dispatch(self, trigger, *args, **kwargs):
         """ Trigger an event on all models assigned to the machine.
@@ -737,11 +1312,64 @@ class Machine(object):
         """
         return all(getattr(model, trigger)(*args, **kwargs) for model in self.models)
 
+    def batch_dispatch(self, trigger, *args, **kwargs):
+        """ Trigger an event on all models assigned to the machine, handling models that share a state
+            as one group: the state and the transitions leaving it are looked up once per group, then the
+            callbacks run for each model. Unlike dispatch, every model is triggered even if an earlier one
+            returned False. Queued machines and custom event classes fall back to one trigger call per model.
+        Args:
+            trigger (str): Event name
+            *args (list): List of arguments passed to the event trigger
+            **kwargs (dict): Dictionary of keyword arguments passed to the event trigger
+        Returns:
+            list: The trigger result of each model, in the order of Machine.models
+        """
+        event = self.events.get(trigger)
+        if event is None or self._queued or type(event) is not Event:
+            return [getattr(model, trigger)(*args, **kwargs) for model in self.models]
+        if self._transition_queue:
+            raise MachineError("Attempt to process events synchronously while transition queue is not empty!")
+
+        kwargs = kwargs or _NO_KWARGS
+        results = [False] * len(self.models)
+        models = list(self.models)
+        for value, indices in self._group_models().items():
+            state, transitions = self._group_transitions(event, value)
+            for index in indices:
+                model = models[index]
+                if getattr(model, self.model_attribute) != value:
+                    # moved by a callback of an earlier model; trigger it on its own
+                    results[index] = getattr(model, trigger)(*args, **kwargs)
+                else:
+                    results[index] = self._run_event(event, model, state, args, kwargs, transitions)
+        return results
+
+    def _group_models(self):
+        """ Return the indices of the models in Machine.models by state value. """
+        groups = OrderedDict()
+        for index, model in enumerate(self.models):
+            value = getattr(model, self.model_attribute)
+            group = groups.get(value)
+            if group is None:
+                group = groups[value] = []
+            group.append(index)
+        return groups
+
+    def _group_transitions(self, event, value):
+        """ Return the state of value and the transitions of event leaving it, False if there are none. """
+        state = self.get_state(value)
+        return state, event.transitions.get(state.name, False)
+
     def callbacks(self, funcs, event_data):
         """ Triggers a list of callbacks """
-        for func in funcs:
+        if type(funcs) is not list:
+            funcs = list(funcs)
+        index = 0
+        while index < len(funcs):  # iterating the list would allocate an iterator on every call
+            func = funcs[index]
             self.callback(func, event_data)
             _LOGGER.info("%sExecuted callback '%s'", self.name, func)
+            index += 1
 
     def callback(self, func, event_data):
         """ Trigger a callback function with passed event_data parameters. In case func is a string,
@@ -757,11 +1385,13 @@ class Machine(object):
                 from (if event sending is disabled).
         """
 
-        func = self.resolve_callable(func, event_data)
+        func = self._cached_callable(func, event_data.model)
         if self.send_event:
             func(event_data)
-        else:
+        elif event_data.args or event_data.kwargs:
             func(*event_data.args, **event_data.kwargs)
+        else:
+            func()
 
     @staticmethod
     def resolve_callable(func, event_data):
@@ -773,13 +1403,69 @@ class Machine(object):
         Returns:
             callable function resolved from string or func
         """
+        return Machine._lookup_callable(func, event_data.model)
+
+    def _cached_callable(self, func, model):
+        """ resolve_callable for the callbacks of this machine. A name is resolved once per model of the machine
+            and served again as long as the model's class holds the same attribute under that name. Names set on
+            the model itself are read from it every time, so reassigning them takes effect at once.
+        """
+        if not isinstance(func, string_types):
+            return func
+        attrs = getattr(model, '__dict__', None)
+        if attrs is not None and func in attrs:
+            return self._lookup_callable(func, model)
+        try:
+            cache = self._callable_cache.get(model)
+        except TypeError:  # unhashable model
+            cache = None
+        if cache is None:  # not a model of this machine
+            return self._lookup_callable(func, model)
+        source = getattr(type(model), func, None)
+        entry = cache.get(func)
+        if entry is not None and entry[0] is source:
+            return entry[1]
+        resolved = self._lookup_callable(func, model)
+        cache[func] = (source, resolved)
+        return resolved
+
+    def _bind_callables(self, model):
+        """ Resolve every callback name currently registered on the machine against model.
+            Names that cannot be resolved yet are left to _cached_callable on first use.
+        """
+        try:
+            bound = self._callable_cache[model] = {}
+        except TypeError:  # unhashable models are not cached
+            return
+        attrs = getattr(model, '__dict__', ())
+        cls = type(model)
+        names = itertools.chain(self.prepare_event, self.before_state_change, self.after_state_change,
+                                self.finalize_event, self.on_exception)
+        for state in self.states.values():
+            names = itertools.chain(names, state.on_enter, state.on_exit)
+        for event in self.events.values():
+            # dict.values: pending auto transitions have no callbacks, they are not created for this
+            for transition in itertools.chain.from_iterable(dict.values(event.transitions)):
+                names = itertools.chain(names, transition.prepare, transition.before, transition.after,
+                                        (cond.func for cond in transition.conditions))
+        for name in names:
+            if isinstance(name, string_types) and name not in bound and name not in attrs:
+                try:
+                    bound[name] = (getattr(cls, name, None), self._lookup_callable(name, model))
+                except AttributeError:
+                    continue
+
+    @staticmethod
+    def _lookup_callable(func, model):
+        """ Uncached resolution of a callback name against model, falling back to a module path. """
         if isinstance(func, string_types):
             try:
-                func = getattr(event_data.model, func)
-                if not callable(func):  # if a property or some other not callable attribute was passed
+                attr = getattr(model, func)
+                if not callable(attr):  # if a property or some other not callable attribute was passed
                     def func_wrapper(*_, **__):  # properties cannot process parameters
-                        return func
+                        return getattr(model, func)
                     return func_wrapper
+                return attr
             except AttributeError:
                 try:
                     module_name, func_name = func.rsplit('.', 1)
@@ -809,21 +1495,44 @@ class Machine(object):
             raise MachineError("Attempt to process events synchronously while transition queue is not empty!")
 
         # process queued events
-        self._transition_queue.append(trigger)
-        # another entry in the queue implies a running transition; skip immediate execution
-        if len(self._transition_queue) > 1:
-            return True
+        if not self._transition_queue.append(trigger, skip_head=self._draining):
+            _LOGGER.warning("%sTransition queue full (%d), trigger refused.", self.name, self._transition_queue.capacity)
+            return False
+        # a running transition will pick the trigger up; skip immediate execution
+        if not self._draining:
+            self.drain()
+        return True
 
-        # execute as long as transition queue is not empty
-        while self._transition_queue:
-            try:
+    def drain(self, budget_ms=None):
+        """ Execute queued triggers until the queue is empty or the time budget is spent.
+            Call it periodically (e.g. once per event loop iteration) when drain_budget_ms is set.
+        Args:
+            budget_ms (int): Overrides drain_budget_ms for this call if set.
+        Returns:
+            int: The number of triggers executed.
+        """
+        if self._draining:
+            return 0
+        if budget_ms is None:
+            budget_ms = self.drain_budget_ms
+        start = ticks_ms()
+        done = 0
+        self._draining = True
+        try:
+            # execute as long as transition queue is not empty
+            while self._transition_queue:
                 self._transition_queue[0]()
                 self._transition_queue.popleft()
-            except Exception:
-                # if a transition raises an exception, clear queue and delegate exception handling
-                self._transition_queue.clear()
-                raise
-        return True
+                done += 1
+                if budget_ms is not None and ticks_diff(ticks_ms(), start) >= budget_ms:
+                    break
+        except Exception:
+            # if a transition raises an exception, clear queue and delegate exception handling
+            self._transition_queue.clear()
+            raise
+        finally:
+            self._draining = False
+        return done
 
     def _identify_callback(self, name):
         # Does the prefix match a known callback?
@@ -843,6 +1552,22 @@ class Machine(object):
 
         return callback_type, target
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # resolved callables may be closures, which do not pickle; the cache is filled again on use
+        state['_callable_cache'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for model in self.models:
+            if self._register_model(model):
+                self._serve_model(model)
+            try:
+                self._callable_cache[model] = {}
+            except TypeError:
+                pass
+
     def __getattr__(self, name):
         # Machine.__dict__ does not contain double underscore variables.
         # Class variables will be mangled.
@@ -858,6 +1583,8 @@ class Machine(object):
                 if target not in self.events:
                     raise AttributeError("event '{}' is not registered on <Machine@{}>"
                                          .format(target, id(self)))
+                # callbacks have to reach every transition of the event, including pending auto ones
+                self._freeze_auto(target)
                 return partial(self.events[target].add_callback, callback_type)
 
             if callback_type in self.state_cls.dynamic_methods:
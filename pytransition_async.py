@@ -0,0 +1,400 @@
+""" Asynchronous variant of ``pytransition.Machine``.
+
+Conditions, prepare/before/after and on_enter/on_exit callbacks may be plain callables or coroutines.
+Triggers, may_<trigger> checks and ``dispatch`` return awaitables. With ``queued=True`` every model gets its
+own transition queue, so transitions of one model stay sequential while independent models progress
+concurrently. Runs on uasyncio (MicroPython) and asyncio (CPython).
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from collections import defaultdict
+from functools import partial
+
+from pytransition import Machine, MachineError, State
+
+
+async def _g():
+    pass
+_coro = _g()
+type_coro = type(_coro)
+_coro.close()
+
+
+def listify(obj):
+    """ Wraps a passed object into a list in case it is not a list or tuple already. """
+    if obj is None:
+        return []
+    return obj if isinstance(obj, (list, tuple)) else [obj]
+
+
+def is_awaitable(res):
+    """ True for coroutines (generators on MicroPython) and asyncio awaitables like tasks. """
+    return isinstance(res, type_coro) or hasattr(res, '__await__')
+
+
+class AsyncEventData(object):
+    """ Collection of relevant data related to the ongoing transition attempt.
+    Attributes:
+        state (AsyncState): The State from which the Event was triggered.
+        event (AsyncEvent): The triggering Event.
+        machine (AsyncMachine): The current Machine instance.
+        model (object): The model/object the machine is bound to.
+        args (list): Optional positional arguments from trigger method to store internally.
+        kwargs: Any keyword arguments passed to the trigger method.
+        transition (AsyncTransition): Currently active transition.
+        error (Exception): In case a triggered event causes an Error, it is assigned here.
+        result (bool): True in case a transition has been successful, False otherwise.
+    """
+
+    def __init__(self, state, event, machine, model, args, kwargs):
+        self.state = state
+        self.event = event
+        self.machine = machine
+        self.model = model
+        self.args = args
+        self.kwargs = kwargs
+        self.transition = None
+        self.error = None
+        self.result = False
+
+    def update(self, state):
+        """ Updates the AsyncState object of the passed model's current state. """
+        if not isinstance(state, self.machine.state_cls):
+            state = self.machine.get_state(state)
+        self.state = state
+
+
+class AsyncState(State):
+    """ A persistent representation of a state managed by an ``AsyncMachine``. Enter and exit callbacks
+    are awaited one after another.
+    """
+
+    async def enter(self, event_data):
+        """ Triggered when a state is entered. """
+        await event_data.machine.callbacks(self.on_enter, event_data)
+
+    async def exit(self, event_data):
+        """ Triggered when a state is exited. """
+        await event_data.machine.callbacks(self.on_exit, event_data)
+
+
+class AsyncCondition(object):
+    """ A helper class to await condition checks in the intended way.
+    Attributes:
+        func (str or callable): The function or coroutine function to call for the condition check
+        target (bool): Indicates the target state--i.e., when True,
+                the condition-checking callback should return True to pass,
+                and when False, the callback should return False to pass.
+    """
+
+    def __init__(self, func, target=True):
+        self.func = func
+        self.target = target
+
+    async def check(self, event_data):
+        """ Check whether the condition passes.
+        Args:
+            event_data (AsyncEventData): An AsyncEventData instance to pass to the
+                condition (if event sending is enabled) or to extract arguments
+                from (if event sending is disabled).
+        """
+        return await event_data.machine.callback(self.func, event_data) == self.target
+
+    def __repr__(self):
+        return "<%s(%s)@%s>" % (type(self).__name__, self.func, id(self))
+
+
+class AsyncTransition(object):
+    """ Representation of a transition managed by an ``AsyncMachine`` instance.
+    Attributes:
+        source (str): Source state of the transition.
+        dest (str): Destination state of the transition.
+        prepare (list): Callbacks executed before conditions checks.
+        conditions (list): Callbacks evaluated to determine if
+            the transition should be executed.
+        before (list): Callbacks executed before the transition is executed
+            but only if condition checks have been successful.
+        after (list): Callbacks executed after the transition is executed
+            but only if condition checks have been successful.
+    """
+
+    dynamic_methods = ['before', 'after', 'prepare']
+    condition_cls = AsyncCondition
+
+    def __init__(self, source, dest, conditions=None, unless=None, before=None,
+                 after=None, prepare=None):
+        self.source = source
+        self.dest = dest
+        self.prepare = listify(prepare)
+        self.before = listify(before)
+        self.after = listify(after)
+
+        self.conditions = []
+        for cond in listify(conditions):
+            self.conditions.append(self.condition_cls(cond))
+        for cond in listify(unless):
+            self.conditions.append(self.condition_cls(cond, target=False))
+
+    async def execute(self, event_data):
+        """ Execute the transition.
+        Args:
+            event_data: An instance of class AsyncEventData.
+        Returns: boolean indicating whether the transition was
+            successfully executed (True if successful, False if not).
+        """
+        machine = event_data.machine
+        await machine.callbacks(self.prepare, event_data)
+
+        for cond in self.conditions:
+            if not await cond.check(event_data):
+                return False
+
+        await machine.callbacks(machine.before_state_change + self.before, event_data)
+        if self.dest:  # if self.dest is None this is an internal transition with no actual state change
+            await self._change_state(event_data)
+        await machine.callbacks(self.after + machine.after_state_change, event_data)
+        return True
+
+    async def _change_state(self, event_data):
+        machine = event_data.machine
+        await machine.get_state(self.source).exit(event_data)
+        machine.set_state(self.dest, event_data.model)
+        event_data.update(getattr(event_data.model, machine.model_attribute))
+        await machine.get_state(self.dest).enter(event_data)
+
+    def add_callback(self, trigger, func):
+        """ Add a new before, after, or prepare callback.
+        Args:
+            trigger (str): The type of triggering event. Must be one of
+                'before', 'after' or 'prepare'.
+            func (str or callable): The name of the callback function or a callable.
+        """
+        callback_list = getattr(self, trigger)
+        callback_list.append(func)
+
+    def __repr__(self):
+        return "<%s('%s', '%s')@%s>" % (type(self).__name__, self.source, self.dest, id(self))
+
+
+class AsyncEvent(object):
+    """ A collection of transitions assigned to the same trigger. Triggering returns a coroutine. """
+
+    def __init__(self, name, machine):
+        self.name = name
+        self.machine = machine
+        self.transitions = defaultdict(list)
+
+    def add_transition(self, transition):
+        """ Add a transition to the list of potential transitions.
+        Args:
+            transition (AsyncTransition): The Transition instance to add to the list.
+        """
+        self.transitions[transition.source].append(transition)
+
+    async def trigger(self, model, *args, **kwargs):
+        """ Serially execute all transitions that match the current state,
+        halting as soon as one successfully completes.
+        Args:
+            model (object): The model the event is triggered on.
+            args and kwargs: Optional positional or named arguments that will
+                be passed onto the AsyncEventData object, enabling arbitrary state
+                information to be passed on to downstream triggered functions.
+        Returns: boolean indicating whether or not a transition was
+            successfully executed (True if successful, False if not).
+        """
+        func = partial(self._trigger, model, *args, **kwargs)
+        return await self.machine._process(func, model)
+
+    async def _trigger(self, model, *args, **kwargs):
+        state = self.machine.get_model_state(model)
+        if state.name not in self.transitions:
+            ignore = state.ignore_invalid_triggers if state.ignore_invalid_triggers is not None \
+                else self.machine.ignore_invalid_triggers
+            if ignore:
+                return False
+            raise MachineError("Can't trigger event %s from state %s!" % (self.name, state.name))
+        event_data = AsyncEventData(state, self, self.machine, model, args=args, kwargs=kwargs)
+        return await self._process(event_data)
+
+    async def _process(self, event_data, transitions=None):
+        machine = self.machine
+        await machine.callbacks(machine.prepare_event, event_data)
+        if transitions is None:
+            transitions = self.transitions[event_data.state.name]
+        try:
+            for trans in transitions:
+                event_data.transition = trans
+                if await trans.execute(event_data):
+                    event_data.result = True
+                    break
+        except Exception as err:
+            event_data.error = err
+            if machine.on_exception:
+                await machine.callbacks(machine.on_exception, event_data)
+            else:
+                raise
+        finally:
+            await machine.callbacks(machine.finalize_event, event_data)
+        return event_data.result
+
+    def add_callback(self, trigger, func):
+        """ Add a new before or after callback to all available transitions.
+        Args:
+            trigger (str): The type of triggering event. Must be one of
+                'before', 'after' or 'prepare'.
+            func (str): The name of the callback function.
+        """
+        for trans in self.transitions.values():
+            for transition in trans:
+                transition.add_callback(trigger, func)
+
+    def __repr__(self):
+        return "<%s('%s')@%s>" % (type(self).__name__, self.name, id(self))
+
+
+class AsyncMachine(Machine):
+    """ Machine whose triggers are coroutines. Callbacks and conditions may be coroutine functions and
+    are awaited in the order they were added. See ``Machine`` for the available arguments.
+    Attributes:
+        queued (bool): When True, each model processes its triggers sequentially in its own queue.
+            Triggers of different models do not wait for each other.
+    """
+
+    state_cls = AsyncState
+    transition_cls = AsyncTransition
+    event_cls = AsyncEvent
+
+    def __init__(self, *args, **kwargs):
+        # id(model) -> list of pending trigger coroutine functions, head is the running one
+        self._model_queues = {}
+        super(AsyncMachine, self).__init__(*args, **kwargs)
+
+    def remove_model(self, model):
+        """ Remove a model from the state machine. Queued triggers of removed models are dropped,
+        a currently running one is allowed to finish."""
+        super(AsyncMachine, self).remove_model(model)
+        for mod in listify(model):
+            queue = self._model_queues.get(id(mod))
+            if queue:
+                del queue[1:]
+
+    async def dispatch(self, trigger, *args, **kwargs):
+        """ Trigger an event on all models assigned to the machine concurrently.
+        Args:
+            trigger (str): Event name
+            *args (list): List of arguments passed to the event trigger
+            **kwargs (dict): Dictionary of keyword arguments passed to the event trigger
+        Returns:
+            bool The truth value of all triggers combined with AND
+        """
+        results = await asyncio.gather(*[getattr(model, trigger)(*args, **kwargs) for model in self.models])
+        return all(results)
+
+    async def batch_dispatch(self, trigger, *args, **kwargs):
+        """ Trigger an event on all models concurrently, looking the state and the transitions leaving it up
+            once per group of models that share a state. Models keep their transition queues when queued.
+        Args:
+            trigger (str): Event name
+            *args (list): List of arguments passed to the event trigger
+            **kwargs (dict): Dictionary of keyword arguments passed to the event trigger
+        Returns:
+            list: The trigger result of each model, in the order of Machine.models
+        """
+        event = self.events.get(trigger)
+        if event is None or type(event) is not AsyncEvent:
+            return list(await asyncio.gather(*[getattr(model, trigger)(*args, **kwargs) for model in self.models]))
+        models = list(self.models)
+        pending = [None] * len(models)
+        for value, indices in self._group_models().items():
+            state, transitions = self._group_transitions(event, value)
+            for index in indices:
+                model = models[index]
+                func = partial(self._batch_trigger, event, model, value, state, transitions, args, kwargs)
+                pending[index] = self._process(func, model)
+        return list(await asyncio.gather(*pending))
+
+    async def _batch_trigger(self, event, model, value, state, transitions, args, kwargs):
+        if transitions is False or getattr(model, self.model_attribute) != value:
+            # no transitions to resolve or moved since the grouping; the event checks the model on its own
+            return await event._trigger(model, *args, **kwargs)
+        event_data = AsyncEventData(state, event, self, model, args, kwargs)
+        return await event._process(event_data, transitions)
+
+    async def callbacks(self, funcs, event_data):
+        """ Triggers a list of callbacks, awaiting coroutines before the next callback starts. """
+        for func in funcs:
+            await self.callback(func, event_data)
+
+    async def callback(self, func, event_data):
+        """ Trigger a callback function or coroutine function with passed event_data parameters.
+        Args:
+            func (str or callable): The callback function.
+            event_data (AsyncEventData): An AsyncEventData instance to pass to the
+                callback (if event sending is enabled) or to extract arguments
+                from (if event sending is disabled).
+        Returns:
+            The (awaited) return value of the callback.
+        """
+        func = self._cached_callable(func, event_data.model)
+        if self.send_event:
+            res = func(event_data)
+        else:
+            res = func(*event_data.args, **event_data.kwargs)
+        if is_awaitable(res):
+            res = await res
+        return res
+
+    async def _can_trigger(self, model, trigger, *args, **kwargs):
+        state = self.get_model_state(model).name
+        if trigger in self._lazy_auto:
+            self._materialize_auto(trigger, state)
+        try:
+            transitions = self._transition_index[(state, trigger)][1]
+        except KeyError:
+            return False
+
+        evt = AsyncEventData(None, None, self, model, args, kwargs)
+        for transition in transitions:
+            await self.callbacks(self.prepare_event, evt)
+            await self.callbacks(transition.prepare, evt)
+            for cond in transition.conditions:
+                if not await cond.check(evt):
+                    break
+            else:
+                return True
+        return False
+
+    async def _get_trigger(self, model, trigger_name, *args, **kwargs):
+        res = super(AsyncMachine, self)._get_trigger(model, trigger_name, *args, **kwargs)
+        if is_awaitable(res):
+            res = await res
+        return res
+
+    async def _process(self, trigger, model=None):
+        # default processing
+        if not self.has_queue:
+            return await trigger()
+
+        # process queued events per model; other models keep running in their own queue
+        queue = self._model_queues.setdefault(id(model), [])
+        queue.append(trigger)
+        # another entry in the queue implies a running transition; skip immediate execution
+        if len(queue) > 1:
+            return True
+
+        try:
+            while queue:
+                await queue[0]()
+                queue.pop(0)
+        except Exception:
+            # if a transition raises an exception, clear queue and delegate exception handling
+            del queue[:]
+            raise
+        finally:
+            if not queue:
+                self._model_queues.pop(id(model), None)
+        return True
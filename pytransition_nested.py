@@ -0,0 +1,502 @@
+""" Hierarchical variant of ``pytransition.Machine``.
+
+States can contain children (compound states) or parallel regions, so sub-phases like walk/don't-walk
+or a protected left turn are added to a phase without enumerating every combination:
+
+    states = ['Red', 'Yellow_Red',
+              {'name': 'Green', 'parallel': [
+                  {'name': 'Vehicle', 'children': ['Go']},
+                  {'name': 'Ped', 'children': ['Walk', 'Flash', 'DontWalk']}]},
+              'Yellow_Green']
+
+Child states are registered with their full path (e.g. 'Green.Ped.Walk'). A model's state attribute holds the
+path of its active leaf state, or a list of leaf paths while a parallel state is active. Entering a compound
+state enters its initial child (all regions for parallel states); transitions exit and enter every state
+between the source/destination and their closest common ancestor, children before parents on exit and
+parents before children on enter. A transition from one region of a parallel state into another only exits
+and enters the destination's region, e.g. 'Green.Vehicle.Go' -> 'Green.Ped.Flash' keeps 'Green.Vehicle.Go'.
+"""
+
+from collections import defaultdict
+from functools import partial
+
+from pytransition import Machine, MachineError, State
+
+
+def listify(obj):
+    """ Wraps a passed object into a list in case it is not a list or tuple already. """
+    if obj is None:
+        return []
+    return obj if isinstance(obj, (list, tuple)) else [obj]
+
+
+class NestedEventData(object):
+    """ Collection of relevant data related to the ongoing transition attempt.
+    Attributes:
+        state (NestedState): The State from which the Event was triggered.
+        event (NestedEvent): The triggering Event.
+        machine (HierarchicalMachine): The current Machine instance.
+        model (object): The model/object the machine is bound to.
+        args (list): Optional positional arguments from trigger method to store internally.
+        kwargs: Any keyword arguments passed to the trigger method.
+        transition (NestedTransition): Currently active transition.
+        error (Exception): In case a triggered event causes an Error, it is assigned here.
+        result (bool): True in case a transition has been successful, False otherwise.
+        exited (list): States left by the executed transition.
+    """
+
+    def __init__(self, state, event, machine, model, args, kwargs):
+        self.state = state
+        self.event = event
+        self.machine = machine
+        self.model = model
+        self.args = args
+        self.kwargs = kwargs
+        self.transition = None
+        self.error = None
+        self.result = False
+        self.exited = ()
+
+    def update(self, state):
+        """ Updates the NestedState object of the passed model's current state. """
+        if not isinstance(state, self.machine.state_cls):
+            state = self.machine.get_state(state)
+        self.state = state
+
+
+class NestedState(State):
+    """ A state that may contain child states.
+    Attributes:
+        parent (NestedState): The enclosing state or None for top level states.
+        children (list): Child states in the order they were added.
+        initial (str): Name (without parent path) of the child entered with this state.
+        parallel (bool): When True, all children are regions that are active at the same time.
+        depth (int): Number of ancestors.
+    """
+
+    separator = '.'
+
+    def __init__(self, name, on_enter=None, on_exit=None, ignore_invalid_triggers=None,
+                 initial=None, parallel=False):
+        super(NestedState, self).__init__(name, on_enter=on_enter, on_exit=on_exit,
+                                          ignore_invalid_triggers=ignore_invalid_triggers)
+        self.parent = None
+        self.children = []
+        self.initial = initial
+        self.parallel = parallel
+        self.depth = 0
+
+    def add_child(self, state):
+        state.parent = self
+        state.depth = self.depth + 1
+        self.children.append(state)
+
+    def get_initial(self):
+        """ Return the child entered together with this state (None for leaves and parallel states). """
+        if not self.children or self.parallel:
+            return None
+        if self.initial is None:
+            return self.children[0]
+        name = self.name + self.separator + self.initial
+        for child in self.children:
+            if child.name == name:
+                return child
+        raise MachineError("Initial state '%s' of '%s' is not one of its children." % (self.initial, self.name))
+
+    def is_ancestor_of(self, state):
+        while state is not None:
+            if state is self:
+                return True
+            state = state.parent
+        return False
+
+
+class NestedCondition(object):
+    """ A helper class to call condition checks in the intended way.
+    Attributes:
+        func (str or callable): The function to call for the condition check
+        target (bool): Indicates the target state--i.e., when True,
+                the condition-checking callback should return True to pass,
+                and when False, the callback should return False to pass.
+    """
+
+    def __init__(self, func, target=True):
+        self.func = func
+        self.target = target
+
+    def check(self, event_data):
+        """ Check whether the condition passes. """
+        machine = event_data.machine
+        predicate = machine.resolve_callable(self.func, event_data)
+        if machine.send_event:
+            return predicate(event_data) == self.target
+        return predicate(*event_data.args, **event_data.kwargs) == self.target
+
+    def __repr__(self):
+        return "<%s(%s)@%s>" % (type(self).__name__, self.func, id(self))
+
+
+class NestedTransition(object):
+    """ Representation of a transition between (possibly nested) states of a ``HierarchicalMachine``.
+    Attributes:
+        source (str): Full name of the source state.
+        dest (str): Full name of the destination state, None for internal transitions.
+        prepare (list): Callbacks executed before conditions checks.
+        conditions (list): Callbacks evaluated to determine if
+            the transition should be executed.
+        before (list): Callbacks executed before the transition is executed
+            but only if condition checks have been successful.
+        after (list): Callbacks executed after the transition is executed
+            but only if condition checks have been successful.
+    """
+
+    dynamic_methods = ['before', 'after', 'prepare']
+    condition_cls = NestedCondition
+
+    def __init__(self, source, dest, conditions=None, unless=None, before=None,
+                 after=None, prepare=None):
+        self.source = source
+        self.dest = dest
+        self.prepare = listify(prepare)
+        self.before = listify(before)
+        self.after = listify(after)
+
+        self.conditions = []
+        for cond in listify(conditions):
+            self.conditions.append(self.condition_cls(cond))
+        for cond in listify(unless):
+            self.conditions.append(self.condition_cls(cond, target=False))
+
+    def execute(self, event_data):
+        """ Execute the transition.
+        Args:
+            event_data: An instance of class NestedEventData.
+        Returns: boolean indicating whether the transition was
+            successfully executed (True if successful, False if not).
+        """
+        machine = event_data.machine
+        machine.callbacks(self.prepare, event_data)
+
+        for cond in self.conditions:
+            if not cond.check(event_data):
+                return False
+
+        machine.callbacks(machine.before_state_change + self.before, event_data)
+        if self.dest:  # if self.dest is None this is an internal transition with no actual state change
+            machine.change_state(event_data, self.source, self.dest)
+        machine.callbacks(self.after + machine.after_state_change, event_data)
+        return True
+
+    def add_callback(self, trigger, func):
+        """ Add a new before, after, or prepare callback.
+        Args:
+            trigger (str): The type of triggering event. Must be one of
+                'before', 'after' or 'prepare'.
+            func (str or callable): The name of the callback function or a callable.
+        """
+        callback_list = getattr(self, trigger)
+        callback_list.append(func)
+
+    def __repr__(self):
+        return "<%s('%s', '%s')@%s>" % (type(self).__name__, self.source, self.dest, id(self))
+
+
+class NestedEvent(object):
+    """ A collection of transitions assigned to the same trigger. Transitions of the deepest active state
+    are tried first, then those of its ancestors. In a parallel state every region handles the event.
+    """
+
+    def __init__(self, name, machine):
+        self.name = name
+        self.machine = machine
+        self.transitions = defaultdict(list)
+
+    def add_transition(self, transition):
+        """ Add a transition to the list of potential transitions.
+        Args:
+            transition (NestedTransition): The Transition instance to add to the list.
+        """
+        self.transitions[transition.source].append(transition)
+
+    def trigger(self, model, *args, **kwargs):
+        """ Execute the first matching transition of every active region, halting the search of a region as
+        soon as one transition successfully completes.
+        Returns: boolean indicating whether or not a transition was
+            successfully executed (True if successful, False if not).
+        """
+        func = partial(self._trigger, model, *args, **kwargs)
+        return self.machine._process(func)
+
+    def _trigger(self, model, *args, **kwargs):
+        machine = self.machine
+        leaves = machine.get_active_states(model)
+        tried = set()
+        handled = False
+        result = False
+        for leaf in leaves:
+            # a transition of an earlier region may have left (and re-entered) this one already
+            if leaf.name in tried:
+                continue
+            state = leaf
+            while state is not None and state.name not in tried:
+                tried.add(state.name)
+                if state.name in self.transitions:
+                    handled = True
+                    event_data = NestedEventData(state, self, machine, model, args, kwargs)
+                    if self._process(event_data):
+                        tried.update(s.name for s in event_data.exited)
+                        result = True
+                        break
+                state = state.parent
+        if not handled:
+            state = leaves[0]
+            msg = "%sCan't trigger event %s from state %s!" % (machine.name, self.name, state.name)
+            ignore = state.ignore_invalid_triggers if state.ignore_invalid_triggers is not None \
+                else machine.ignore_invalid_triggers
+            if ignore:
+                return False
+            raise MachineError(msg)
+        return result
+
+    def _process(self, event_data):
+        machine = self.machine
+        machine.callbacks(machine.prepare_event, event_data)
+        try:
+            for trans in self.transitions[event_data.state.name]:
+                event_data.transition = trans
+                if trans.execute(event_data):
+                    event_data.result = True
+                    break
+        except Exception as err:
+            event_data.error = err
+            if machine.on_exception:
+                machine.callbacks(machine.on_exception, event_data)
+            else:
+                raise
+        finally:
+            machine.callbacks(machine.finalize_event, event_data)
+        return event_data.result
+
+    def add_callback(self, trigger, func):
+        """ Add a new before or after callback to all available transitions.
+        Args:
+            trigger (str): The type of triggering event. Must be one of
+                'before', 'after' or 'prepare'.
+            func (str): The name of the callback function.
+        """
+        for trans in self.transitions.values():
+            for transition in trans:
+                transition.add_callback(trigger, func)
+
+    def __repr__(self):
+        return "<%s('%s')@%s>" % (type(self).__name__, self.name, id(self))
+
+
+class HierarchicalMachine(Machine):
+    """ Machine supporting compound and parallel states. See ``Machine`` for the available arguments; states
+    can additionally be passed as dicts with 'children' (and optionally 'initial') or 'parallel' lists.
+    """
+
+    state_cls = NestedState
+    transition_cls = NestedTransition
+    event_cls = NestedEvent
+
+    def add_states(self, states, on_enter=None, on_exit=None,
+                   ignore_invalid_triggers=None, parent=None, **kwargs):
+        """ Add new (nested) state(s).
+        Args:
+            states (list, str, dict or NestedState): see ``Machine.add_states``. A dict may contain
+                'children' (list of states), 'initial' (child entered with the state) or 'parallel'
+                (list of regions which are all entered with the state).
+            parent (str or NestedState): Parent of the added states. Names are prefixed with the parent's name.
+        """
+        if isinstance(parent, str):
+            parent = self.get_state(parent)
+        ignore = ignore_invalid_triggers
+        if ignore is None:
+            ignore = self.ignore_invalid_triggers
+
+        for state in listify(states):
+            children = None
+            if isinstance(state, dict):
+                spec = dict(state)
+                children = spec.pop('children', None)
+                regions = spec.pop('parallel', None)
+                if regions is not None:
+                    children = regions
+                    spec['parallel'] = True
+                if 'ignore_invalid_triggers' not in spec:
+                    spec['ignore_invalid_triggers'] = ignore
+                name = spec.pop('name')
+                if parent is not None:
+                    name = parent.name + self.state_cls.separator + name
+                state = self._create_state(name, **spec)
+            elif isinstance(state, str):
+                if parent is not None:
+                    state = parent.name + self.state_cls.separator + state
+                state = self._create_state(state, on_enter=on_enter, on_exit=on_exit,
+                                           ignore_invalid_triggers=ignore, **kwargs)
+            elif not isinstance(state, NestedState):
+                raise ValueError("%s states have to be names, dicts or NestedState instances." % type(self).__name__)
+            if parent is not None:
+                parent.add_child(state)
+            super(HierarchicalMachine, self).add_states(state)
+            if children:
+                self.add_states(children, on_enter=on_enter, on_exit=on_exit,
+                                ignore_invalid_triggers=ignore_invalid_triggers, parent=state, **kwargs)
+
+    def get_active_states(self, model):
+        """ Return the active leaf states of model, one per active region. """
+        value = getattr(model, self.model_attribute)
+        if isinstance(value, list):
+            return [self.get_state(name) for name in value]
+        return [self.get_state(value)]
+
+    def get_model_state(self, model):
+        """ Return the State object of the model's (first) active leaf state. """
+        return self.get_active_states(model)[0]
+
+    def is_state(self, state, model):
+        """ Check whether state is active for model, either as leaf state or as an ancestor of one.
+        Args:
+            state (str or Enum): name of the checked state or Enum
+            model: model to be checked
+        Returns:
+            bool: Whether state is active.
+        """
+        name = state.name if hasattr(state, 'name') else state
+        for leaf in self.get_active_states(model):
+            while leaf is not None:
+                if leaf.name == name:
+                    return True
+                leaf = leaf.parent
+        return False
+
+    def set_state(self, state, model=None):
+        """ Set the current state without processing callbacks. Compound states are resolved to their
+        initial leaf states.
+        Args:
+            state (str or Enum or State): value of state to be set
+            model (optional[object]): targeted model; if not set, all models will be set to 'state'
+        """
+        if not isinstance(state, State):
+            state = self.get_state(state)
+        leaves = [s for s in self._entry_closure(state) if not s.children]
+        models = self.models if model is None else listify(model)
+        for mod in models:
+            self._set_leaves(mod, leaves)
+
+    def _set_leaves(self, model, leaves):
+        order = list(self.states)
+        leaves = sorted(leaves, key=lambda s: order.index(s.name))
+        setattr(model, self.model_attribute, leaves[0].value if len(leaves) == 1 else [s.name for s in leaves])
+
+    def _entry_closure(self, state):
+        """ state and every state entered with it through initial children and parallel regions. """
+        entered = [state]
+        if state.parallel:
+            for child in state.children:
+                entered.extend(self._entry_closure(child))
+        else:
+            child = state.get_initial()
+            if child is not None:
+                entered.extend(self._entry_closure(child))
+        return entered
+
+    def change_state(self, event_data, source, dest):
+        """ Exit all active states below the common ancestor of source and dest, then enter dest's path.
+        If that ancestor is a parallel state (source and dest are in different regions), only the region of
+        dest is exited and entered again; the other regions keep their states.
+        Args:
+            event_data (NestedEventData): The currently processed event.
+            source (str): Full name of the transition's source state.
+            dest (str): Full name of the transition's destination state.
+        """
+        model = event_data.model
+        source = self.get_state(source)
+        dest = self.get_state(dest)
+
+        scope = source
+        while scope is not None and not scope.is_ancestor_of(dest):
+            scope = scope.parent
+        if scope is source or scope is dest:
+            # external transition: a state transitioning to itself or into its own child/parent is left
+            scope = scope.parent
+        region = scope
+        if scope is not None and scope.parallel:
+            # cross-region transition: only the region of dest changes
+            region = dest
+            while region.parent is not scope:
+                region = region.parent
+
+        # exit, children before parents
+        leaves = self.get_active_states(model)
+        kept = []
+        exited = []
+        for leaf in leaves:
+            if region is not None and not region.is_ancestor_of(leaf):
+                kept.append(leaf)
+                continue
+            state = leaf
+            while state is not scope:
+                if state not in exited:
+                    exited.append(state)
+                state = state.parent
+        exited.sort(key=lambda s: -s.depth)
+        event_data.exited = exited
+        for state in exited:
+            state.exit(event_data)
+
+        # enter, parents before children; parallel regions along the path are entered with their initials
+        path = []
+        state = dest
+        while state is not scope:
+            path.append(state)
+            state = state.parent
+        path.reverse()
+        entered = []
+        for i, state in enumerate(path):
+            if state is dest:
+                entered.extend(self._entry_closure(state))
+                break
+            entered.append(state)
+            if state.parallel:
+                for child in state.children:
+                    if child is not path[i + 1]:
+                        entered.extend(self._entry_closure(child))
+        entered.sort(key=lambda s: s.depth)
+
+        self._set_leaves(model, kept + [s for s in entered if not s.children])
+        event_data.update(dest)
+        for state in entered:
+            state.enter(event_data)
+
+    def _trigger_event(self, trigger, model, *args, **kwargs):
+        if trigger in self._lazy_auto:
+            for leaf in self.get_active_states(model):
+                self._materialize_auto(trigger, leaf.name)
+        return self.events[trigger].trigger(model, *args, **kwargs)
+
+    def _get_trigger(self, model, trigger_name, *args, **kwargs):
+        if trigger_name not in self.events:
+            return super(HierarchicalMachine, self)._get_trigger(model, trigger_name, *args, **kwargs)
+        return self._trigger_event(trigger_name, model, *args, **kwargs)
+
+    def _can_trigger(self, model, trigger, *args, **kwargs):
+        evt = NestedEventData(None, None, self, model, args, kwargs)
+        for leaf in self.get_active_states(model):
+            if trigger in self._lazy_auto:
+                self._materialize_auto(trigger, leaf.name)
+            state = leaf
+            while state is not None:
+                entry = self._transition_index.get((state.name, trigger))
+                for transition in entry[1] if entry else ():
+                    self.callbacks(self.prepare_event, evt)
+                    self.callbacks(transition.prepare, evt)
+                    for cond in transition.conditions:
+                        if not cond.check(evt):
+                            break
+                    else:
+                        return True
+                state = state.parent
+        return False
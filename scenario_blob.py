@@ -0,0 +1,221 @@
+# scenario_blob.py Scenario sets packed into one bytes object, read in place
+# Usage:
+# from scenarios_packed import BLOB       # written by pack_scenarios.py
+# SCENARIOS = Scenarios(BLOB)              # the first plan, used like the OrderedDict in config.py
+# night = Scenarios(BLOB, 'night')         # a named plan
+#
+# Layout (little endian), all offsets from the start of the blob:
+#   header     magic 'SC', format version (B), number of plans (B), of slots (H), of approaches (H)
+#   plans      name offset (H), name length (B), first slot (H), number of slots (H)
+#   slots      slot key (H), first approach (H), number of approaches (B), 1 if the slot holds a list (B)
+#   approaches name offset (H), name length (B), bulbs (B), status (B, 1 = On), initial state (B),
+#              number of states (B), up to 4 state codes (4s), throughput (H)
+#   strings    names, utf-8
+# State codes index STATE_NAMES.
+# A frozen module's bytes object stays in flash, so only the views that are being read take RAM. Names are
+# decoded when they are read.
+
+import struct
+
+MAGIC = b'SC'
+FORMAT_VERSION = 1
+STATE_NAMES = ('Red', 'Yellow_Red', 'Green', 'Yellow_Green')
+MAX_STATES = 4 # state codes an approach record holds
+
+_HEADER = '<2sBBHH'
+_PLAN = '<HBHH'
+_SLOT = '<HHBB'
+_APPROACH = '<HBBBBB{}sH'.format(MAX_STATES)
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_PLAN_SIZE = struct.calcsize(_PLAN)
+_SLOT_SIZE = struct.calcsize(_SLOT)
+_APPROACH_SIZE = struct.calcsize(_APPROACH)
+_KEYS = ('name', 'bulbs', 'states', 'initial', 'status', 'throughput')
+
+
+def validate_scenarios(scenarios):
+    '''Raises ValueError if the scenario set can't run. The pins and the slots are checked when it is compiled'''
+    names = {}
+    on_slots = 0
+    for slot, value in scenarios.items():
+        approaches = value if isinstance(value, list) else [value]
+        if not approaches:
+            raise ValueError("Slot {} has no approach".format(slot))
+        for approach in approaches:
+            if not hasattr(approach, 'get'):
+                raise ValueError("Slot {}: an approach is a JSON object".format(slot))
+            name = approach.get('name')
+            if not isinstance(name, str) or not name:
+                raise ValueError("Slot {}: approach without a name".format(slot))
+            if name in names:
+                raise ValueError("Approach {} is in more than one slot".format(name))
+            states = approach.get('states')
+            if not isinstance(states, list) or not states or any(state not in STATE_NAMES for state in states):
+                raise ValueError("{}: states must be taken from {}".format(name, STATE_NAMES))
+            if 'Red' not in states or 'Green' not in states:
+                raise ValueError("{}: needs a Red and a Green state".format(name))
+            bulbs = approach.get('bulbs')
+            if not isinstance(bulbs, int) or isinstance(bulbs, bool) or not 0 < bulbs <= len(states):
+                raise ValueError("{}: bulbs must be 1 to {}".format(name, len(states)))
+            if approach.get('initial') not in states:
+                raise ValueError("{}: initial state is not one of its states".format(name))
+            if approach.get('status') not in ('On', 'Off'):
+                raise ValueError("{}: status must be 'On' or 'Off'".format(name))
+            names[name] = approach['status'] == 'On'
+        first = approaches[0]
+        on_slots += first['status'] == 'On'
+    if on_slots < 2:
+        raise ValueError("A plan needs at least 2 slots that are on")
+    for name, on in names.items():
+        if on and name.endswith('x') and not names.get(name.rstrip('x')):
+            raise ValueError("{} extends the green of {}, which is not on".format(name, name.rstrip('x')))
+
+
+def pack(plans):
+    '''plans is a list of (name, scenarios). Every scenario set is validated first'''
+    if not 0 < len(plans) < 256:
+        raise ValueError("1 to 255 plans can be packed, got {}".format(len(plans)))
+    strings = bytearray()
+    offsets = {}
+
+    def string(text):
+        data = text.encode()
+        if len(data) > 255:
+            raise ValueError("Name {} is longer than 255 bytes".format(text))
+        if text not in offsets:
+            offsets[text] = len(strings)
+            strings.extend(data)
+        return offsets[text], len(data)
+
+    plan_records, slot_records, approach_records = [], [], []
+    for plan_name, scenarios in plans:
+        validate_scenarios(scenarios)
+        plan_records.append(string(plan_name) + (len(slot_records), len(scenarios)))
+        for slot, value in scenarios.items():
+            if not isinstance(slot, int) or not 0 <= slot < 65536:
+                raise ValueError("Slot keys must be integers from 0 to 65535, got {}".format(slot))
+            approaches = value if isinstance(value, list) else [value]
+            slot_records.append((slot, len(approach_records), len(approaches), isinstance(value, list)))
+            for approach in approaches:
+                codes = bytes(STATE_NAMES.index(state) for state in approach['states'])
+                if len(codes) > MAX_STATES: # struct would cut the codes off without a word
+                    raise ValueError("{}: at most {} states can be packed, got {}".format(
+                                     approach['name'], MAX_STATES, len(codes)))
+                approach_records.append(string(approach['name']) + (
+                    approach['bulbs'], approach['status'] == 'On', STATE_NAMES.index(approach['initial']),
+                    len(codes), codes, approach.get('throughput', 1)))
+
+    base = (_HEADER_SIZE + _PLAN_SIZE * len(plan_records) + _SLOT_SIZE * len(slot_records)
+            + _APPROACH_SIZE * len(approach_records))
+    if base + len(strings) > 65535 or len(slot_records) > 65535 or len(approach_records) > 65535:
+        raise ValueError("Scenario sets too large for 16 bit offsets")
+    blob = bytearray(struct.pack(_HEADER, MAGIC, FORMAT_VERSION, len(plan_records), len(slot_records),
+                                 len(approach_records)))
+    for name_offset, name_length, first, count in plan_records:
+        blob.extend(struct.pack(_PLAN, base + name_offset, name_length, first, count))
+    for record in slot_records:
+        blob.extend(struct.pack(_SLOT, *record))
+    for record in approach_records:
+        blob.extend(struct.pack(_APPROACH, base + record[0], *record[1:]))
+    blob.extend(strings)
+    return bytes(blob)
+
+
+class Approach(object):
+    """ Read-only view of one approach record, with the keys and values of an approach dict in config.py """
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+
+    def __getitem__(self, key):
+        name_offset, name_length, bulbs, status, initial, count, codes, throughput = \
+            struct.unpack_from(_APPROACH, self._data, self._offset)
+        if key == 'name':
+            return str(bytes(self._data[name_offset:name_offset + name_length]), 'utf-8')
+        if key == 'bulbs':
+            return bulbs
+        if key == 'states':
+            return [STATE_NAMES[code] for code in codes[:count]]
+        if key == 'initial':
+            return STATE_NAMES[initial]
+        if key == 'status':
+            return 'On' if status else 'Off'
+        if key == 'throughput':
+            return throughput
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return _KEYS
+
+    def items(self):
+        return [(key, self[key]) for key in _KEYS]
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class Scenarios(object):
+    """ Read-only view of one packed scenario set, iterated like the SCENARIOS OrderedDict: slot key -> approach,
+        or list of approaches.
+    """
+
+    def __init__(self, blob, plan=0):
+        self._data = memoryview(blob)
+        magic, version, plans, self._slots, approaches = struct.unpack_from(_HEADER, self._data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a scenario blob of format version {}".format(FORMAT_VERSION))
+        self._slot_base = _HEADER_SIZE + _PLAN_SIZE * plans
+        self._approach_base = self._slot_base + _SLOT_SIZE * self._slots
+        if not isinstance(plan, int):
+            names = plan_names(blob)
+            if plan not in names:
+                raise KeyError(plan)
+            plan = names.index(plan)
+        if not 0 <= plan < plans:
+            raise KeyError(plan)
+        _, _, self._first, self._count = struct.unpack_from(_PLAN, self._data, _HEADER_SIZE + _PLAN_SIZE * plan)
+
+    def _slot(self, i):
+        return struct.unpack_from(_SLOT, self._data, self._slot_base + _SLOT_SIZE * (self._first + i))
+
+    def _value(self, first, count, is_list):
+        approaches = [Approach(self._data, self._approach_base + _APPROACH_SIZE * (first + i)) for i in range(count)]
+        return approaches if is_list else approaches[0]
+
+    def __len__(self):
+        return self._count
+
+    def keys(self):
+        return [self._slot(i)[0] for i in range(self._count)]
+
+    def values(self):
+        for i in range(self._count):
+            yield self._value(*self._slot(i)[1:])
+
+    def items(self):
+        for i in range(self._count):
+            key, first, count, is_list = self._slot(i)
+            yield key, self._value(first, count, is_list)
+
+    def __getitem__(self, key):
+        for slot, value in self.items():
+            if slot == key:
+                return value
+        raise KeyError(key)
+
+
+def plan_names(blob):
+    data = memoryview(blob)
+    plans = struct.unpack_from(_HEADER, data, 0)[2]
+    names = []
+    for i in range(plans):
+        name_offset, name_length, _, _ = struct.unpack_from(_PLAN, data, _HEADER_SIZE + _PLAN_SIZE * i)
+        names.append(str(bytes(data[name_offset:name_offset + name_length]), 'utf-8'))
+    return names
@@ -0,0 +1,109 @@
+# snapshot.py Compact binary snapshot of the controller state, for a fast restart after a reset
+# Usage:
+# from snapshot import store
+# store.write(pack(...))   # at every phase change, in flash at most every snapshot_file_interval
+# state = unpack(store.read())  # None if missing, corrupt, or of another format version
+#
+# Layout (little endian):
+#   header  magic 'TS', format version (B), plan version (I), phase end in epoch ms (q), ms allotted to the
+#           phase (I), flags (B), number of models (B), number of detector pins (B)
+#   models  next slot (B) and current state index (B, 255 for none) per model
+#   pins    vehicle count (I) per detector pin
+#   trailer crc32 of everything before it (I)
+# The default store is RTC memory, which survives machine.reset() and the watchdog but not a power loss.
+# SETTINGS['snapshot'] = 'file' keeps it in flash instead. To spare the flash, phase changes are then written at
+# most every snapshot_file_interval seconds; plan swaps and flash mode changes are written at once. A reset
+# resumes from the slot of the last write.
+
+from binascii import crc32
+import struct
+import utime
+
+from config import SETTINGS
+
+MAGIC = b'TS'
+FORMAT_VERSION = 2
+NO_STATE = 255
+FLASHING = 1
+
+_HEADER = '<2sBIqIBBB'
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+
+def epoch_ms():
+    '''Wall-clock ms from the RTC, which keeps running through a reset'''
+    try:
+        return utime.time_ns() // 1000000
+    except AttributeError:
+        return int(utime.time()) * 1000
+
+
+def pack(plan, end, allotted, flags, models, pins):
+    '''models is a list of (next slot, state index), pins a list of counts'''
+    data = bytearray(_HEADER_SIZE + 2 * len(models) + 4 * len(pins) + 4)
+    struct.pack_into(_HEADER, data, 0, MAGIC, FORMAT_VERSION, plan, end, allotted, flags, len(models), len(pins))
+    offset = _HEADER_SIZE
+    for slot, state in models:
+        data[offset] = slot
+        data[offset + 1] = state
+        offset += 2
+    for count in pins:
+        struct.pack_into('<I', data, offset, count)
+        offset += 4
+    struct.pack_into('<I', data, offset, crc32(memoryview(data)[:offset]) & 0xffffffff)
+    return data
+
+
+def unpack(data):
+    '''Returns (plan, end, allotted, flags, models, pins) or None if data is no intact snapshot of this format
+       version'''
+    if not data or len(data) < _HEADER_SIZE + 4:
+        return None
+    magic, version, plan, end, allotted, flags, n_models, n_pins = struct.unpack_from(_HEADER, data, 0)
+    size = _HEADER_SIZE + 2 * n_models + 4 * n_pins
+    if magic != MAGIC or version != FORMAT_VERSION or len(data) < size + 4:
+        return None
+    if struct.unpack_from('<I', data, size)[0] != crc32(memoryview(data)[:size]) & 0xffffffff:
+        return None
+    models = [(data[offset], data[offset + 1]) for offset in range(_HEADER_SIZE, _HEADER_SIZE + 2 * n_models, 2)]
+    pins = list(struct.unpack_from('<%dI' % n_pins, data, _HEADER_SIZE + 2 * n_models))
+    return plan, end, allotted, flags, models, pins
+
+
+class RTCStore:
+
+    def __init__(self):
+        from machine import RTC
+        self.rtc = RTC()
+
+    def read(self):
+        return self.rtc.memory()
+
+    def write(self, data):
+        self.rtc.memory(data)
+
+    def clear(self):
+        self.rtc.memory(b'')
+
+
+class FileStore:
+
+    def __init__(self, file_name='snapshot.bin'):
+        self.file_name = file_name
+
+    def read(self):
+        try:
+            with open(self.file_name, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write(self, data):
+        with open(self.file_name, 'wb') as f:
+            f.write(data)
+
+    def clear(self):
+        self.write(b'')
+
+
+store = FileStore() if SETTINGS.get('snapshot') == 'file' else RTCStore()
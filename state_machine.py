@@ -14,23 +14,39 @@
 
 #from micropython import const
 
+import profiler
+profiler.mark('interpreter and boot.py')
+
 from machine import Pin
 import sys
 from collections import OrderedDict
 import uasyncio as asyncio
+from binascii import crc32
 from machine import RTC
-import ntptime
+from utime import ticks_add, ticks_diff, ticks_ms, ticks_us
+profiler.mark('import')
+
+from config import SCENARIOS, PINS, SETTINGS
+profiler.mark('config compile')
 
+import conflicts
+from coordination import CORRIDOR_TOPIC, Coordinator
 from delay_ms import Delay_ms
+from detectors import DetectorBank
+from flasher import flasher
+from mqtt_link import MqttLink
+import plans
+import snapshot
+from timeplans import TimePlans
+from timesync import TimeSync
 import ulogger
-
-from config import SCENARIOS, PINS, SETTINGS
+profiler.mark('controller modules')
 
 class Clock(ulogger.BaseClock):
+    '''RTC time for the log. The RTC is set by TimeSync (timesync.py) from SETTINGS['time_server']'''
+
     def __init__(self):
         self.rtc = RTC()
-        ntptime.host = "ntp.ntsc.ac.cn"
-        #ntptime.settime()
 
     def __call__(self) -> str:
         y,m,d,_,h,mi,s,_ = self.rtc.datetime ()
@@ -95,9 +111,7 @@ class Condition(object):
     def check(self, machine):
         """ Check whether the condition passes.
         """
-        predicate = machine.resolve_callable(self.func)
-
-        return predicate() == self.target
+        return self.func() == self.target
 
     def __repr__(self):
         return "<%s(%s)@%s>" % (type(self).__name__, self.func, id(self))
@@ -149,13 +163,14 @@ class Transition(object):
         self.before = [self._check_allowed_states]
         self.after = []
 
+        # condition callables are resolved against the model once, here, instead of on every tick
         self.conditions = []
         if conditions is not None:
             for cond in listify(conditions):
-                self.conditions.append(self.condition_cls(cond))
+                self.conditions.append(self.condition_cls(StateMachine.resolve_callable(cond, model)))
         if unless is not None:
             for cond in listify(unless):
-                self.conditions.append(self.condition_cls(cond, target=False))
+                self.conditions.append(self.condition_cls(StateMachine.resolve_callable(cond, model), target=False))
 
     def _eval_conditions(self, machine):
         for cond in self.conditions:
@@ -206,35 +221,12 @@ class Transition(object):
             self.dest = None
 
     def _ordered_transitions(self):
-        """ Add a set of transitions that move linearly from state to state.
-        Args:
-            states (list): A list of state names defining the order of the
-                transitions. E.g., ['A', 'B', 'C'] will generate transitions
-                for A --> B, B --> C, and C --> A (if loop is True). If states
-                is None, all states in the current instance will be used.
-            loop (boolean): Whether to add a transition from the last
-                state to the first state.
-            loop_includes_initial (boolean): If no initial state was defined in
-                the machine, setting this to True will cause the _initial state
-                placeholder to be included in the added transitions. This argument
-                has no effect if the states argument is passed without the
-                initial state included.
+        """ Set dest to the next slot of the model's ordered_states and advance to its successor.
+            ordered_states repeats state names, so the successor table (see Lamps.build_successors)
+            maps slot positions: the last slot leads back to the first one if the model loops, else to itself.
         """
-        states = self.model.ordered_states
-        loop = self.model.loop
-
-        len_transitions = len(states)
-        if len_transitions < 2:
-            raise ValueError("Can't create ordered transitions on a Machine "
-                             "with fewer than 2 states.")
-
-        try:
-            self.dest = states[self.idx]
-            self.idx += 1
-        except IndexError:
-            self.idx = 0 if loop else -1 # stay in the last state or go to the first
-            self.dest = states[self.idx]
-            self.idx = 1 if self.idx == 0 else -1
+        self.dest = self.model.ordered_states[self.idx]
+        self.idx = self.model.successors[self.idx]
 
     def add_callback(self, trigger, func):
         """ Add a new before, after, or prepare callback.
@@ -242,9 +234,10 @@ class Transition(object):
             trigger (str): The type of triggering event. Must be one of
                 'before', 'after' or 'prepare'.
             func (str or callable): The name of the callback function or a callable.
+                Names are resolved against the transition's model here, not at execution.
         """
         callback_list = getattr(self, trigger)
-        callback_list.append(func)
+        callback_list.append(StateMachine.resolve_callable(func, self.model))
 
     def __repr__(self):
         return "<%s('%s', '%s')@%s>" % (type(self).__name__,
@@ -280,36 +273,196 @@ class StateMachine(object):
 
     transition_cls = Transition
 
-    transitions = []
-
     delay = Delay_ms()
 
     gpios = PINS['GPIO_POOL']
 
+    lamp_pins = {} # approach name -> its lamp pins, a reloaded plan hands them to the approach's new model
+    pin_numbers = {} # approach name -> the GPIOs of its lamp pins, back to the pool when it leaves the plan
+
     def __init__(self):
         self.g_current_states = []
-        self.g_states = []
-        self.models = OrderedDict()
+
+        # the plan accepted before the last reset (see plans.py), else the one in config.py
+        plan = None
+        saved = plans.saved(SCENARIOS)
+        if saved is not None:
+            try:
+                plan = self._build_plan(saved[0])
+                SETTINGS.update(saved[1])
+            except ValueError as e:
+                _LOGGER.error("Saved plan not used: {}".format(e))
+        # config.py's plan runs even with conflicting greens, the monitor then keeps the intersection in flash
+        self._adopt(plan if plan is not None else self._build_plan(SCENARIOS, checked=False))
+        self.pending_plan = None # (compiled plan, settings) waiting for the next clearance, see _swap_plan
 
         self.delay.callback(self._run_transitions, ())
 
         self.state_allotted_time = 0 # there is only one per transition
 
-        self._initialize_machine()
+        self.flashing = False # whole intersection in flash, see FlashMode
+        self.fault = None # conflict that latched the flash, see conflict
+
+        self._phase_end = ticks_ms() # when the running delay fires
+        self._snapshot_at = None # ticks_ms of the last snapshot written to flash
+        self.wake_latency = None # ms from the last wake-up to restored lamps
+
+        self.adaptive = False # wait times from get_wait_time, only once WiFi is up (see join_wifi)
+        self.first_lamp = None # ms after reset the first lamp came on
+
+        self._apply_settings()
+        self.time_plans = TimePlans(self, clock.rtc.datetime)
+        self.time_sync = TimeSync(_LOGGER)
+        self.coordinator = Coordinator(self.time_sync.now, _LOGGER)
+
+        self.pedestrians = Pedestrians()
+        self.detectors = DetectorBank(listener=self._on_detectors)
+        self.plan_loader = plans.PlanLoader(self, _LOGGER)
+        if saved is not None and plan is not None:
+            self.plan_loader.settings.update(saved[1])
+
+        if not self._restore_snapshot():
+            self.delay.trigger(1) # first slot on the first loop pass, not after the default 1 s
+        if self.conflicting_slot is not None:
+            self.conflict("greens of slot {} conflict".format(self.conflicting_slot))
 
     def _initialize_machine(self):
-        self._generate_global_states_from_scenarios()
-        self._add_models()
-        self._add_g_states_to_models()
-        self._modify_model_ordered_state()
-        self._create_transition(self)
-        self.delay.trigger()
+        for step in self._build_steps():
+            step()
+
+    def _build_steps(self):
+        '''The steps that compile self.scenarios into models, their ordered slots and the transitions'''
+        return (self._generate_global_states_from_scenarios, self._add_models, self._add_g_states_to_models,
+                self._modify_model_ordered_state, self._build_successors, self._build_conflicts,
+                lambda: self._create_transition(self), self._version_plan)
+
+    def _build_conflicts(self):
+        '''Gives every model its bit and conflict mask (see conflicts.py) and finds a slot with conflicting greens'''
+        masks = conflicts.compile_masks(self.scenarios, list(self.models))
+        for i, (model, mask) in enumerate(zip(self.models.values(), masks)):
+            model.bit = 1 << i
+            model.conflicts = mask
+        self.conflicting_slot = conflicts.check_slots(list(self.models.values()))
+
+    def _version_plan(self):
+        # a snapshot is only resumed by the plan it was taken with
+        self.plan_version = crc32(';'.join(name + ':' + ','.join(model.ordered_states)
+                                           for name, model in self.models.items()).encode()) & 0xffffffff
+
+    def _stage_plan(self, scenarios):
+        '''Compiles scenarios on a staging machine one step at a time and yields it after every step.
+           Neither the running plan nor the GPIO pool is touched: lamps of approaches the running plan has keep
+           their pins, new ones get theirs when the plan is adopted'''
+        plan = StateMachine.__new__(StateMachine)
+        plan.scenarios = scenarios
+        plan.g_states = []
+        plan.models = OrderedDict()
+        plan.transitions = []
+        needed = 0
+        kept = set()
+        for value in scenarios.values():
+            for val in (value if isinstance(value, list) else [value]):
+                if val['status'] != 'On':
+                    continue
+                if self._has_pins(val['name'], val['states'], val['bulbs']):
+                    kept.add(val['name'])
+                else:
+                    needed += val['bulbs']
+        # the approaches of the running plan that don't keep their pins hand them back at the swap
+        free = len(StateMachine.gpios) + sum(len(numbers) for name, numbers in StateMachine.pin_numbers.items()
+                                             if name not in kept)
+        if needed > free:
+            raise ValueError("The plan needs {} more lamp GPIOs, {} are left".format(needed, free))
+        for step in plan._build_steps():
+            step()
+            yield plan
+
+    def _build_plan(self, scenarios, checked=True):
+        plan = None
+        try:
+            for plan in self._stage_plan(scenarios):
+                pass
+        except (KeyError, IndexError) as e: # slots the 'x' approaches can't extend
+            raise ValueError("Plan can't be compiled: {}".format(repr(e)))
+        if checked:
+            self._check_conflicts(plan)
+        return plan
+
+    async def compile_plan(self, scenarios, on_step=None):
+        '''Like _build_plan, but gives the loop back between the steps so the running plan keeps its timing.
+           on_step() is called after each step'''
+        plan = None
+        try:
+            for plan in self._stage_plan(scenarios):
+                if on_step is not None:
+                    on_step()
+                await asyncio.sleep_ms(0)
+        except (KeyError, IndexError) as e:
+            raise ValueError("Plan can't be compiled: {}".format(repr(e)))
+        self._check_conflicts(plan)
+        return plan
+
+    @staticmethod
+    def _check_conflicts(plan):
+        if plan.conflicting_slot is not None:
+            raise ValueError("Approaches that conflict are green together in slot {}".format(plan.conflicting_slot))
+
+    def _adopt(self, plan):
+        self._claim_pins(plan)
+        self.scenarios = plan.scenarios
+        self.g_states = plan.g_states
+        self.models = plan.models
+        self.transitions = plan.transitions
+        self.plan_version = plan.plan_version
+        self.conflicting_slot = plan.conflicting_slot
+        self.green_mask = 0 # bits of the models showing green, the new plan numbers them anew
+
+    def _apply_settings(self):
+        '''Reads the settings a plan reload can change. The detector, flash and WiFi settings are only read
+           at start-up'''
+        self.get_ready_time = SETTINGS['get_ready_time']
+        self.power_saver_window = int(SETTINGS['power_saver_window'] * 1000)
+        # safe fixed-time plan until adaptive timing is available
+        self.fixed_wait_times = OrderedDict((name, SETTINGS['fixed_green_time']) for name in self.models)
+        if not self.adaptive:
+            self.wait_times = self.fixed_wait_times
+
+    def _swap_plan(self):
+        '''Swaps in the staged plan at the end of a phase without a green: every lamp goes red and the new plan
+           starts from its first slot after the all-red clearance. The plan was compiled beforehand, here only
+           references are moved'''
+        start = ticks_us()
+        plan, settings = self.pending_plan
+        self.pending_plan = None
+        for model in self.models.values():
+            new = plan.models.get(model.name)
+            if new is None or new.gpios.get('Red') is not model.gpios.get('Red'): # left the plan or gets new pins
+                for state_name in model.gpios:
+                    model.putOffLamp(state_name)
+                self._release_pins(model.name)
+            elif model.state.name != 'Red':
+                self.go_to_state(model, 'Red')
+        SETTINGS.update(settings)
+        self._adopt(plan)
+        self._apply_settings()
+        self.pedestrians.configure()
+        for model in self.models.values():
+            self.go_to_state(model, 'Red')
+        self.state_allotted_time = int(SETTINGS['all_red_time'] * 1000)
+        self._phase_end = ticks_add(ticks_ms(), self.state_allotted_time)
+        self.delay.trigger(self.state_allotted_time)
+        self._save_snapshot()
+        loader = self.plan_loader
+        loader.swap_us = ticks_diff(ticks_us(), start)
+        loader.wait_ms = ticks_diff(ticks_ms(), loader.staged_at)
+        _LOGGER.info("Plan {:08x} swapped in {} us, {} ms after it was staged".format(
+                     self.plan_version, loader.swap_us, loader.wait_ms))
 
     def _generate_global_states_from_scenarios(self):
         g_state_1 = []#['Green', 'Red', 'Red', 'Red']
         g_state_2 = []#['Yellow', 'Yellow', 'Red', 'Red']
         g_id = None
-        for value in SCENARIOS.values():
+        for value in self.scenarios.values():
             if isinstance(value, list):
                 if value[0]['status'] == 'On':
                     g_state_1.append(value[0]['initial'])
@@ -327,20 +480,20 @@ class StateMachine(object):
             else:
                 g_state_2.append('Red')
 
-        for i in range([value[0]['status']if isinstance(value, list) else value['status']for value in SCENARIOS.values()].count('On'),0,-1):
+        for i in range([value[0]['status']if isinstance(value, list) else value['status']for value in self.scenarios.values()].count('On'),0,-1):
             self.g_states.append(g_state_1[i:]+g_state_1[:i])
             self.g_states.append(g_state_2[i:]+g_state_2[:i])
 
     #todo: link a model to another here.
     def _add_models(self): #(self, lamp_location, number_of_bulbs=3, states=[], initial=None, loop=True, ordered_transition=True):
-        for value in SCENARIOS.values():
+        for value in self.scenarios.values():
             if isinstance(value, list):
                 for val in value:
                     if val['status'] == 'On':
                         name = val['name']
                         #if not name.startswith('*'):
                         self.models[name] = Lamps(val['name'], val['states'], 'Dummy', val['bulbs'])
-                        _LOGGER.info(f"Created model: {val['name']} with GPIO {self.models[name].gpios}")
+                        _LOGGER.info(f"Created model: {val['name']}")
                         #else:
                             #_LOGGER.info(f"Model: {val['name']} already created")
                     else:
@@ -349,14 +502,14 @@ class StateMachine(object):
                 if value['status'] == 'On':
                         name = value['name']
                         self.models[name] = Lamps(value['name'], value['states'], 'Dummy', value['bulbs'])
-                        _LOGGER.info(f"Created model: {value['name']} with GPIO {self.models[name].gpios}")
+                        _LOGGER.info(f"Created model: {value['name']}")
                 else:
                     _LOGGER.info(f"Model: {value['name']} is off!")
 
     def _add_g_states_to_models(self):
         for states in self.g_states:
             #for k, model in enumerate(self.models.values()):
-            for k, value in enumerate(SCENARIOS.values()):
+            for k, value in enumerate(self.scenarios.values()):
                 if isinstance(value, list):
                     for val in value:
                         self.models[val['name']].ordered_states.append(states[k]) if val['status']=='On' else None
@@ -364,7 +517,7 @@ class StateMachine(object):
                     self.models[value['name']].ordered_states.append(states[k]) if value['status']=='On' else None
 
     def _modify_model_ordered_state(self):
-        for k, value in enumerate(SCENARIOS.values()):
+        for k, value in enumerate(self.scenarios.values()):
             if isinstance(value, list):
                     for val in value:
                         if val['name'].endswith('x'):
@@ -377,29 +530,145 @@ class StateMachine(object):
                     self.models[value['name'].rstrip('x')].ordered_states[g_index] = 'Green'
                     self.models[value['name'].rstrip('x')].ordered_states[g_index+1] = 'Yellow_Green'
 
+    def _build_successors(self):
+        for model in self.models.values():
+            model.build_successors()
+
     @staticmethod
     def _add_states(model, states):# this method can only be called in the lamp models
         for state_name in states:
             model.states[state_name] = getattr(sys.modules[__name__], state_name)()
 
+    @staticmethod
+    def _has_pins(name, states, number_of_bulbs):
+        '''True if approach name already has pins for the lamps of states, from an earlier plan'''
+        pins = StateMachine.lamp_pins.get(name)
+        return pins is not None and sorted(pins) == sorted(state_name.split('_')[0]
+                                                           for state_name in states[:number_of_bulbs])
+
     @staticmethod
     def _add_pins(model, states, number_of_bulbs):
-        for pin, state_name in enumerate(states[:number_of_bulbs]):
-            #print(StateMachine.gpios[pin])
-            model.gpios[state_name.split('_')[0]] = Pin(StateMachine.gpios[pin], Pin.OUT)
-        del StateMachine.gpios[:number_of_bulbs]
+        '''Gives model the pins its approach has in the running plan. Lamps the running plan has no pins for are
+           listed in model.unclaimed and get theirs from the pool when the plan is adopted (see _claim_pins)'''
+        if StateMachine._has_pins(model.name, states, number_of_bulbs):
+            model.gpios.update(StateMachine.lamp_pins[model.name])
+            model.unclaimed = None
+        else:
+            model.unclaimed = [state_name.split('_')[0] for state_name in states[:number_of_bulbs]]
+
+    @staticmethod
+    def _claim_pins(plan):
+        '''Takes the pins of the plan's new lamps from the pool, only once the plan is adopted'''
+        for model in plan.models.values():
+            if model.unclaimed is None:
+                continue
+            numbers = StateMachine.gpios[:len(model.unclaimed)]
+            for gpio, state_name in zip(numbers, model.unclaimed):
+                model.gpios[state_name] = Pin(gpio, Pin.OUT)
+            del StateMachine.gpios[:len(numbers)]
+            StateMachine.lamp_pins[model.name] = dict(model.gpios)
+            StateMachine.pin_numbers[model.name] = numbers
+            model.unclaimed = None
+            _LOGGER.info(f"Lamps of {model.name} on GPIO {model.gpios}")
+
+    @staticmethod
+    def _release_pins(name):
+        '''Returns the pins of approach name to the pool'''
+        StateMachine.lamp_pins.pop(name, None)
+        StateMachine.gpios.extend(StateMachine.pin_numbers.pop(name, ()))
 
     @classmethod
     def _create_transition(cls, self, conditions=None, unless=None, before=None, after=None, prepare=None):
         for model in self.models.values():
-            cls.transitions.append(cls.transition_cls(model, conditions, unless, before, after, prepare))
+            self.transitions.append(cls.transition_cls(model, conditions, unless, before, after, prepare))
 
     def _run_transitions(self):
+        if self.flashing:
+            return
+        if self.pending_plan is not None and not any(model.state.name == 'Green' for model in self.models.values()):
+            self._swap_plan()
+            return
+        cycle_start = self.transitions[0].idx == 0
+        if cycle_start:
+            self.time_plans.step()
         for transition in self.transitions:
             transition.execute(self)
+        if cycle_start: # keeps the coordinated green on the corridor's schedule
+            self.state_allotted_time += self.coordinator.correction(self.state_allotted_time)
+        # a green serving a walk lasts at least until the walk has cleared
+        self.state_allotted_time = max(self.state_allotted_time, self.pedestrians.take_extension())
+        self._phase_end = ticks_add(ticks_ms(), self.state_allotted_time)
         self.delay.trigger(self.state_allotted_time)
+        self._save_snapshot(phase_change=True)
         _LOGGER.info(f"There will be transition in: {self.state_allotted_time}ms")
 
+    def _detector_pins(self):
+        return [detector for detectors in self.detectors.detectors.values() for detector in detectors]
+
+    def _save_snapshot(self, phase_change=False):
+        '''Writes slots, states, phase end, the phase's allotted time and detector counts to the snapshot store
+           (see snapshot.py). In flash a phase change is only written snapshot_file_interval after the last write,
+           plan and mode changes always are'''
+        if SETTINGS['snapshot'] is None:
+            return
+        if SETTINGS['snapshot'] == 'file':
+            now = ticks_ms()
+            if (phase_change and self._snapshot_at is not None
+                    and ticks_diff(now, self._snapshot_at) < SETTINGS['snapshot_file_interval'] * 1000):
+                return
+            self._snapshot_at = now
+        models = []
+        for transition in self.transitions:
+            model = transition.model
+            names = list(model.states)
+            state = names.index(model.state.name) if model.state.name in model.states else snapshot.NO_STATE
+            models.append((transition.idx, state))
+        end = snapshot.epoch_ms() + ticks_diff(self._phase_end, ticks_ms())
+        flags = snapshot.FLASHING if self.flashing else 0
+        allotted = max(self.state_allotted_time, 0)
+        pins = [detector.count for detector in self._detector_pins()]
+        snapshot.store.write(snapshot.pack(self.plan_version, end, allotted, flags, models, pins))
+
+    def _restore_snapshot(self):
+        '''Resumes the phase a reset interrupted, with the time it had left. False if there is no usable
+           snapshot: none, corrupt, of another format version or taken with another plan'''
+        if SETTINGS['snapshot'] is None:
+            return False
+        start = ticks_ms()
+        saved = snapshot.unpack(snapshot.store.read())
+        if saved is None:
+            return False
+        plan, end, allotted, flags, models, pins = saved
+        if plan != self.plan_version or len(models) != len(self.transitions):
+            _LOGGER.info("Snapshot of another plan, starting from the first slot")
+            return False
+        for transition, (slot, state) in zip(self.transitions, models):
+            if slot >= len(transition.model.ordered_states) or \
+                    state != snapshot.NO_STATE and state >= len(transition.model.states):
+                return False
+
+        for transition, (slot, state) in zip(self.transitions, models):
+            transition.idx = slot
+            if state != snapshot.NO_STATE:
+                self.go_to_state(transition.model, list(transition.model.states)[state])
+        detectors = self._detector_pins()
+        if len(pins) == len(detectors):
+            for detector, count in zip(detectors, pins):
+                detector.count = count
+            for name in self.detectors.detectors:
+                self.detectors._window_counts[name] = self.detectors.total(name)
+
+        if flags & snapshot.FLASHING:
+            self.FlashMode('(restored)')
+        else:
+            # never longer than the restored phase was allotted, in case the RTC was set since
+            self.state_allotted_time = allotted
+            remaining = min(max(end - snapshot.epoch_ms(), 1), max(allotted, 1))
+            self._phase_end = ticks_add(ticks_ms(), remaining)
+            self.delay.trigger(remaining)
+        _LOGGER.info("Resumed from snapshot in {} ms".format(ticks_diff(ticks_ms(), start)))
+        return True
+
     def go_to_state(self, model, state_name):
         self.g_current_states.append(state_name)# it can be any length due to the possibility of internal transitions
         if model.state:
@@ -409,9 +678,13 @@ class StateMachine(object):
         _LOGGER.debug('Entering {}'.format(model.state.name))
         #self.delay.trigger(self.state_allotted_time)
         model.state.enter(self, model)
+        if self.first_lamp is None:
+            self.first_lamp = ticks_ms() # ticks_ms counts from reset
+            profiler.mark('first lamp output')
+            profiler.report(_LOGGER)
 
     async def update(self):
-        self.wait_times = await get_wait_time() 
+        self.wait_times = await get_wait_time() if self.adaptive else self.fixed_wait_times
         await asyncio.sleep_ms(1)
         for state_name in self.g_current_states: #make sure this section and the associated state updates don't tie down
             #_LOGGER.info(f'Updating {state_name}')
@@ -420,9 +693,94 @@ class StateMachine(object):
             await asyncio.sleep_ms(1)
         self.g_current_states = []
 
+    def FlashMode(self, reason=''):
+        '''Takes the whole intersection into flash (night or fault operation): yellow lamps flash, approaches
+           without a yellow lamp flash red and crossings go dark. The cycle stays stopped until NormalMode'''
+        if self.flashing:
+            return
+        self.flashing = True
+        self.delay.stop()
+        for model in self.models.values():
+            for state_name in model.gpios:
+                model.putOffLamp(state_name)
+            model.flashLamp('Yellow' if 'Yellow' in model.gpios else 'Red')
+        for crossing in self.pedestrians.crossings:
+            crossing.cancel()
+            crossing.putOffLamp('Dont')
+        self._save_snapshot()
+        _LOGGER.info("Intersection in flash {}".format(reason))
+
+    def NormalMode(self):
+        '''Leaves flash through all-red and restarts the cycle from its first slot. Not while a conflict is
+           latched'''
+        if not self.flashing:
+            return
+        if self.fault is not None:
+            _LOGGER.error("Flash latched by the conflict monitor ({}), ClearFault first".format(self.fault))
+            return
+        for model in self.models.values():
+            self.go_to_state(model, 'Red')
+            for state_name in model.gpios:
+                if state_name != 'Red':
+                    model.putOffLamp(state_name)
+        for crossing in self.pedestrians.crossings:
+            crossing.putOnLamp('Dont')
+        for transition in self.transitions:
+            transition.idx = 0 if transition.model.loop_includes_initial else 1
+        self.flashing = False
+        self.state_allotted_time = int(SETTINGS['all_red_time'] * 1000)
+        self._phase_end = ticks_add(ticks_ms(), self.state_allotted_time)
+        self.delay.trigger(self.state_allotted_time)
+        self._save_snapshot()
+        _LOGGER.info("Intersection back in normal operation")
+
+    def conflict(self, reason):
+        '''Fail to flash: a green was about to conflict with the greens on. The flash stays latched, NormalMode is
+           refused until ClearFault'''
+        self.fault = reason
+        _LOGGER.error("Conflict monitor: {}".format(reason))
+        self.FlashMode('(conflict: {})'.format(reason))
+
+    def ClearFault(self):
+        '''Unlatches the conflict monitor, once the cause was put right, and leaves flash'''
+        self.fault = None
+        self.NormalMode()
+
+    def _on_detectors(self, bank):
+        if not self.flashing and bank.idle() >= self.power_saver_window:
+            self.PowerSaverMode()
+
     def PowerSaverMode(self):# enter the mode when the densities on all the paths are zero
-        '''Kills all the lamps and go to sleep. It wakes up when the flow rate has passed a threshold'''
-        pass
+        '''Kills all the lamps and go to sleep. It wakes up when the flow rate has passed a threshold:
+           the first vehicle on any detector. The phase is then restored as it was, with the time it had left.
+           With SETTINGS['power_saver_flash'] the lamps flash instead of going dark.'''
+        remaining = max(ticks_diff(self._phase_end, ticks_ms()), 1)
+        self.delay.stop()
+        for crossing in self.pedestrians.crossings:
+            crossing.cancel()
+        lamps = [(model, state_name) for model in list(self.models.values()) + self.pedestrians.crossings
+                 for state_name in model.gpios]
+        for model, state_name in lamps:
+            model.putOffLamp(state_name)
+        if SETTINGS['power_saver_flash']:
+            for model in self.models.values():
+                model.flashLamp('Yellow' if 'Yellow' in model.gpios else 'Red')
+        _LOGGER.info("Power saver: no vehicles for {} ms, sleeping".format(self.detectors.idle()))
+
+        woke = self.detectors.lightsleep(flasher)
+
+        for model, state_name in lamps: # stops the flashing
+            model.putOffLamp(state_name)
+        for model in self.models.values():
+            if model.state.name in model.states:
+                for state_name in model.state.name.split('_'):
+                    model.putOnLamp(state_name)
+        for crossing in self.pedestrians.crossings:
+            crossing.putOnLamp('Dont')
+        self._phase_end = ticks_add(ticks_ms(), remaining)
+        self.delay.trigger(remaining)
+        self.wake_latency = ticks_diff(ticks_ms(), woke)
+        _LOGGER.info("Power saver: woke up, phase restored in {} ms".format(self.wake_latency))
 
     def callbacks(self, funcs):
         """ Triggers a list of callbacks """
@@ -431,40 +789,35 @@ class StateMachine(object):
             _LOGGER.debug("{} Executed callback {}".format(self.name, func))
 
     def callback(self, func):
-        """ Trigger a callback function with passed event_data parameters. In case func is a string,
-            the callable will be resolved from the passed model in event_data. This function is not intended to
+        """ Trigger a callback function. Callback names have already been resolved by the
+            transition when they were registered (see resolve_callable). This function is not intended to
             be called directly but through state and transition callback definitions.
         Args:
-            func (str or callable): The callback function.
-                1. First, if the func is callable, just call it
-                2. Second, we try to import string assuming it is a path to a func
-                3. Fallback to a model attribute
-            event_data (EventData): An EventData instance to pass to the
-                callback (if event sending is enabled) or to extract arguments
-                from (if event sending is disabled).
+            func (callable): The callback function.
         """
 
-        func = self.resolve_callable(func)
         func()
 
 
     @staticmethod
-    def resolve_callable(func):
+    def resolve_callable(func, model=None):
         """ Converts a model's property name, method name or a path to a callable into a callable.
-            If func is not a string it will be returned unaltered.
+            If func is not a string it will be returned unaltered. Transitions call this once when
+            a callback is registered so that callbacks() only ever sees callables.
         Args:
             func (str or callable): Property name, method name or a path to a callable
-            event_data (EventData): Currently processed event
+            model (Lamps): Model the name is looked up on before trying a module path
         Returns:
             callable function resolved from string or func
         """
         if isinstance(func, str):
             try:
-                func = getattr(event_data.model, func)
-                if not callable(func):  # if a property or some other not callable attribute was passed
+                attr = getattr(model, func)
+                if not callable(attr):  # if a property or some other not callable attribute was passed
                     def func_wrapper(*_, **__):  # properties cannot process parameters
-                        return func
+                        return getattr(model, func)
                     return func_wrapper
+                return attr
             except AttributeError:
                 try:
                     module_name, func_name = func.rsplit('.', 1)
@@ -515,11 +868,21 @@ class Green(State):
         except KeyError:
             pass
 
+        if machine.green_mask & model.conflicts: # see conflicts.py
+            machine.conflict("{} green with {}".format(model.name, ', '.join(
+                other.name for other in machine.models.values() if machine.green_mask & model.conflicts & other.bit)))
+            return
+        machine.green_mask |= model.bit
+
         for state_name in self.name.split('_'):
             model.putOnLamp(state_name)
 
+        machine.pedestrians.green(model)
+
     def exit(self, machine, model):
         State.exit(self, machine, model)
+        machine.pedestrians.stop(model)
+        machine.green_mask &= ~model.bit
         for state_name in self.name.split('_'):
             model.putOffLamp(state_name)
 
@@ -602,6 +965,7 @@ class Lamps():
         self.number_of_bulbs = number_of_bulbs
 
         self.ordered_states = []
+        self.successors = [] # slot -> next slot of ordered_states, see build_successors
         self.loop = loop
         self.loop_includes_initial = loop_includes_initial
 
@@ -610,23 +974,139 @@ class Lamps():
         self.gpios = {}
         StateMachine._add_pins(self, states, number_of_bulbs)
 
+        self.bit = 0 # set with the conflict masks of the plan, see StateMachine._build_conflicts
+        self.conflicts = 0
+
         self.state = getattr(sys.modules[__name__], init_state)()
         self.states = {}
         StateMachine._add_states(self, states)
 
     def putOnLamp(self, state_name):
         print(f'put on {state_name} on pin {self.gpios[state_name]}')
+        self._stop_flash(state_name)
         self.gpios[state_name].on()
 
     def putOffLamp(self, state_name):
         print(f'put off {state_name} on pin {self.gpios[state_name]}')
+        self._stop_flash(state_name)
         self.gpios[state_name].off()
 
+    def build_successors(self):
+        '''Precomputes slot -> next slot for ordered_states. Call it again whenever ordered_states changes'''
+        last = len(self.ordered_states) - 1
+        if last < 1:
+            raise ValueError("Can't create ordered transitions on a Machine "
+                             "with fewer than 2 states.")
+        self.successors = list(range(1, last + 1)) + [0 if self.loop else last]
+
     def toggleLamp(self, state_name):
-        pass #toggle the misc lamp between red and green states
+        '''Inverts the lamp of state_name, a flashing lamp stops flashing'''
+        pin = self.gpios[state_name]
+        self._stop_flash(state_name)
+        pin.value(not pin.value())
 
     def flashLamp(self, state_name):
-        pass #flashes only the yellow lamp at a certain rate
+        '''Flashes the lamp of state_name at SETTINGS['flash_rate'] until putOnLamp or putOffLamp is called for it.
+           All flashing lamps share one hardware timer (see flasher.py)'''
+        flasher.add(self.gpios[state_name])
+
+    def _stop_flash(self, state_name):
+        flasher.remove(self.gpios[state_name])
+
+
+class Crossing(Lamps):
+    """ Pedestrian signal of a crossing that walks with the green of the approach it is named after.
+        Its lamps are 'Walk' and 'Dont' (don't walk) on the GPIOs given in PINS['PEDESTRIAN'], the call button
+        latches a request in Pedestrians.calls.
+    """
+
+    def __init__(self, lamp_location, gpios):
+        self.lamp_location = lamp_location
+        self.name = lamp_location
+        self._walk = None # task running the walk
+
+        self.gpios = {'Walk': Pin(gpios['walk'], Pin.OUT), 'Dont': Pin(gpios['dont_walk'], Pin.OUT)}
+        self.button = Pin(gpios['button'], Pin.IN, Pin.PULL_UP)
+
+        self.putOffLamp('Walk')
+        self.putOnLamp('Dont')
+
+    def walk(self, walk_ms, clearance_ms):
+        self.cancel()
+        self._walk = asyncio.create_task(self._run_walk(walk_ms, clearance_ms))
+
+    async def _run_walk(self, walk_ms, clearance_ms):
+        self.putOffLamp('Dont')
+        self.putOnLamp('Walk')
+        await asyncio.sleep_ms(walk_ms)
+        self.putOffLamp('Walk')
+        self.flashLamp('Dont')
+        await asyncio.sleep_ms(clearance_ms)
+        self.putOnLamp('Dont')
+        self._walk = None
+
+    def cancel(self):
+        '''Ends a running walk with a steady don't walk'''
+        if self._walk is not None:
+            self._walk.cancel()
+            self._walk = None
+            self.putOffLamp('Walk')
+            self.putOnLamp('Dont')
+
+
+class Pedestrians():
+    """ Pedestrian crossings of the intersection. A button press sets the bit of its crossing in calls from the
+        IRQ handler; the bit stays latched until the next green of the crossing's approach serves the walk.
+        Greens of approaches without a call carry no walk and are not stretched for one.
+        With SETTINGS['ped_recall'] every green serves its walk, as a fixed pedestrian phase would.
+    """
+
+    def __init__(self):
+        self.configure()
+
+        self.calls = 0 # bit i latched for crossings[i]
+        self.crossings = []
+        self._extension = 0
+        for name, gpios in PINS.get('PEDESTRIAN', {}).items():
+            crossing = Crossing(name, gpios)
+            crossing.button.irq(handler=self._irq_handler(1 << len(self.crossings)), trigger=Pin.IRQ_FALLING)
+            self.crossings.append(crossing)
+            _LOGGER.info(f"Created crossing: {name} with GPIO {crossing.gpios}")
+
+    def configure(self):
+        self.walk_time = int(SETTINGS['walk_time'] * 1000)
+        self.clearance_time = int(SETTINGS['ped_clearance_time'] * 1000)
+        self.recall = SETTINGS['ped_recall']
+
+    def _irq_handler(self, bit):
+        def press(pin):
+            self.calls |= bit
+        return press
+
+    def call(self, name):
+        '''Latches a walk request for the crossing of approach name, as its button would'''
+        for i, crossing in enumerate(self.crossings):
+            if crossing.name == name:
+                self.calls |= 1 << i
+
+    def green(self, model):
+        '''Starts the walk of model's crossing if it was called, a model may have no crossing'''
+        for i, crossing in enumerate(self.crossings):
+            if crossing.name == model.name and (self.recall or self.calls & (1 << i)):
+                self.calls &= ~(1 << i)
+                crossing.walk(self.walk_time, self.clearance_time)
+                self._extension = self.walk_time + self.clearance_time
+                _LOGGER.info(f"Walk on {crossing.name}")
+
+    def stop(self, model):
+        for crossing in self.crossings:
+            if crossing.name == model.name:
+                crossing.cancel()
+
+    def take_extension(self):
+        '''Minimum green in ms needed by the walks started since the last call'''
+        extension, self._extension = self._extension, 0
+        return extension
 
 
 def set_global_exception():
@@ -640,12 +1120,46 @@ def set_global_exception():
 
 
 
+async def join_wifi(machine):
+    '''Waits for the WiFi association started in boot.py while the lamps already run the fixed-time plan.
+       Adaptive timing is used while the link is up. A join that takes longer than wifi_timeout is restarted
+       with the credentials boot.py gave, doubling the timeout up to 8 times wifi_timeout.'''
+    import network
+    station = network.WLAN(network.STA_IF)
+    base_timeout = timeout = int(SETTINGS['wifi_timeout'] * 1000)
+    started = ticks_ms()
+    while True:
+        if station.isconnected():
+            if not machine.adaptive:
+                machine.adaptive = True
+                timeout = base_timeout
+                _LOGGER.info("WiFi up {} ms after reset {}, adaptive timing".format(ticks_ms(), station.ifconfig()))
+        elif machine.adaptive:
+            machine.adaptive = False
+            started = ticks_ms()
+            _LOGGER.info("WiFi lost, fixed-time plan")
+        elif ticks_diff(ticks_ms(), started) > timeout:
+            _LOGGER.info("WiFi join timed out after {} ms, retrying".format(ticks_diff(ticks_ms(), started)))
+            try:
+                station.disconnect()
+                station.connect()
+            except OSError as e:
+                _LOGGER.error("WiFi connect failed: {}".format(e))
+            started = ticks_ms()
+            timeout = min(2 * timeout, 8 * base_timeout)
+        await asyncio.sleep_ms(500)
+
+
 # Create the state machine
 fsm = StateMachine()
+profiler.mark('model build')
 
 
 async def main():
     set_global_exception()
+    asyncio.create_task(join_wifi(fsm))
+    fsm.link = MqttLink({plans.PLAN_TOPIC: fsm.plan_loader.on_message,
+                         CORRIDOR_TOPIC: fsm.coordinator.on_message}, _LOGGER)
     while True:
         #print('in main...')
         await fsm.update()
@@ -1,21 +1,32 @@
 
 from machine import Pin
 import sys
+import heapq
+from array import array
 from collections import OrderedDict
 import uasyncio as asyncio
 from machine import RTC
-import ntptime
+from utime import ticks_add, ticks_diff, ticks_ms
 
 from delay_ms import Delay_ms
+from detectors import DetectorBank
+from flasher import flasher
+from mqtt_link import MqttLink
 import ulogger
 
 from config import SCENARIOS, PINS, SETTINGS
 
 class Clock(ulogger.BaseClock):
+    ntp_host = "ntp.ntsc.ac.cn"
+
     def __init__(self):
         self.rtc = RTC()
-        ntptime.host = "ntp.ntsc.ac.cn"
-        #ntptime.settime()
+
+    def settime(self):
+        '''Sets the RTC from NTP. ntptime (and socket with it) is only imported here, once WiFi is up'''
+        import ntptime
+        ntptime.host = self.ntp_host
+        ntptime.settime()
 
     def __call__(self) -> str:
         y,m,d,_,h,mi,s,_ = self.rtc.datetime ()
@@ -42,6 +53,9 @@ handlers = (
 
 _LOGGER = ulogger.Logger(__name__, handlers)
 
+PREEMPT_TOPIC = b'preempt'
+PREEMPT_SLACK_MS = 50 # allowance for IRQ -> task wake-up and lamp switching on top of the clearance times
+
 class Condition(object):
     """ A helper class to call condition checks in the intended way.
     Attributes:
@@ -126,7 +140,7 @@ class Transition(object):
         self.add_callback('before', before)
         self.add_callback('after', after)
 
-        self.conditions = [self._check_model_priority]
+        self.conditions = [self.condition_cls(self._check_model_priority)]
         
         if conditions is not None:
             for cond in conditions:
@@ -186,50 +200,34 @@ class Transition(object):
         machine.go_to_state(self.model, self.dest)
 
     def _ordered_transitions(self):
-        """ Add a set of transitions that move linearly from state to state.
-        Args:
-            states (list): A list of state names defining the order of the
-                transitions. E.g., ['A', 'B', 'C'] will generate transitions
-                for A --> B, B --> C, and C --> A (if loop is True). If states
-                is None, all states in the current instance will be used.
-            loop (boolean): Whether to add a transition from the last
-                state to the first state.
-            loop_includes_initial (boolean): If no initial state was defined in
-                the machine, setting this to True will cause the _initial state
-                placeholder to be included in the added transitions. This argument
-                has no effect if the states argument is passed without the
-                initial state included.
+        """ Set dest to the state that follows the model's current state in its ordered_states.
+            The lookup goes through the successor table of the model (see Lamps.build_successors),
+            so it costs the same for any number of states.
         """
-        states = self.model.ordered_states
-        current_state_name = self.model.state.name
-
-        len_transitions = len(states)
-        if len_transitions < 2:
-            raise ValueError("Can't create ordered transitions on a Machine "
-                             "with fewer than 2 states.")
+        # successor table is built by Lamps.build_successors whenever ordered_states changes
+        state_id = self.model.state_ids.get(self.model.state.name)
+        if state_id is None: # not part of the cycle (e.g. the initial state), start from the beginning
+            self.dest = self.model.ordered_states[0]
+        else:
+            self.dest = self.model.ordered_states[self.model.successors[state_id]]
 
-        try:
-            self.dest = states[states.index(current_state_name)+1]
-        except IndexError:
-            self.dest = states[0]
-            
     def _check_source_dest(self):
-	if self.model.state.name == self.dest:
+        if self.model.state.name == self.dest:
             self.dest = None
 
     def _check_allowed_states(self):
         if not self.dest in self.model.states.keys():
             self.dest = None
-            
+
     def _check_model_priority(self):
-    	return self.model.priority == 0   	
-    	
+        return self.model.priority == 0
+
     # def _check_right_state(self):
-    # 	return self.model.state.name == 'Green'
-    	
+    #     return self.model.state.name == 'Green'
+
     def _remove_priority(self):
         if self.model.state.name == 'Red':
-    	    self.model.priority = None
+            self.model.priority = None
 
     def add_callback(self, trigger, func):
         """ Add a new before, after, or prepare callback.
@@ -238,6 +236,8 @@ class Transition(object):
                 'before', 'after' or 'prepare'.
             func (str or callable): The name of the callback function or a callable.
         """
+        if func is None:
+            return
         callback_list = getattr(self, trigger)
         callback_list.append(func)
 
@@ -288,8 +288,19 @@ class StateMachine(object):
 
         self.check_event_time = 0
 
+        self.min_green_time = int(SETTINGS['min_green_time'] * 1000)
+        self._next_green = None # approach waiting for the current greens to clear
+        self.power_saver_window = int(SETTINGS['power_saver_window'] * 1000)
+        self.wake_latency = None # ms from the last wake-up to restored lamps
+
         self._initialize_machine()
 
+        self.scheduler = PhaseScheduler()
+        self.preemption = Preemption(self)
+
+        self._served = {} # approach name -> detector total when it last had green
+        self.detectors = DetectorBank(listener=self._on_detectors)
+
     def _initialize_machine(self):
         self._add_models()
         self._create_transition(self)
@@ -307,7 +318,7 @@ class StateMachine(object):
             else:
                 if value['status'] == 'On':
                         name = value['name']
-                        self.models[name] = Lamps(value['name'], value['states'], val['initial'], value['bulbs'])
+                        self.models[name] = Lamps(value['name'], value['states'], value['initial'], value['bulbs'])
                         _LOGGER.info(f"Created model: {value['name']} with GPIO {self.models[name].gpios}")
                 else:
                     _LOGGER.info(f"Model: {value['name']} is off!")
@@ -331,6 +342,8 @@ class StateMachine(object):
             cls.transitions.append(cls.transition_cls(model, conditions, unless, before, after, prepare))
 
     def _run_transitions(self):
+        if self.preemption.active is not None: # lamps belong to the preemption until it hands them back
+            return
         for transition in self.transitions:
             transition.execute(self)
 
@@ -339,21 +352,86 @@ class StateMachine(object):
             _LOGGER.debug('Exiting {}'.format(model.state.name))
             model.state.exit(self, model)
         model.state = model.states[state_name]
+        model.entered = ticks_ms()
         _LOGGER.debug('Entering {}'.format(model.state.name))
         model.state.enter(self, model)
 
     async def update(self):
         #await asyncio.sleep_ms(self.check_event_time) #delay asking for new priority for at least previous wait time
-        #pubsub comm protocol to get the direction with the highest priority and the minimum time before checking back for an event (self.check_event_time)(make it async)
+        #pubsub comm protocol feeds self.scheduler.request() with the queue lengths of the approaches
         #set self.check_event_time
-        for model in self.models:
-            #model.priority = 0 if model.name ==  self.priority_model else None
-            await asyncio.sleep_ms(0)
-        #self._run_transitions() #event triggered transition
+        if self.preemption.active is None and not self.delay.running(): # no phase change in progress
+            self._next_phase()
+        await asyncio.sleep_ms(0)
+
+    def _on_detectors(self, bank):
+        '''Requests green for every approach with vehicles counted since its last green. Sleeps when no
+           vehicle was seen for power_saver_window and nothing is in progress'''
+        if (bank.idle() >= self.power_saver_window and self.preemption.active is None
+                and self._next_green is None and not self.delay.running()):
+            self.powerSaverMode()
+        for name, model in self.models.items():
+            if name not in bank.detectors:
+                continue
+            total = bank.total(name)
+            if model.state.name == 'Green':
+                self._served[name] = total
+            else:
+                queue_len = total - self._served.get(name, 0)
+                if queue_len and self.scheduler.queued(name) != queue_len:
+                    self.scheduler.request(name, queue_len)
+
+    def _next_phase(self):
+        '''Gives green to the best ranked waiting approach once the current greens have had their minimum time.
+           The greens and the new approach get priority 0, so their transitions run until the greens are Red
+           and the new approach is Green.'''
+        greens = [model for model in self.models.values() if model.state.name == 'Green']
+        target = self._next_green
+        if target is None:
+            now = ticks_ms()
+            for model in greens:
+                if ticks_diff(now, model.entered) < self.min_green_time:
+                    return
+            name = self.scheduler.pop()
+            if name is None or name not in self.models:
+                return
+            target = self.models[name]
+            if target.state.name == 'Green': # already being served
+                return
+            _LOGGER.info("Next green: {}".format(name))
+            for model in greens:
+                model.priority = 0
+        elif greens:
+            return
+        # a target without red and yellow would show green next to a yellow, it waits for the greens to clear
+        if greens and target.ordered_states[target.successors[target.state_ids[target.state.name]]] == 'Green':
+            self._next_green = target
+        else:
+            self._next_green = None
+            target.priority = 0
+        self._run_transitions() #event triggered transition
 
     def powerSaverMode(self):# enter the mode when the densities on all the paths are zero
-        '''Kills all the lamps and go to sleep. It wakes up when the flow rate has passed a threshold'''
-        pass
+        '''Kills all the lamps and go to sleep. It wakes up when the flow rate has passed a threshold:
+           the first vehicle on any detector. Only called at rest (no yellow running, no preemption),
+           so restoring the lamps of the current states restores the phase.'''
+        lamps = [(model, state_name) for model in self.models.values() for state_name in model.gpios]
+        for model, state_name in lamps:
+            model.putOffLamp(state_name)
+        if SETTINGS['power_saver_flash']:
+            for model in self.models.values():
+                model.flashLamp('Yellow' if 'Yellow' in model.gpios else 'Red')
+        _LOGGER.info("Power saver: no vehicles for {} ms, sleeping".format(self.detectors.idle()))
+
+        woke = self.detectors.lightsleep(flasher)
+
+        for model, state_name in lamps: # stops the flashing
+            model.putOffLamp(state_name)
+        for model in self.models.values():
+            for state_name in model.state.name.split('_'):
+                model.putOnLamp(state_name)
+        self.wake_latency = ticks_diff(ticks_ms(), woke)
+        _LOGGER.info("Power saver: woke up, phase restored in {} ms".format(self.wake_latency))
         
     def callbacks(self, funcs):
         """ Triggers a list of callbacks """
@@ -379,7 +457,7 @@ class StateMachine(object):
         func()
 
 
-     @staticmethod
+    @staticmethod
     def resolve_callable(func):
         """ Converts a model's property name, method name or a path to a callable into a callable.
             If func is not a string it will be returned unaltered.
@@ -494,18 +572,280 @@ class Yellow_Red(State):
         pass
 
 
+class PhaseScheduler(object):
+    """ Ranks the approaches waiting for green. The score of a request is
+            level * level_weight + queue length * queue_weight + seconds waited * aging_rate
+        with the weights from SETTINGS. All waiting requests age at the same rate, so two requests never swap
+        places while they wait and a binary heap keyed on aging_rate * arrival - static score keeps them in
+        order: request() and pop() are O(log n). Updating a request leaves its old heap entry behind marked
+        stale; stale entries are skipped when they reach the top.
+        Times are kept in ms on a counter that does not wrap, weights must be integers.
+    """
+
+    def __init__(self):
+        self.level_weight = SETTINGS['level_weight']
+        self.queue_weight = SETTINGS['queue_weight']
+        self.aging_rate = SETTINGS['aging_rate']
+
+        self._heap = []
+        self._entries = {} # name -> live heap entry [key, sequence, name, arrival, static score, queue_len]
+        self._sequence = 0 # ties go to the earlier request
+        self._now = 0
+        self._last = ticks_ms()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _clock(self):
+        now = ticks_ms()
+        self._now += ticks_diff(now, self._last)
+        self._last = now
+        return self._now
+
+    def request(self, name, queue_len=1, level=0):
+        '''Adds or updates the request of approach name. The waiting time counts from its first request,
+           queue_len 0 with level 0 withdraws it'''
+        now = self._clock()
+        entry = self._entries.pop(name, None)
+        arrival = now
+        if entry is not None:
+            arrival = entry[3]
+            entry[2] = None # stale
+        if queue_len <= 0 and level <= 0:
+            return
+        static = level * self.level_weight + queue_len * self.queue_weight
+        entry = [self.aging_rate * arrival - 1000 * static, self._sequence, name, arrival, static, queue_len]
+        self._sequence += 1
+        self._entries[name] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._entries) + 8: # drop stale entries, O(n) once per n updates
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapq.heapify(self._heap)
+
+    def queued(self, name):
+        '''Queue length of the waiting request of approach name, None if it does not wait'''
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        return entry[5]
+
+    def pop(self):
+        '''Removes and returns the name of the best ranked approach, None if nobody waits'''
+        heap = self._heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry[2] is not None:
+                del self._entries[entry[2]]
+                return entry[2]
+        return None
+
+    def score(self, name):
+        '''Current score of the request of approach name, None if it does not wait'''
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        return entry[4] + self.aging_rate * (self._clock() - entry[3]) // 1000
+
+
+class Preemption(object):
+    """ Emergency vehicle preemption. Requests come from detector pins (PINS['PREEMPT']) or MQTT messages
+        on PREEMPT_TOPIC. The greens of all other approaches are cut short through yellow and all-red
+        clearance, the requested approach gets green for SETTINGS['preempt_hold_time'] and the lamps are
+        then handed back to the normal plan.
+        The worst-case time from request to green is yellow + all-red + PREEMPT_SLACK_MS. It is checked
+        against SETTINGS['preempt_latency_budget'] when the machine is created.
+    Attributes:
+        active (str): Name of the approach being served, None when idle.
+        pending (int): Bitmask of waiting requests, bit i stands for names[i].
+        max_latency (int): Largest request to green time seen so far in ms.
+    """
+
+    rest_states = {'Yellow_Green': 'Red'} # state handed back after the preemption, if not the saved one
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.names = list(machine.models)
+
+        self.yellow_time = int(SETTINGS['get_ready_time'] * 1000)
+        self.all_red_time = int(SETTINGS['all_red_time'] * 1000)
+        self.hold_time = int(SETTINGS['preempt_hold_time'] * 1000)
+        self.budget = int(SETTINGS['preempt_latency_budget'] * 1000)
+        worst = self.yellow_time + self.all_red_time + PREEMPT_SLACK_MS
+        if worst > self.budget:
+            raise ValueError("Preemption needs {} ms worst case, more than the latency budget of {} ms".format(
+                             worst, self.budget))
+
+        self.active = None
+        self.pending = 0
+        self.requested = array('I', [0] * len(self.names)) # ticks_ms of the oldest waiting request
+        self.max_latency = 0
+        self._release = False
+        self._saved = []
+        self._flag = asyncio.ThreadSafeFlag()
+
+        self.pins = []
+        for name, gpio in PINS.get('PREEMPT', {}).items():
+            if name not in self.names:
+                _LOGGER.info(f"Preempt pin {gpio} ignored, no model named {name}")
+                continue
+            pin = Pin(gpio, Pin.IN)
+            pin.irq(handler=self._irq_handler(self.names.index(name)), trigger=Pin.IRQ_RISING)
+            self.pins.append(pin)
+
+        self._task = asyncio.create_task(self._run())
+
+    def _irq_handler(self, idx):
+        return lambda pin: self.request(idx)
+
+    def request(self, idx):
+        '''Registers a preempt request for approach number idx. Allocates nothing, so it can run in a hard IRQ'''
+        bit = 1 << idx
+        if not self.pending & bit: # debounce: the first edge of a request stamps its time
+            self.requested[idx] = ticks_ms()
+            self.pending |= bit
+        self._flag.set()
+
+    def request_name(self, name):
+        if name not in self.names:
+            _LOGGER.error(f"Preempt request for unknown approach {name}")
+            return
+        self.request(self.names.index(name))
+
+    def release(self):
+        '''Ends the hold of the approach being served'''
+        self._release = True
+        self._flag.set()
+
+    def on_message(self, topic, msg):
+        '''MQTT callback. The message names the approach to serve, b'clear' ends the current preemption'''
+        if topic != PREEMPT_TOPIC:
+            return
+        if msg == b'clear':
+            self.release()
+        else:
+            self.request_name(msg.decode())
+
+    async def _run(self):
+        while True:
+            await self._flag.wait()
+            while self.pending or self.active is not None:
+                if self.pending:
+                    await self._serve(self._oldest())
+                else:
+                    await self._restore()
+
+    def _oldest(self):
+        now = ticks_ms()
+        oldest, age = None, -1
+        for idx in range(len(self.names)):
+            if self.pending & (1 << idx) and ticks_diff(now, self.requested[idx]) > age:
+                oldest, age = idx, ticks_diff(now, self.requested[idx])
+        return oldest
+
+    async def _serve(self, idx):
+        machine = self.machine
+        name = self.names[idx]
+        bit = 1 << idx
+        queued = self.active is not None # waited for another emergency vehicle, the budget does not apply
+        if not queued:
+            self._saved = [(model, model.state.name) for model in machine.models.values()]
+            machine.delay.stop()
+        self.active = name
+        self._release = False
+
+        target = machine.models[name]
+        await self._clear(target)
+        if target.state.name != 'Green':
+            machine.go_to_state(target, 'Green')
+
+        latency = ticks_diff(ticks_ms(), self.requested[idx])
+        self.pending &= ~bit
+        if not queued:
+            self.max_latency = max(self.max_latency, latency)
+            if latency > self.budget:
+                _LOGGER.error(f"Preemption of {name} took {latency} ms, budget is {self.budget} ms")
+        _LOGGER.info(f"Preempted to {name} in {latency} ms")
+
+        hold_end = ticks_add(ticks_ms(), self.hold_time)
+        while not self._release:
+            if self.pending & bit: # repeated call from the approach being served extends the hold
+                self.pending &= ~bit
+                hold_end = ticks_add(ticks_ms(), self.hold_time)
+            left = ticks_diff(hold_end, ticks_ms())
+            if left <= 0:
+                break
+            await asyncio.sleep_ms(min(left, 100))
+
+    async def _clear(self, keep=None):
+        '''Takes every approach except keep to Red through yellow and all-red clearance. Time already spent
+           in yellow or red counts towards the clearance.'''
+        machine = self.machine
+        now = ticks_ms()
+        yellow = 0
+        for model in machine.models.values():
+            if model is keep:
+                continue
+            state_name = model.state.name
+            if state_name == 'Green' and 'Yellow_Green' in model.states:
+                machine.go_to_state(model, 'Yellow_Green')
+                yellow = self.yellow_time
+            elif state_name == 'Yellow_Green':
+                yellow = max(yellow, self.yellow_time - ticks_diff(now, model.entered))
+        if yellow > 0:
+            await asyncio.sleep_ms(yellow)
+
+        now = ticks_ms()
+        all_red = 0
+        for model in machine.models.values():
+            if model is keep:
+                continue
+            state_name = model.state.name
+            if state_name in ('Green', 'Yellow_Green'):
+                machine.go_to_state(model, 'Red')
+                all_red = self.all_red_time
+            elif state_name == 'Red':
+                all_red = max(all_red, self.all_red_time - ticks_diff(now, model.entered))
+            else: # red and yellow, traffic is already stopped
+                machine.go_to_state(model, 'Red')
+        if all_red > 0:
+            await asyncio.sleep_ms(all_red)
+
+    async def _restore(self):
+        '''Hands the lamps back to the normal plan in the states they rested in before the preemption'''
+        machine = self.machine
+        target = machine.models[self.active]
+        resume = [(model, self.rest_states.get(state_name, state_name)) for model, state_name in self._saved]
+        if target.state.name != dict(resume)[target]:
+            await self._clear()
+            if self.pending: # another emergency vehicle called during the clearance, serve it first
+                return
+        for model, state_name in resume:
+            if model.state.name != state_name:
+                machine.go_to_state(model, state_name)
+            if state_name == 'Red': # its green ended, see Transition._remove_priority
+                model.priority = None
+        _LOGGER.info(f"Preemption of {self.active} ended")
+        self.active = None
+        self._saved = []
+
+
 class Lamps():
 
-    def __init__(self, lamp_location, states, init_state='Dummy', number_of_bulbs=3):
-                
+    def __init__(self, lamp_location, states, init_state='Dummy', number_of_bulbs=3, loop=True,\
+                ordered_transition=True):
+
         self.priority = None
-        
+        self.entered = ticks_ms() # ticks_ms when the current state was entered
+
         self.lamp_location = lamp_location
         self.name = lamp_location
         self.number_of_bulbs = number_of_bulbs
 
+        self.loop = loop
+        self.ordered_transition = ordered_transition
         self.ordered_states = states
-        
+        self.build_successors()
+
         self.gpios = {}
         StateMachine._add_pins(self, states, number_of_bulbs)
 
@@ -515,17 +855,34 @@ class Lamps():
 
     def putOnLamp(self, state_name):
         print(f'put on {state_name} on pin {self.gpios[state_name]}')
+        flasher.remove(self.gpios[state_name])
         self.gpios[state_name].on()
 
     def putOffLamp(self, state_name):
         print(f'put off {state_name} on pin {self.gpios[state_name]}')
+        flasher.remove(self.gpios[state_name])
         self.gpios[state_name].off()
 
+    def build_successors(self):
+        '''Precomputes state ID -> next state ID for ordered_states. Call it again whenever ordered_states changes'''
+        last = len(self.ordered_states) - 1
+        if last < 1:
+            raise ValueError("Can't create ordered transitions on a Machine "
+                             "with fewer than 2 states.")
+        self.state_ids = {}
+        for state_id, state_name in enumerate(self.ordered_states):
+            self.state_ids.setdefault(state_name, state_id) # names repeat, a state name maps to its first slot
+        self.successors = list(range(1, last + 1)) + [0 if self.loop else last]
+
     def toggleLamp(self, state_name):
-        pass #toggle the misc lamp between red and green states
+        '''Inverts the lamp of state_name, a flashing lamp stops flashing'''
+        pin = self.gpios[state_name]
+        flasher.remove(pin)
+        pin.value(not pin.value())
 
     def flashLamp(self, state_name):
-        pass #flashes only the yellow lamp at a certain rate
+        '''Flashes the lamp of state_name until putOnLamp or putOffLamp is called for it (see flasher.py)'''
+        flasher.add(self.gpios[state_name])
 
 
 def set_global_exception():
@@ -545,6 +902,7 @@ fsm = StateMachine()
 
 async def main():
     set_global_exception()
+    fsm.link = MqttLink({PREEMPT_TOPIC: fsm.preemption.on_message}, _LOGGER)
     while True:
         #print('in main...')
         await fsm.update()
@@ -0,0 +1,60 @@
+""" Times building a machine with auto transitions, created lazily by pytransition against eagerly by transitions.
+
+    python tests/bench_auto.py [--states N ...] [--eager PATH]
+
+For every size a machine with N states, one model and auto_transitions on is built, and the time and the heap
+it holds afterwards are taken. The eager reference is transitions.core.Machine, which creates all N * N
+to_<state> transitions like pytransition.py did before, or the Machine of an older pytransition.py given
+with --eager. Needs transitions (see pt_core.py).
+"""
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pt_core
+
+
+def build(machine_cls, states):
+    class Model(object):
+        pass
+    names = ['s%d' % i for i in range(states)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    machine = machine_cls(Model(), states=names, initial=names[0])
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return machine, elapsed * 1000, held / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0].strip())
+    parser.add_argument('--states', type=int, nargs='+', default=[10, 100, 250, 500])
+    parser.add_argument('--eager', help='an older pytransition.py to use as the eager reference')
+    args = parser.parse_args()
+    if args.eager:
+        eager = pt_core.load(args.eager).Machine
+    else:
+        import transitions.core
+        eager = transitions.core.Machine
+    lazy = pt_core.load().Machine
+    print('%7s %12s %12s %12s %12s' % ('states', 'eager ms', 'eager KiB', 'lazy ms', 'lazy KiB'))
+    for states in args.states:
+        eager_machine, eager_ms, eager_kib = build(eager, states)
+        del eager_machine
+        lazy_machine, lazy_ms, lazy_kib = build(lazy, states)
+        model = lazy_machine.models[0]
+        model.trigger('to_s%d' % (states - 1)) # the lazy machine still works
+        assert model.state == 's%d' % (states - 1)
+        print('%7d %12.1f %12.0f %12.1f %12.0f' % (states, eager_ms, eager_kib, lazy_ms, lazy_kib))
+
+
+if __name__ == '__main__':
+    main()
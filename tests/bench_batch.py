@@ -0,0 +1,80 @@
+""" Times Machine.batch_dispatch against triggering every model on its own.
+
+    python tests/bench_batch.py [--models N ...] [--states S] [--before PATH]
+
+For every size, N models spread over S states are triggered with one event, first model by model (the
+per-model lookups batch_dispatch saves) and then with batch_dispatch. --before times the batch_dispatch of an
+older pytransition.py as well. The same is done on AsyncMachine, where the model triggers are gathered.
+Needs transitions (see pt_core.py).
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pt_core
+
+
+class Model(object):
+    pass
+
+
+def machine(machine_cls, models, states):
+    names = ['s%d' % i for i in range(states)]
+    transitions = [['next', names[i], names[(i + 1) % states]] for i in range(states)]
+    fsm = machine_cls([], states=names, initial=names[0], auto_transitions=False, transitions=transitions)
+    lamps = [Model() for _ in range(models)]
+    fsm.add_model(lamps)
+    for i, lamp in enumerate(lamps):
+        fsm.set_state(names[i % states], model=lamp)
+    return fsm
+
+
+def timed(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0].strip())
+    parser.add_argument('--models', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--states', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--before', help='an older pytransition.py whose batch_dispatch is timed as well')
+    args = parser.parse_args()
+    before = pt_core.load(args.before).Machine if args.before else None
+    pt = pt_core.load()
+    sys.path.insert(0, pt_core.ROOT)
+    import pytransition_async
+
+    print('%7s %14s %14s %14s %14s %14s' % ('models', 'per model ms', 'batch ms', 'before ms',
+                                             'async each ms', 'async batch ms'))
+    for models in args.models:
+        row = [models]
+        fsm = machine(pt.Machine, models, args.states)
+        row.append(timed(lambda: [lamp.next() for lamp in fsm.models], args.rounds))
+        row.append(timed(lambda: fsm.batch_dispatch('next'), args.rounds))
+        if before is not None:
+            old = machine(before, models, args.states)
+            row.append(timed(lambda: old.batch_dispatch('next'), args.rounds))
+        else:
+            row.append(float('nan'))
+        fsm = machine(pytransition_async.AsyncMachine, models, args.states)
+        loop = asyncio.new_event_loop()
+        async def each():
+            return await asyncio.gather(*[lamp.next() for lamp in fsm.models])
+
+        row.append(timed(lambda: loop.run_until_complete(each()), args.rounds))
+        row.append(timed(lambda: loop.run_until_complete(fsm.batch_dispatch('next')), args.rounds))
+        loop.close()
+        print('%7d %14.3f %14.3f %14.3f %14.3f %14.3f' % tuple(row))
+
+
+if __name__ == '__main__':
+    main()
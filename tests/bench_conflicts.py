@@ -0,0 +1,81 @@
+""" Times the conflict monitor's check of a green (conflicts.py) against a scan of the slot groups.
+
+    python tests/bench_conflicts.py [--approaches N ...] [--calls N]
+
+N approaches are put two to a slot, and the last approach is checked with every other approach green, the
+worst case for the scan. The check is what Green.enter does before a lamp goes on:
+machine.green_mask & model.conflicts. The scan is what it would take without the masks: every green on
+looked up in the slot groups for one shared with the new green. compile_masks, run once per plan, is timed as
+well. The loop overhead (an empty call) is taken off every figure.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conflicts
+
+
+class Machine(object):
+    pass
+
+
+class Model(object):
+    pass
+
+
+def timed(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def intersection(approaches):
+    names = ['A%d' % i for i in range(approaches)]
+    scenarios = {slot: [{'name': name, 'status': 'On'} for name in names[slot * 2:slot * 2 + 2]]
+                 for slot in range((approaches + 1) // 2)}
+    machine = Machine()
+    machine.models = {}
+    for i, (name, mask) in enumerate(zip(names, conflicts.compile_masks(scenarios, names))):
+        model = Model()
+        model.name, model.bit, model.conflicts = name, 1 << i, mask
+        machine.models[name] = model
+    model = machine.models[names[-1]]
+    others = [other for other in machine.models.values() if other is not model]
+    machine.green_mask = sum(other.bit for other in others)
+    machine.greens = [other.name for other in others]
+    return scenarios, names, machine, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--approaches', type=int, nargs='+', default=[4, 8, 16, 30])
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+    print('%10s %12s %12s %18s' % ('approaches', 'mask us', 'scan us', 'compile_masks us'))
+    for approaches in args.approaches:
+        scenarios, names, machine, model = intersection(approaches)
+        groups = conflicts.slot_groups(scenarios)
+
+        def mask():
+            return machine.green_mask & model.conflicts
+
+        def scan():
+            return [name for name in machine.greens
+                    if not any(model.name in group and name in group for group in groups)]
+
+        assert bool(mask()) == bool(scan())
+        empty = timed(lambda: None, args.calls)
+        print('%10d %12.3f %12.3f %18.1f' % (
+            approaches,
+            timed(mask, args.calls) - empty,
+            timed(scan, args.calls // 10) - empty,
+            timed(lambda: conflicts.compile_masks(scenarios, names), max(args.calls // 1000, 10)) - empty))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+""" Times the (source, trigger) index of pytransition.Machine against the scan it replaced.
+
+    python tests/bench_index.py [--states N ...] [--calls N]
+
+A chain of N states with one trigger leaving each is built. may_<trigger> (Machine._can_trigger) and
+get_triggers(state) are timed from the middle state, once through the index and once through the lookup
+pytransition.py did before it: every event of the machine checked for the source state. Needs transitions
+(see pt_core.py).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pt_core
+
+pt = pt_core.load()
+
+
+def scan_get_triggers(machine, state):
+    return [t for (t, ev) in machine.events.items() if state in ev.transitions]
+
+
+def scan_can_trigger(machine, model, trigger):
+    evt = pt.EventData(None, None, machine, model, (), {})
+    state = machine.get_model_state(model).name
+    for trigger_name in scan_get_triggers(machine, state):
+        if trigger_name != trigger:
+            continue
+        for transition in machine.events[trigger_name].transitions[state]:
+            try:
+                machine.get_state(transition.dest)
+            except ValueError:
+                continue
+            machine.callbacks(machine.prepare_event, evt)
+            machine.callbacks(transition.prepare, evt)
+            if all(c.check(evt) for c in transition.conditions):
+                return True
+    return False
+
+
+def timed(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def chain(states):
+    class Model(object):
+        pass
+    model = Model()
+    names = ['s%d' % i for i in range(states)]
+    machine = pt.Machine(model, states=names, initial=names[states // 2], auto_transitions=False)
+    for i in range(states - 1):
+        machine.add_transition('t%d' % i, names[i], names[i + 1])
+    return machine, model, names[states // 2], 't%d' % (states // 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1].strip())
+    parser.add_argument('--states', type=int, nargs='+', default=[10, 30, 100, 300])
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+    print('%7s %14s %14s %14s %14s' % ('states', 'may scan us', 'may index us', 'triggers scan', 'triggers index'))
+    for states in args.states:
+        machine, model, state, trigger = chain(states)
+        assert scan_can_trigger(machine, model, trigger) and machine._can_trigger(model, trigger)
+        assert scan_get_triggers(machine, state) == machine.get_triggers(state)
+        print('%7d %14.2f %14.2f %14.2f %14.2f' % (
+            states,
+            timed(lambda: scan_can_trigger(machine, model, trigger), args.calls),
+            timed(lambda: machine._can_trigger(model, trigger), args.calls),
+            timed(lambda: scan_get_triggers(machine, state), args.calls),
+            timed(lambda: machine.get_triggers(state), args.calls)))
+
+
+if __name__ == '__main__':
+    main()
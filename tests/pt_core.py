@@ -0,0 +1,29 @@
+""" Loads pytransition.py for the host tests and benchmarks.
+
+pytransition.py holds State and Machine only; Event, Transition, EventData and the helpers it uses are the
+ones of transitions.core (pip install transitions==0.9.0). load() runs the upstream core and pytransition.py
+in one module namespace, registered as 'pytransition' so pickling and the pytransition_* variants find it.
+"""
+
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(path=os.path.join(ROOT, 'pytransition.py')):
+    """ The module of path; loaded once, so the modules of one test run share its classes """
+    module = sys.modules.get('pytransition')
+    if module is not None and getattr(module, '__file__', None) == path:
+        return module
+    import transitions.core as core
+    module = types.ModuleType('pytransition')
+    module.__file__ = path
+    with open(core.__file__) as f:
+        source = f.read()
+    with open(path) as f:
+        source += '\n' + f.read()
+    sys.modules['pytransition'] = module
+    exec(compile(source, path, 'exec'), module.__dict__)
+    return module
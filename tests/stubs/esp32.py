@@ -0,0 +1,12 @@
+""" esp32 for the host tests """
+
+WAKEUP_ALL_LOW = 0
+WAKEUP_ANY_HIGH = 1
+
+
+def wake_on_ext0(pin=None, level=1):
+    pass
+
+
+def wake_on_ext1(pins=None, level=1):
+    pass
@@ -0,0 +1,101 @@
+""" machine for the host tests. Pins keep their value, timers and sleeps do nothing """
+
+import time
+
+
+class Pin(object):
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+    PULL_DOWN = 3
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    WAKE_LOW = 0
+    WAKE_HIGH = 1
+
+    def __init__(self, n, mode=None, pull=None, value=None):
+        self.n = n
+        self._value = value or 0
+        self.handler = None
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    __call__ = value
+
+    def irq(self, handler=None, trigger=None, wake=None, hard=False):
+        self.handler = handler
+        return self
+
+    def __repr__(self):
+        return 'Pin(%d)' % self.n
+
+
+class RTC(object):
+    _memory = b''
+
+    def datetime(self, value=None):
+        tm = time.localtime()
+        return (tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], 0)
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._memory
+        RTC._memory = bytes(data)
+
+
+class Timer(object):
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, n=-1):
+        self.callback = None
+
+    def init(self, mode=None, period=None, freq=None, callback=None):
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+
+PIN_WAKE = 2
+
+
+def lightsleep(ms=None):
+    pass
+
+
+def deepsleep(ms=None):
+    pass
+
+
+def reset_cause():
+    return 0
+
+
+def wake_reason():
+    return 0
+
+
+def unique_id():
+    return b'\x01\x02'
+
+
+def freq(hz=None):
+    return 240000000
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
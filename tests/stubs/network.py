@@ -0,0 +1,26 @@
+""" network for the host tests. The station is associated unless a test says otherwise """
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN(object):
+    connected = True
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+
+    def active(self, active=None):
+        return True
+
+    def connect(self, ssid=None, password=None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def isconnected(self):
+        return WLAN.connected
+
+    def ifconfig(self):
+        return ('192.168.100.10', '255.255.255.0', '192.168.100.1', '192.168.100.1')
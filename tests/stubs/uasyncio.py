@@ -0,0 +1,15 @@
+""" uasyncio for the host tests: asyncio with the MicroPython extras the controller uses """
+
+from asyncio import *
+import asyncio as _asyncio
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+class ThreadSafeFlag(_asyncio.Event):
+
+    async def wait(self):
+        await super().wait()
+        self.clear()
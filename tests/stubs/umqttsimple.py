@@ -0,0 +1,44 @@
+""" umqttsimple for the host tests: a broker in memory. Tests put messages in inbox and read outbox """
+
+
+class MQTTClient(object):
+    clients = []
+    fail_connect = False
+
+    def __init__(self, client_id, server, **kwargs):
+        self.client_id = client_id
+        self.server = server
+        self.callback = None
+        self.topics = []
+        self.inbox = []
+        self.outbox = []
+        self.polls = 0
+        self.broken = False
+        MQTTClient.clients.append(self)
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def connect(self):
+        if MQTTClient.fail_connect:
+            raise OSError(113) # ECONNABORTED
+        return 0
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, topic):
+        self.topics.append(topic)
+
+    def publish(self, topic, msg):
+        if self.broken:
+            raise OSError(104)
+        self.outbox.append((topic, msg))
+
+    def check_msg(self):
+        self.polls += 1
+        if self.broken:
+            raise OSError(104) # ECONNRESET
+        if self.inbox:
+            topic, msg = self.inbox.pop(0)
+            self.callback(topic, msg)
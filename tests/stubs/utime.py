@@ -0,0 +1,37 @@
+""" utime for the host tests. The ticks follow clock(), which a test may replace by its event loop's time """
+
+import time as _time
+
+clock = _time.monotonic
+
+
+def ticks_ms():
+    return int(clock() * 1000)
+
+
+def ticks_us():
+    return int(clock() * 1000000)
+
+
+def ticks_add(ticks, delta):
+    return ticks + delta
+
+
+def ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
+
+
+def sleep_us(us):
+    _time.sleep(us / 1000000)
+
+
+sleep = _time.sleep
+time = _time.time
+time_ns = _time.time_ns
+gmtime = _time.gmtime
+localtime = _time.localtime
+mktime = _time.mktime
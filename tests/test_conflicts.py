@@ -0,0 +1,135 @@
+""" Conflict monitor of conflicts.py against a hand-built matrix: run with python -m pytest tests
+
+The matrix is written out pair by pair, not derived from the scenarios, so compile_masks is checked against
+what the intersection allows rather than against itself. The running controller is driven into a conflicting
+green to see the flash latch. python tests/bench_conflicts.py times the check.
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import conflicts
+from test_snapshot import Board
+
+
+def slot(*approaches):
+    return [{'name': name, 'status': status} for name, status in approaches]
+
+
+# North and South together, South carried on by Southx, then West, then East and Eastx; Northx is switched off
+SCENARIOS = {1: slot(('North', 'On'), ('South', 'On'), ('Northx', 'Off')),
+             2: {'name': 'Southx', 'status': 'On'},
+             3: slot(('West', 'On')),
+             4: slot(('East', 'On'), ('Eastx', 'On'))}
+NAMES = ['North', 'South', 'Southx', 'West', 'East', 'Eastx', 'Northx']
+# 1 where the approaches of row and column must never be green together
+MATRIX = {'North':  '0 0 1 1 1 1 1',
+          'South':  '0 0 0 1 1 1 1',
+          'Southx': '1 0 0 1 1 1 1',
+          'West':   '1 1 1 0 1 1 1',
+          'East':   '1 1 1 1 0 0 1',
+          'Eastx':  '1 1 1 1 0 0 1',
+          'Northx': '1 1 1 1 1 1 0'}
+
+
+class Model(object):
+    """ What check_slots uses of a lamp model """
+
+    def __init__(self, i, mask, ordered_states):
+        self.bit = 1 << i
+        self.conflicts = mask
+        self.ordered_states = ordered_states
+
+
+def test_slot_groups():
+    assert conflicts.slot_groups(SCENARIOS) == [
+        {'North', 'South'}, {'Southx', 'South'}, {'West'}, {'East', 'Eastx'}]
+
+
+def test_masks_match_the_matrix():
+    masks = conflicts.compile_masks(SCENARIOS, NAMES)
+    for name, mask in zip(NAMES, masks):
+        row = MATRIX[name].split()
+        assert [str(mask >> j & 1) for j in range(len(NAMES))] == row, name
+    assert all(masks[i] >> j & 1 == masks[j] >> i & 1 for i in range(len(NAMES)) for j in range(len(NAMES)))
+
+
+def test_mask_order_follows_names():
+    names = list(reversed(NAMES))
+    masks = dict(zip(NAMES, conflicts.compile_masks(SCENARIOS, NAMES)))
+    for name, mask in zip(names, conflicts.compile_masks(SCENARIOS, names)):
+        assert [mask >> j & 1 for j in range(len(names))] == \
+            [masks[name] >> NAMES.index(other) & 1 for other in names]
+
+
+def test_too_many_approaches():
+    names = ['A%d' % i for i in range(conflicts.MAX_APPROACHES + 1)]
+    with pytest.raises(ValueError, match='At most 30 approaches'):
+        conflicts.compile_masks({1: slot((names[0], 'On'))}, names)
+    assert len(conflicts.compile_masks({1: slot((names[0], 'On'))}, names[:-1])) == conflicts.MAX_APPROACHES
+
+
+def models(states):
+    names = list(states)
+    masks = conflicts.compile_masks(SCENARIOS, names)
+    return [Model(i, mask, states[name].split()) for i, (name, mask) in enumerate(zip(names, masks))]
+
+
+def test_check_slots():
+    # the slots as _modify_model_ordered_state lays them out, South green on through Southx's slot
+    good = {'North':  'Green Yellow_Green Red Red Red Red Red Red Yellow_Red',
+            'South':  'Green Green Green Yellow_Green Red Red Red Red Yellow_Red',
+            'Southx': 'Red Red Green Green Red Red Red Red Red',
+            'West':   'Red Red Red Red Green Yellow_Green Red Red Red',
+            'East':   'Red Red Red Red Red Red Green Yellow_Green Red'}
+    assert conflicts.check_slots(models(good)) is None
+    assert conflicts.check_slots([]) is None
+
+    bad = dict(good, Southx='Red Red Green Green Green Red Red Red Red') # Southx green with West
+    assert conflicts.check_slots(models(bad)) == 4
+    bad = dict(good, West='Red Red Red Red Green Yellow_Green Green') # West green with East, shorter list
+    assert conflicts.check_slots(models(bad)) == 6
+    bad = dict(good, East='Green') # with North and South, in the first slot already
+    assert conflicts.check_slots(models(bad)) == 0
+
+
+@pytest.fixture
+def board(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    monkeypatch.setitem(config.SETTINGS, 'snapshot', None)
+    monkeypatch.delitem(sys.modules, 'state_machine', raising=False)
+    board = Board(monkeypatch)
+    board.reset()
+    yield board
+    board.close()
+
+
+def test_compiled_plan_has_no_conflicting_slot(board):
+    fsm = board.fsm
+    assert fsm.conflicting_slot is None
+    assert [model.bit for model in fsm.models.values()] == [1 << i for i in range(len(fsm.models))]
+    assert dict(zip(fsm.models, conflicts.compile_masks(config.SCENARIOS, list(fsm.models)))) == \
+        {name: model.conflicts for name, model in fsm.models.items()}
+
+
+def test_conflicting_green_latches_flash(board):
+    board.run(1)
+    fsm = board.fsm
+    assert board.states()['North'] == 'Green' and board.states()['West'] == 'Red'
+    west = fsm.models['West']
+    board.do(fsm.go_to_state, west, 'Green')
+    assert fsm.flashing and fsm.fault.startswith('West green with North')
+    assert not west.gpios['Green'].value()
+    board.do(fsm.NormalMode)
+    assert fsm.flashing # latched
+    board.do(fsm.ClearFault)
+    assert not fsm.flashing and fsm.fault is None
+    board.run(60)
+    assert not fsm.flashing and fsm.fault is None
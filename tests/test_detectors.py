@@ -0,0 +1,109 @@
+""" Detector inputs of detectors.py fed through their IRQ handler on a virtual clock: run with python -m pytest tests """
+
+import asyncio
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import utime
+import detectors
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.ms = 1000
+
+    def __call__(self):
+        return self.ms / 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(utime, 'clock', clock)
+    return clock
+
+
+def edge(detector, clock, at, level):
+    clock.ms = at
+    detector.pin.value(level)
+    detector._isr(detector.pin)
+
+
+def vehicles(detector, clock, start, spacing, occupied, n):
+    '''n vehicles every spacing ms from start, each holding the detector for occupied ms'''
+    for i in range(n):
+        edge(detector, clock, start + i * spacing, 1)
+        edge(detector, clock, start + i * spacing + occupied, 0)
+
+
+def test_counts_and_occupied_time(clock):
+    detector = detectors.Detector('North', 34, size=64, debounce_ms=30)
+    vehicles(detector, clock, 2000, 1000, 400, 10)
+    assert detector.drain() == 20
+    assert (detector.count, detector.occupied, detector.dropped) == (10, 4000, 0)
+    assert detector.close_window(clock.ms) == 4000 and detector.occupied == 0
+
+
+def test_bounces_are_ignored(clock):
+    detector = detectors.Detector('North', 34, size=64, debounce_ms=30)
+    edge(detector, clock, 2000, 1)
+    for at in (2005, 2010, 2020): # chatter of the loop
+        edge(detector, clock, at, at % 2)
+    edge(detector, clock, 2500, 0)
+    detector.drain()
+    assert (detector.count, detector.occupied, detector.min_gap) == (1, 500, 500)
+
+
+def test_occupation_is_split_at_the_window_boundary(clock):
+    detector = detectors.Detector('North', 34)
+    edge(detector, clock, 2000, 1)
+    detector.drain()
+    assert detector.close_window(2600) == 600
+    edge(detector, clock, 3000, 0)
+    detector.drain()
+    assert detector.close_window(4000) == 400 and detector.count == 1
+
+
+def test_full_buffer_drops_and_counts_edges(clock):
+    detector = detectors.Detector('North', 34, size=8, debounce_ms=30)
+    vehicles(detector, clock, 2000, 200, 100, 6) # 12 edges, 7 fit
+    assert detector.dropped == 5
+    assert detector.drain() == 7
+    assert detector.count == 4 and detector.occupied == 300
+    vehicles(detector, clock, 5000, 200, 100, 2) # room again once drained, the lost off edge is not counted
+    assert detector.drain() == 4 and detector.dropped == 5
+    assert detector.count == 5
+
+
+def test_peak_rate_is_the_shortest_interval(clock):
+    '''A burst shorter than the drain period is not averaged away by the quiet time around it'''
+    detector = detectors.Detector('North', 34, size=64, debounce_ms=30)
+    assert detector.drain() == 0 and detector.peak_rate == 0
+    edge(detector, clock, 2000, 1)
+    detector.drain()
+    assert detector.min_gap == detectors.NO_GAP and detector.peak_rate == 0 # one edge has no rate
+    edge(detector, clock, 2040, 0) # 40 ms: 25 edges per second
+    vehicles(detector, clock, 10000, 1000, 500, 3)
+    detector.drain()
+    assert detector.min_gap == 40 and detector.peak_rate == 25
+
+
+def test_bank_publishes_counts_and_occupancy(clock):
+    async def make():
+        return detectors.DetectorBank(pins={'North': [34, 35], 'West': 36})
+    bank = asyncio.run(make()) # drained by hand below, its task ends with the loop
+    north, second = bank.detectors['North']
+    vehicles(north, clock, 2000, 2000, 1000, 3)
+    vehicles(second, clock, 2000, 6000, 3000, 1)
+    bank.drain()
+    bank.close_window(10000)
+    assert bank.counts == {'North': 4, 'West': 0}
+    assert bank.occupancy == {'North': 0.3, 'West': 0}
+    assert bank.total('North') == 4 and bank.peak_rate('North') == 1 and bank.dropped('North') == 0
@@ -0,0 +1,124 @@
+""" MQTT link of the controllers (mqtt_link.py), run from their main() on a virtual clock
+
+The controllers start the link as a task of their uasyncio loop, so a message published to the broker reaches
+the part of the machine that takes its topic while the plan goes on. umqttsimple and network are the
+stand-ins of tests/stubs.
+"""
+
+import asyncio
+import os
+import sys
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import network
+import umqttsimple
+import utime
+from test_preemption_latency import VirtualLoop, load_controller
+
+GPIO_POOL = list(config.PINS['GPIO_POOL']) # a controller takes its lamps from the pool as it is imported
+CONTROLLERS = ('state_machine', 'state_machine_priority')
+
+
+@pytest.fixture
+def loop(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controllers log errors to logging.log
+    monkeypatch.setattr(umqttsimple.MQTTClient, 'clients', [])
+    monkeypatch.setattr(umqttsimple.MQTTClient, 'fail_connect', False)
+    monkeypatch.setattr(network.WLAN, 'connected', True)
+    monkeypatch.setitem(config.SETTINGS, 'time_server', '127.0.0.1')
+    monkeypatch.setitem(config.PINS, 'GPIO_POOL', list(GPIO_POOL))
+    for name in CONTROLLERS: # imported on this test's loop, which is closed after it
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    loop = VirtualLoop()
+    monkeypatch.setattr(utime, 'clock', loop.time)
+    asyncio.set_event_loop(loop)
+    yield loop
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    asyncio.set_event_loop(None)
+    for name in CONTROLLERS:
+        sys.modules.pop(name, None)
+
+
+def run(loop, controller, seconds, check=None):
+    async def session():
+        main = asyncio.create_task(controller.main())
+        await asyncio.sleep(seconds)
+        result = check() if check is not None else None
+        main.cancel()
+        return result
+    return loop.run_until_complete(session())
+
+
+def load_state_machine():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        import state_machine
+    return state_machine
+
+
+def test_preempt_messages_reach_the_preemption(loop):
+    async def load():
+        return load_controller()
+    controller = loop.run_until_complete(load())
+    preemption = controller.fsm.preemption
+    run(loop, controller, 5)
+    client = controller.fsm.link.client
+    assert client is not None and umqttsimple.MQTTClient.clients == [client]
+    assert controller.PREEMPT_TOPIC in client.topics
+    client.inbox.append((controller.PREEMPT_TOPIC, b'North'))
+    served = run(loop, controller, 20, lambda: preemption.active)
+    assert served == 'North'
+    assert client.polls > 100 # polled all along, between the phases
+    assert any(topic == b'hello Rpi, how are you doing' for topic, _ in client.outbox)
+    client.inbox.append((controller.PREEMPT_TOPIC, b'clear'))
+    run(loop, controller, 20)
+    assert preemption.active is None
+
+
+def test_plan_and_corridor_messages_reach_the_controller(loop, monkeypatch):
+    async def load():
+        return load_state_machine()
+    controller = loop.run_until_complete(load())
+    monkeypatch.setitem(config.SETTINGS, 'intersection', 'Main')
+    monkeypatch.setitem(config.SETTINGS, 'cycle_length', None)
+    monkeypatch.setitem(config.SETTINGS, 'offset', 0)
+    run(loop, controller, 5)
+    client = controller.fsm.link.client
+    import coordination
+    import plans
+    assert plans.PLAN_TOPIC in client.topics and coordination.CORRIDOR_TOPIC in client.topics
+    client.inbox.append((coordination.CORRIDOR_TOPIC, b'{"cycle": 90, "offsets": {"Main": 30}}'))
+    run(loop, controller, 2)
+    assert (config.SETTINGS['cycle_length'], config.SETTINGS['offset']) == (90, 30)
+
+
+def test_lost_connection_is_made_again(loop, monkeypatch):
+    async def load():
+        return load_controller()
+    controller = loop.run_until_complete(load())
+    monkeypatch.setattr(network.WLAN, 'connected', False)
+    run(loop, controller, 30)
+    link = controller.fsm.link
+    assert link.client is None and link.connects == 0 # waits for the WiFi
+    monkeypatch.setattr(network.WLAN, 'connected', True)
+    monkeypatch.setattr(umqttsimple.MQTTClient, 'fail_connect', True)
+    run(loop, controller, 30)
+    assert link.client is None and link.connects == 0
+    monkeypatch.setattr(umqttsimple.MQTTClient, 'fail_connect', False)
+    run(loop, controller, 15)
+    first = link.client
+    assert first is not None and link.connects == 1
+    first.broken = True
+    run(loop, controller, config.SETTINGS['mqtt_retry'] + 5)
+    assert link.client is not None and link.client is not first and link.connects == 2
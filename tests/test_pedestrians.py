@@ -0,0 +1,264 @@
+""" Pedestrian calls of state_machine.py (Crossing, Pedestrians) on a virtual clock
+
+    python -m pytest tests/test_pedestrians.py    or    python tests/test_pedestrians.py for the table
+
+The controller runs its fixed-time plan with 10 s greens and a crossing walking with North, Southx and West.
+A served call stretches the green of its approach to walk_time + ped_clearance_time (19 s). The simulation runs
+the controller for HOURS with button presses arriving at random per crossing, records every green and then
+discharges Poisson vehicle arrivals over those greens, one every HEADWAY seconds. ped_recall, a walk in every
+green, is what a fixed pedestrian phase costs.
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import warnings
+from collections import deque
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import network
+import utime
+from flasher import flasher
+from test_preemption_latency import VirtualLoop
+
+CROSSINGS = {'North': {'button': 35, 'walk': 2, 'dont_walk': 5},
+             'Southx': {'button': 36, 'walk': 16, 'dont_walk': 17},
+             'West': {'button': 39, 'walk': 19, 'dont_walk': 21}}
+RATES = {'North': 0.08, 'South': 0.04, 'Southx': 0.04, 'West': 0.06} # vehicles per second
+HEADWAY = 2 # seconds per discharged vehicle
+GREEN = 10 # fixed_green_time
+WALK = 19 # walk_time + ped_clearance_time
+HOURS = 4
+GPIO_POOL = list(config.PINS['GPIO_POOL']) # a controller takes its lamps from the pool as it is imported
+
+
+class Controller(object):
+    """ state_machine imported on a loop of its own, with the greens it gives recorded """
+
+    def __init__(self, patch, recall=False):
+        patch.setitem(config.PINS, 'GPIO_POOL', list(GPIO_POOL))
+        patch.setitem(config.PINS, 'PEDESTRIAN', CROSSINGS)
+        patch.setitem(config.SETTINGS, 'fixed_green_time', GREEN)
+        patch.setitem(config.SETTINGS, 'ped_recall', recall)
+        patch.setitem(config.SETTINGS, 'snapshot', None)
+        patch.setattr(network.WLAN, 'connected', False) # fixed-time plan
+        patch.delitem(sys.modules, 'state_machine', raising=False)
+        self.loop = VirtualLoop()
+        patch.setattr(utime, 'clock', self.loop.time)
+
+        async def load():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                import state_machine
+            return state_machine
+
+        with contextlib.redirect_stdout(io.StringIO()): # the lamps print every switch
+            self.module = self.loop.run_until_complete(load())
+        self.fsm = self.module.fsm
+        self.pedestrians = self.fsm.pedestrians
+        self.crossings = {crossing.name: crossing for crossing in self.pedestrians.crossings}
+        self.greens = {name: [] for name in self.fsm.models} # [start, end] in s
+        self.walks = {name: [] for name in CROSSINGS} # s the walks started
+        go_to_state = self.fsm.go_to_state
+
+        def record(model, state_name):
+            if state_name == 'Green':
+                self.greens[model.name].append([self.loop.time(), None])
+            elif model.state is not None and model.state.name == 'Green':
+                self.greens[model.name][-1][1] = self.loop.time()
+            go_to_state(model, state_name)
+
+        self.fsm.go_to_state = record
+        for crossing in self.pedestrians.crossings:
+            crossing.walk = self._walk_recorder(crossing)
+        self._main = self.loop.create_task(self.module.main())
+
+    def _walk_recorder(self, crossing):
+        walk = crossing.walk
+
+        def recorded(walk_ms, clearance_ms):
+            self.walks[crossing.name].append(self.loop.time())
+            walk(walk_ms, clearance_ms)
+        return recorded
+
+    def run(self, seconds, presses=()):
+        '''Runs the controller for seconds, pressing the buttons of presses [(s from now, crossing name)]'''
+        async def session():
+            start = self.loop.time()
+            for at, name in sorted(presses):
+                await asyncio.sleep(start + at - self.loop.time())
+                button = self.crossings[name].button
+                button.handler(button)
+            await asyncio.sleep(start + seconds - self.loop.time())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.loop.run_until_complete(session())
+
+    def do(self, func, *args):
+        '''func(*args) on the controller's loop, as its own tasks would call it'''
+        async def call():
+            return func(*args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.loop.run_until_complete(call())
+
+    def close(self):
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+        sys.modules.pop('state_machine', None)
+
+    def lamps(self, name):
+        '''(walk on, don't walk on, don't walk flashing) of the crossing of approach name'''
+        crossing = self.crossings[name]
+        return (crossing.gpios['Walk'].value(), crossing.gpios['Dont'].value(), flasher.flashing(crossing.gpios['Dont']))
+
+
+@pytest.fixture
+def controller(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    controller = Controller(monkeypatch)
+    yield controller
+    controller.close()
+
+
+def lengths(greens):
+    return [round(end - start) for start, end in greens if end is not None]
+
+
+def test_call_is_latched_until_the_next_green(controller):
+    controller.run(5) # North and South green, West red until 30 s
+    assert controller.greens['West'] == []
+    controller.run(1, presses=[(0, 'West')])
+    assert controller.pedestrians.calls == 1 << list(CROSSINGS).index('West')
+    assert controller.lamps('West') == (0, 1, False)
+    controller.run(25) # West green from 30 s
+    assert controller.walks['West'] and controller.pedestrians.calls == 0
+    assert controller.lamps('West') == (1, 0, False)
+    controller.run(7) # walk_time over
+    assert controller.lamps('West') == (0, 0, True) or controller.lamps('West') == (0, 1, True)
+    controller.run(12)
+    assert controller.lamps('West') == (0, 1, False)
+    assert lengths(controller.greens['West']) == [WALK] # the green carried the walk to its end
+
+
+def test_greens_without_a_call_are_not_stretched(controller):
+    controller.run(300)
+    yellow = config.SETTINGS['get_ready_time'] # Southx, without a yellow of its own, stays green through South's
+    assert {name: set(lengths(controller.greens[name])) for name in CROSSINGS} == {
+        'North': {GREEN}, 'Southx': {GREEN + yellow}, 'West': {GREEN}}
+    assert not any(controller.walks.values())
+    assert controller.lamps('North') == (0, 1, False)
+
+
+def test_press_during_the_green_waits_for_the_next_one(controller):
+    controller.run(35)
+    west = controller.greens['West']
+    assert len(west) == 1 and west[0][1] is None # West green since 30 s, no call
+    controller.run(30, presses=[(2, 'West'), (3, 'West')])
+    assert lengths(west) == [GREEN] and controller.walks['West'] == []
+    assert controller.pedestrians.calls # latched for the next West green
+    controller.run(60)
+    assert lengths(west) == [GREEN, WALK] and len(controller.walks['West']) == 1
+    assert controller.pedestrians.calls == 0
+
+
+def test_leaving_the_green_ends_the_walk(controller):
+    controller.run(1)
+    north = controller.fsm.models['North']
+    crossing = controller.crossings['North']
+    assert north.state.name == 'Green'
+    controller.pedestrians.call('North')
+    controller.do(controller.pedestrians.green, north) # as entering the Green state does
+    controller.run(1)
+    assert controller.lamps('North') == (1, 0, False)
+    controller.do(controller.pedestrians.stop, north) # as leaving it does
+    assert controller.lamps('North') == (0, 1, False) and crossing._walk is None
+    controller.run(30)
+    assert controller.lamps('North') == (0, 1, False)
+
+
+def vehicle_delay(greens, seed):
+    '''Average seconds from arrival to departure over all vehicles, discharged in the recorded greens'''
+    rng = random.Random(seed)
+    end = HOURS * 3600
+    delays = []
+    for name, rate in RATES.items():
+        queue = deque()
+        t = rng.expovariate(rate)
+        for start, stop in greens[name]:
+            stop = end if stop is None else stop
+            depart = start
+            while depart < stop:
+                while t <= depart:
+                    queue.append(t)
+                    t += rng.expovariate(rate)
+                if queue:
+                    delays.append(depart - queue.popleft())
+                    depart += HEADWAY
+                else:
+                    depart = max(depart + HEADWAY, t)
+        delays.extend(end - arrival for arrival in queue if arrival < end)
+    return sum(delays) / len(delays)
+
+
+def simulate(patch, calls_per_hour, seed=39):
+    '''(average vehicle delay, average cycle, max seconds from press to walk) with calls_per_hour per crossing,
+       None for recall'''
+    controller = Controller(patch, recall=calls_per_hour is None)
+    try:
+        rng = random.Random(seed)
+        presses = []
+        if calls_per_hour:
+            for name in CROSSINGS:
+                t = rng.expovariate(calls_per_hour / 3600)
+                while t < HOURS * 3600:
+                    presses.append((t, name))
+                    t += rng.expovariate(calls_per_hour / 3600)
+        controller.run(HOURS * 3600, presses)
+        starts = [start for start, _ in controller.greens['West']]
+        cycle = (starts[-1] - starts[0]) / (len(starts) - 1)
+        waits = []
+        for at, name in presses:
+            walks = [walk for walk in controller.walks[name] if walk >= at]
+            waits.append((walks[0] if walks else HOURS * 3600) - at)
+        return vehicle_delay(controller.greens, seed), cycle, max(waits, default=0)
+    finally:
+        controller.close()
+
+
+def test_actuated_walks_save_vehicle_delay(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    with monkeypatch.context() as patch:
+        recall, recall_cycle, _ = simulate(patch, None)
+    print('recall every green: %.1f s/veh, %.0f s cycle' % (recall, recall_cycle))
+    results = {}
+    for calls in (5, 20, 60):
+        with monkeypatch.context() as patch:
+            results[calls] = delay, cycle, wait = simulate(patch, calls)
+        print('%2d calls/h per crossing: %.1f s/veh, %.0f%% less, %.0f s cycle, press to walk at most %.0f s'
+              % (calls, delay, 100 * (1 - delay / recall), cycle, wait))
+        assert wait <= 2 * recall_cycle # every call is served within the next cycle
+    assert results[5][0] < 0.9 * recall
+    assert results[5][0] < results[20][0] < results[60][0] <= 1.02 * recall
+    assert results[5][1] < results[20][1] < results[60][1] <= recall_cycle
+
+
+if __name__ == '__main__':
+    import tempfile
+    patch = pytest.MonkeyPatch()
+    with tempfile.TemporaryDirectory() as tmp:
+        patch.chdir(tmp)
+        try:
+            test_actuated_walks_save_vehicle_delay(patch, tmp)
+        finally:
+            patch.undo()
@@ -0,0 +1,187 @@
+""" Delays under the aging PhaseScheduler of state_machine_priority.py against plain round-robin
+
+    python -m pytest tests/test_phase_scheduler.py    or    python tests/test_phase_scheduler.py for the table
+
+Four approaches with Poisson arrivals share one green. Every phase change costs LOST_TIME (yellow, all-red and
+start-up), a green discharges one vehicle every HEADWAY seconds. Round robin gives each approach
+fixed_green_time in turn, like the fixed-time plan. The scheduler policies run like StateMachine._next_phase:
+the queue of every approach not on green is requested whenever it changes, and once the green has had
+min_green_time the best ranked request takes over. 'longest queue' is the scheduler with aging_rate 0.
+The delay of a vehicle is the time from its arrival to its departure, vehicles still queued at the end count
+with the time they waited so far.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import warnings
+from collections import deque
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import utime
+from test_preemption_latency import VirtualLoop
+
+RATES = {'North': 0.12, 'South': 0.08, 'West': 0.03, 'Southx': 0.008} # vehicles per second
+HEADWAY = 2 # seconds per discharged vehicle
+LOST_TIME = 7 # seconds lost at every phase change
+HOURS = 4
+STARVATION_BOUND = 300 # seconds no vehicle waits longer than under the aging scheduler
+
+
+class Intersection(object):
+    """ Queues of the approaches on a virtual clock, which the scheduler reads through utime """
+
+    def __init__(self, seed):
+        rng = random.Random(seed)
+        self.end = HOURS * 3600
+        self.arrivals = {}
+        for name, rate in RATES.items():
+            times = deque()
+            t = rng.expovariate(rate)
+            while t < self.end:
+                times.append(t)
+                t += rng.expovariate(rate)
+            self.arrivals[name] = times
+        self.queues = {name: deque() for name in RATES}
+        self.delays = {name: [] for name in RATES}
+        self.now = 0.0
+
+    def advance(self, seconds):
+        self.now += seconds
+        for name, times in self.arrivals.items():
+            while times and times[0] <= self.now:
+                self.queues[name].append(times.popleft())
+
+    def discharge(self, name):
+        if self.queues[name]:
+            self.delays[name].append(self.now - self.queues[name].popleft())
+
+    def report(self):
+        '''(average, max) delay in seconds per approach'''
+        result = {}
+        for name, delays in self.delays.items():
+            delays = delays + [self.end - arrival for arrival in self.queues[name]]
+            result[name] = (sum(delays) / len(delays), max(delays))
+        return result
+
+
+def round_robin(site, scheduler_cls):
+    green = config.SETTINGS['fixed_green_time']
+    while site.now < site.end:
+        for name in RATES:
+            site.advance(LOST_TIME)
+            for _ in range(green // HEADWAY):
+                site.discharge(name)
+                site.advance(HEADWAY)
+    return site.report()
+
+
+def scheduled(site, scheduler_cls):
+    scheduler = scheduler_cls()
+    min_green = config.SETTINGS['min_green_time']
+    green = None
+    started = 0
+    while site.now < site.end:
+        for name, queue in site.queues.items(): # what _on_detectors requests
+            if name != green and scheduler.queued(name) != len(queue):
+                scheduler.request(name, len(queue))
+        if green is None or site.now - started >= min_green:
+            name = scheduler.pop()
+            if name is not None:
+                green = name
+                site.advance(LOST_TIME)
+                started = site.now
+                continue
+        if green is not None:
+            site.discharge(green)
+        site.advance(HEADWAY)
+    return site.report()
+
+
+POLICIES = [('round robin', round_robin, None), ('longest queue', scheduled, 0), ('aging heap', scheduled, None)]
+
+
+def load_scheduler(patch):
+    '''PhaseScheduler of state_machine_priority, imported on a loop of its own and kept out of the other tests.
+       Returns it with the loop, which close() shuts down'''
+    patch.setitem(config.PINS, 'GPIO_POOL', list(config.PINS['GPIO_POOL'])) # the controller takes its lamps
+    patch.delitem(sys.modules, 'state_machine_priority', raising=False)
+    loop = VirtualLoop()
+    patch.setattr(utime, 'clock', loop.time)
+
+    async def load():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            import state_machine_priority
+        return state_machine_priority.PhaseScheduler
+
+    return loop.run_until_complete(load()), loop
+
+
+def close(loop):
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+    sys.modules.pop('state_machine_priority', None)
+
+
+@pytest.fixture
+def scheduler_cls(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    cls, loop = load_scheduler(monkeypatch)
+    yield cls
+    close(loop)
+
+
+def simulate(monkeypatch, scheduler_cls, seed=37):
+    '''{policy: {approach: (average, max) delay}}'''
+    results = {}
+    for policy, run, aging_rate in POLICIES:
+        site = Intersection(seed)
+        with monkeypatch.context() as patch:
+            patch.setattr(utime, 'clock', lambda: site.now)
+            if aging_rate is not None:
+                patch.setitem(config.SETTINGS, 'aging_rate', aging_rate)
+            results[policy] = run(site, scheduler_cls)
+    return results
+
+
+def print_table(results):
+    print('%-14s' % 'avg/max s' + ''.join('%12s' % name for name in RATES))
+    for policy, delays in results.items():
+        print('%-14s' % policy + ''.join('%12s' % ('%d/%d' % delays[name]) for name in RATES))
+
+
+@pytest.mark.parametrize('seed', [37, 38, 39])
+def test_aging_bounds_every_wait(monkeypatch, scheduler_cls, seed):
+    results = simulate(monkeypatch, scheduler_cls, seed)
+    print_table(results)
+    aging = results['aging heap']
+    assert max(delay[1] for delay in aging.values()) <= STARVATION_BOUND
+    # round robin lets the busy approach oversaturate, the queue alone lets the quiet one starve
+    assert results['round robin']['North'][1] > STARVATION_BOUND
+    assert results['longest queue']['Southx'][1] > STARVATION_BOUND
+    assert aging['North'][0] < results['round robin']['North'][0]
+    assert aging['Southx'][0] < results['longest queue']['Southx'][0]
+
+
+if __name__ == '__main__':
+    import tempfile
+    patch = pytest.MonkeyPatch()
+    with tempfile.TemporaryDirectory() as tmp:
+        patch.chdir(tmp)
+        cls, loop = load_scheduler(patch)
+        try:
+            print_table(simulate(patch, cls))
+        finally:
+            close(loop)
+            patch.undo()
@@ -0,0 +1,93 @@
+""" Lamp pins of plans staged and swapped in by state_machine.py: run with python -m pytest tests
+
+A plan is compiled while the running one goes on and may be dropped for a newer one before the next clearance,
+so only the swap may take pins from the pool, and it gives back those of the approaches that leave.
+"""
+
+import copy
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import utime
+from test_snapshot import Board, GPIO_POOL
+
+
+@pytest.fixture
+def board(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    monkeypatch.setitem(config.SETTINGS, 'snapshot', None)
+    monkeypatch.delitem(sys.modules, 'state_machine', raising=False)
+    board = Board(monkeypatch)
+    board.reset()
+    yield board
+    board.close()
+
+
+def scenarios(**names):
+    '''config.py's scenarios with approaches renamed, e.g. West='East' puts East's lamps in West's slot'''
+    plan = copy.deepcopy(config.SCENARIOS)
+    for value in plan.values():
+        for val in (value if isinstance(value, list) else [value]):
+            if val['status'] == 'On':
+                val['name'] = names.get(val['name'], val['name'])
+    return plan
+
+
+def pins(board):
+    return {name: [model.gpios[lamp] for lamp in sorted(model.gpios)] for name, model in board.fsm.models.items()}
+
+
+def swap(board, plan):
+    board.fsm.pending_plan = (plan, {})
+    board.fsm.plan_loader.staged_at = utime.ticks_ms()
+    board.do(board.fsm._swap_plan)
+
+
+def test_staging_takes_no_pins(board):
+    machine = board.module.StateMachine
+    pool = list(machine.gpios)
+    lamp_pins = dict(machine.lamp_pins)
+    running = pins(board)
+    assert len(pool) == 1
+    for _ in range(3): # staged and dropped for a newer one, as plans.py does
+        plan = board.fsm._build_plan(scenarios(West='East'))
+    assert machine.gpios == pool and machine.lamp_pins == lamp_pins
+    assert pins(board) == running
+    assert plan.models['East'].gpios == {} and plan.models['East'].unclaimed == ['Red', 'Yellow', 'Green']
+    assert plan.models['North'].gpios == board.fsm.models['North'].gpios # kept approaches share the pins
+
+
+def test_plan_needing_more_pins_than_are_freed_is_refused(board):
+    machine = board.module.StateMachine
+    pool = list(machine.gpios)
+    plan = scenarios()
+    plan[4]['status'] = 'On' # East joins, nobody leaves
+    with pytest.raises(ValueError, match='needs 3 more lamp GPIOs, 1 are left'):
+        board.fsm._build_plan(plan)
+    assert machine.gpios == pool
+
+
+def test_swap_claims_new_pins_and_releases_the_retired_ones(board):
+    machine = board.module.StateMachine
+    before = pins(board)
+    west = [pin.n for pin in before['West']]
+    swap(board, board.fsm._build_plan(scenarios(West='East')))
+    after = pins(board)
+    assert 'West' not in after and 'West' not in machine.lamp_pins and 'West' not in machine.pin_numbers
+    assert all(after[name] == before[name] for name in ('North', 'South', 'Southx')) # the same Pin objects
+    east = machine.pin_numbers['East']
+    assert len(east) == 3 and len(machine.gpios) == 1
+    assert sorted(east + machine.gpios) == sorted(west + GPIO_POOL[-1:]) # West's pins went to East
+    assert set(board.states().values()) == {'Red'}
+
+    swap(board, board.fsm._build_plan(config.SCENARIOS)) # and back
+    assert sorted(machine.pin_numbers) == ['North', 'South', 'Southx', 'West']
+    assert len(machine.gpios) == 1
+    assert sorted([n for numbers in machine.pin_numbers.values() for n in numbers] + machine.gpios) == sorted(GPIO_POOL)
@@ -0,0 +1,121 @@
+""" Request to green latency of the emergency vehicle preemption in state_machine_priority.py
+
+Runs the controller with the MicroPython stand-ins of tests/stubs on an event loop whose clock only moves when
+every task waits, so thousands of randomized requests take seconds. Requests arrive at random points of the
+normal plan, through the preempt pin and through MQTT messages on PREEMPT_TOPIC.
+"""
+
+import asyncio
+import os
+import random
+import selectors
+import sys
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import config
+import utime
+
+REQUESTS = 3000
+PREEMPT_PIN = {'North': 34}
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    """ Instead of waiting for the next timer, moves the clock to it """
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout:
+            self.now += timeout
+        return super().select(0)
+
+
+class VirtualLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self):
+        self.clock = VirtualSelector()
+        super().__init__(self.clock)
+
+    def time(self):
+        return self.clock.now
+
+
+def load_controller():
+    '''Imports state_machine_priority on the running loop. Its own asyncio.run() then fails at once, which the
+       module shrugs off, and fsm stays on this loop'''
+    config.PINS['PREEMPT'] = PREEMPT_PIN
+    config.SETTINGS['power_saver_window'] = 10 ** 6
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        import state_machine_priority
+    return state_machine_priority
+
+
+async def run(seed):
+    controller = load_controller()
+    fsm = controller.fsm
+    preemption = fsm.preemption
+    rng = random.Random(seed)
+
+    async def plan(): # the normal plan goes on between the preemptions
+        while True:
+            await asyncio.sleep(rng.uniform(0.5, 20))
+            if preemption.active is None:
+                fsm._run_transitions()
+
+    loop = asyncio.get_running_loop()
+    greens = [] # times the requested approach got green: _serve switches it right after its clearance
+    clear = preemption._clear
+
+    async def timed_clear(keep=None):
+        await clear(keep)
+        if keep is not None:
+            greens.append(loop.time())
+
+    preemption._clear = timed_clear
+    planner = asyncio.create_task(plan())
+    latencies = []
+    unsafe = 0
+    for _ in range(REQUESTS):
+        while preemption.active is not None:
+            await asyncio.sleep(0.25)
+        await asyncio.sleep(rng.uniform(0, 30))
+        name = rng.choice(preemption.names)
+        start = loop.time()
+        if name in PREEMPT_PIN and rng.random() < 0.5:
+            preemption.pins[0].handler(preemption.pins[0])
+        else:
+            preemption.on_message(controller.PREEMPT_TOPIC, name.encode())
+        bit = 1 << preemption.names.index(name)
+        while preemption.pending & bit or preemption.active != name:
+            await asyncio.sleep(0.1)
+        latencies.append(round((greens[-1] - start) * 1000))
+        unsafe += any(model.state.name != 'Red' for model in fsm.models.values() if model.name != name)
+        preemption.on_message(controller.PREEMPT_TOPIC, b'clear')
+    planner.cancel()
+    return preemption, latencies, unsafe
+
+
+def test_request_to_green_within_budget(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    loop = VirtualLoop()
+    monkeypatch.setattr(utime, 'clock', loop.time)
+    try:
+        preemption, latencies, unsafe = loop.run_until_complete(run(seed=36))
+    finally:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+    budget = int(config.SETTINGS['preempt_latency_budget'] * 1000)
+    assert len(latencies) == REQUESTS
+    assert max(latencies) <= budget
+    assert preemption.max_latency <= budget
+    assert unsafe == 0
@@ -0,0 +1,155 @@
+""" Steady-state triggers of pytransition.Machine must not allocate: run with python -m pytest tests
+
+Every self.method() call of a Machine allocates a bound method, as Machine.__getattr__ keeps CPython from
+calling methods without binding them; those are freed right away. What a trigger must not do is create its
+EventData, or anything as large, as pytransition did before it pooled them.
+"""
+
+import gc
+import itertools
+import tracemalloc
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+
+N = 1000
+
+
+class Lamp(object):
+    pass
+
+
+class Counted(pt.EventData):
+    made = 0
+
+    def __init__(self, *args, **kwargs):
+        Counted.made += 1
+        super(Counted, self).__init__(*args, **kwargs)
+
+
+def machine(**kwargs):
+    lamp = Lamp()
+    pt.Machine(lamp, states=['Red', 'Green'], initial='Red', auto_transitions=False,
+               transitions=[['go', 'Red', 'Green'], ['stop', 'Green', 'Red']], **kwargs)
+    return lamp
+
+
+def allocations(func):
+    """ (blocks, bytes) allocated by pytransition and still held after func(), and the peak above the start.
+        func runs once before the count, so the blocks the interpreter keeps in its free lists are traced already.
+    """
+    files = [tracemalloc.Filter(True, pt.__file__)]
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        func()
+        before = tracemalloc.take_snapshot().filter_traces(files)
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        after = tracemalloc.take_snapshot().filter_traces(files)
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    diff = after.compare_to(before, 'filename')
+    return sum(d.count_diff for d in diff), sum(d.size_diff for d in diff), peak
+
+
+def cycles(lamp, n):
+    go, stop = lamp.go, lamp.stop
+    for _ in itertools.repeat(None, n): # range would allocate the ints above 256
+        go()
+        stop()
+
+
+def peak(func):
+    """ Bytes allocated at most at once by func(), which runs once before the count """
+    func()
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+
+
+@pytest.mark.parametrize('send_event', [False, True])
+def test_triggers_hold_nothing(send_event):
+    lamp = machine(send_event=send_event)
+    blocks, size, _ = allocations(lambda: cycles(lamp, N))
+    assert blocks <= 0 and size <= 0 # below 0 when a free list hands blocks back
+    assert lamp.state == 'Red'
+
+
+def test_transient_memory_does_not_grow():
+    lamp = machine()
+    one = allocations(lambda: cycles(lamp, 1))[2]
+    many = allocations(lambda: cycles(lamp, N))[2]
+    assert many <= one
+
+
+def test_send_event_callbacks_keep_event_data():
+    kept = []
+    lamp = Lamp()
+    pt.Machine(lamp, states=['Red', 'Green'], initial='Red', auto_transitions=False, send_event=True,
+               transitions=[dict(trigger='go', source='Red', dest='Green', after=kept.append),
+                            dict(trigger='stop', source='Green', dest='Red', after=kept.append)])
+    lamp.go()
+    lamp.stop()
+    assert [evt.event.name for evt in kept] == ['go', 'stop']
+    assert [evt.state.name for evt in kept] == ['Green', 'Red']
+    assert all(evt.model is lamp and evt.result for evt in kept)
+
+
+def test_triggers_create_no_event_data(monkeypatch):
+    monkeypatch.setattr(pt, 'EventData', Counted)
+    lamp = machine()
+    cycles(lamp, 1)
+    Counted.made = 0
+    cycles(lamp, N)
+    assert Counted.made == 0
+    assert lamp.may_go() and Counted.made == 0
+
+
+def test_trigger_allocates_less_than_an_event_data():
+    lamp = machine()
+    go, stop = lamp.go, lamp.stop
+    loops = [itertools.repeat(None, N), itertools.repeat(None, N)] # made before the count
+
+    def run():
+        for _ in loops.pop():
+            go()
+            stop()
+
+    no_kwargs = {}
+    event_data = peak(lambda: pt.EventData(None, None, None, lamp, (), no_kwargs))
+    assert 0 < peak(run) < event_data
+
+
+def test_states_that_keep_event_data_get_their_own():
+    kept = []
+
+    class Keeping(pt.State): # like Timeout, which hands it to its timer
+        def enter(self, event_data):
+            kept.append(event_data)
+            super(Keeping, self).enter(event_data)
+
+    lamp = Lamp()
+    pt.Machine(lamp, states=[Keeping('Red'), Keeping('Green')], initial='Red', auto_transitions=False,
+               transitions=[['go', 'Red', 'Green'], ['stop', 'Green', 'Red']])
+    lamp.go()
+    lamp.stop()
+    assert [evt.state.name for evt in kept] == ['Green', 'Red']
+    assert all(evt.model is lamp and evt.event is not None for evt in kept)
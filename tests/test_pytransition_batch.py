@@ -0,0 +1,113 @@
+""" Machine.batch_dispatch of pytransition and pytransition_async: run with python -m pytest tests """
+
+import asyncio
+import os
+import sys
+from collections import defaultdict
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+sys.path.insert(0, pt_core.ROOT)
+
+import pytransition_async
+
+TRANSITIONS = [['go', 'Red', 'Green'], ['stop', 'Green', 'Red']]
+
+
+class Lamp(object):
+
+    def __init__(self):
+        self.entered = 0
+
+    def on_enter_Green(self):
+        self.entered += 1
+
+
+class Counting(defaultdict):
+    """ Event.transitions counting how often the transitions of a state are looked up """
+
+    def __init__(self, transitions):
+        super(Counting, self).__init__(list, transitions)
+        self.lookups = 0
+
+    def __getitem__(self, key):
+        self.lookups += 1
+        return super(Counting, self).__getitem__(key)
+
+    def __contains__(self, key):
+        self.lookups += 1
+        return super(Counting, self).__contains__(key)
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return super(Counting, self).get(key, default)
+
+
+def lamps(fsm, red, green):
+    models = [Lamp() for _ in range(red + green)]
+    fsm.add_model(models)
+    for lamp in models[red:]:
+        fsm.set_state('Green', model=lamp)
+    return models
+
+
+def test_transitions_are_looked_up_once_per_group():
+    fsm = pt.Machine([], states=['Red', 'Green'], initial='Red', auto_transitions=False,
+                     ignore_invalid_triggers=True, transitions=TRANSITIONS)
+    models = lamps(fsm, 60, 40)
+    event = fsm.events['go']
+    event.transitions = Counting(event.transitions)
+    results = fsm.batch_dispatch('go')
+    assert results == [True] * 60 + [False] * 40
+    assert event.transitions.lookups == 2
+    assert all(lamp.state == 'Green' and lamp.entered == (i < 60) for i, lamp in enumerate(models))
+
+
+def test_models_moved_by_an_earlier_model_are_triggered_on_their_own():
+    fsm = pt.Machine([], states=['Red', 'Green'], initial='Red', auto_transitions=False,
+                     ignore_invalid_triggers=True, transitions=TRANSITIONS)
+    first, second, third = lamps(fsm, 3, 0)
+    first.on_enter_Green = lambda: fsm.set_state('Green', model=second)
+    assert fsm.batch_dispatch('go') == [True, False, True]
+    assert [lamp.state for lamp in (first, second, third)] == ['Green'] * 3
+
+
+def test_invalid_source_still_raises():
+    fsm = pt.Machine([], states=['Red', 'Green'], initial='Red', auto_transitions=False, transitions=TRANSITIONS)
+    lamps(fsm, 1, 1)
+    with pytest.raises(pt.MachineError):
+        fsm.batch_dispatch('go')
+
+
+class AsyncLamp(Lamp):
+
+    async def on_enter_Green(self):
+        await asyncio.sleep(0.05)
+        self.entered += 1
+
+
+@pytest.mark.parametrize('queued', [False, True])
+def test_async_batch_dispatch_awaits_every_model(queued):
+    fsm = pytransition_async.AsyncMachine([], states=['Red', 'Green'], initial='Red', auto_transitions=False,
+                                          ignore_invalid_triggers=True, queued=queued, transitions=TRANSITIONS)
+    models = [AsyncLamp() for _ in range(20)]
+    fsm.add_model(models)
+    for lamp in models[15:]:
+        fsm.set_state('Green', model=lamp)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await fsm.batch_dispatch('go')
+        return results, loop.time() - start
+
+    results, elapsed = asyncio.run(run())
+    assert results == [True] * 15 + [queued] * 5 # queued triggers report that they were processed
+    assert all(lamp.state == 'Green' for lamp in models)
+    assert [lamp.entered for lamp in models] == [1] * 15 + [0] * 5
+    assert elapsed < 0.5 # concurrently, not 15 sleeps one after another
@@ -0,0 +1,70 @@
+""" Callback names of pytransition.Machine resolved through its cache: run with python -m pytest tests """
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+
+
+class Lamp(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def on_enter_Green(self):
+        self.calls.append('class')
+
+
+def machine(*models):
+    return pt.Machine(list(models), states=['Red', 'Green'], initial='Red', auto_transitions=False,
+                      transitions=[['go', 'Red', 'Green'], ['stop', 'Green', 'Red']])
+
+
+def test_reassigned_instance_callback_is_called():
+    lamp = Lamp()
+    machine(lamp)
+    lamp.go()
+    lamp.stop()
+    lamp.on_enter_Green = lambda: lamp.calls.append('instance')
+    lamp.go()
+    lamp.stop()
+    del lamp.on_enter_Green
+    lamp.go()
+    assert lamp.calls == ['class', 'instance', 'class']
+
+
+def test_reassigned_class_callback_is_called():
+    class Other(Lamp):
+        pass
+
+    lamp = Other()
+    machine(lamp)
+    lamp.go()
+    lamp.stop()
+    Other.on_enter_Green = lambda self: self.calls.append('patched')
+    lamp.go()
+    assert lamp.calls == ['class', 'patched']
+
+
+def test_models_do_not_share_entries():
+    first, second = Lamp(), Lamp()
+    fsm = machine(first)
+    first.go()
+    fsm.remove_model(first)
+    del first
+    fsm.add_model(second)
+    second.go()
+    assert second.calls == ['class']
+
+
+def test_resolve_callable_is_static():
+    lamp = Lamp()
+    fsm = machine(lamp)
+    event_data = pt.EventData(fsm.get_state('Red'), fsm.events['go'], fsm, lamp, (), {})
+    func = pt.Machine.resolve_callable('on_enter_Green', event_data)
+    func()
+    assert pt.Machine.resolve_callable(len, event_data) is len
+    assert lamp.calls == ['class']
@@ -0,0 +1,138 @@
+""" Convenience methods pytransition.Machine serves its models: run with python -m pytest tests """
+
+import gc
+import pickle
+import sys
+import tracemalloc
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+
+STATES = ['Red', 'Amber', 'Green']
+TRANSITIONS = [['go', 'Red', 'Green'], ['slow', 'Green', 'Amber'], ['stop', 'Amber', 'Red']]
+
+
+class Lamp(object):
+
+    def __init__(self):
+        self.calls = 0
+
+
+def machine(models, **kwargs):
+    return pt.Machine(models, states=STATES, initial='Red', transitions=TRANSITIONS, **kwargs)
+
+
+def held(func):
+    """ Bytes still held after func(), with what it returns kept alive """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        kept = func()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    del kept
+    return size
+
+
+@pytest.mark.parametrize('auto_transitions', [False, True])
+def test_model_size_does_not_grow_with_methods(auto_transitions):
+    '''Each model costs the same few hundred bytes (its __dict__, its state, its cache entry) whether it is the
+       only one or one of many, however many triggers the machine has, and using the methods stores nothing on it'''
+    fsm = machine([], auto_transitions=auto_transitions)
+
+    def add(n):
+        lamps = [Lamp() for _ in range(n)]
+        fsm.add_model(lamps)
+        for lamp in lamps:
+            lamp.go()
+            lamp.is_Green()
+            lamp.may_slow()
+            lamp.slow()
+            lamp.stop()
+        return lamps
+
+    add(1) # the served class and its methods
+    one = held(lambda: add(1))
+    many = held(lambda: add(100)) / 100
+    assert many <= one < 1024
+    lamp = fsm.models[-1]
+    assert set(vars(lamp)) == {'calls', 'state'}
+    assert lamp.go() and lamp.state == 'Green'
+
+
+def test_user_classes_are_left_untouched():
+    lamp = Lamp()
+    fsm = machine(lamp)
+    assert isinstance(lamp, Lamp) and type(lamp) is not Lamp
+    assert type(lamp) is fsm.model_class(Lamp)
+    assert not any(name in vars(Lamp) for name in ('go', 'trigger', 'is_Red', 'may_go'))
+    assert not hasattr(Lamp(), 'go')
+    assert not hasattr(pt.Machine, 'go') and not hasattr(pt.Machine, 'is_Red')
+    own = machine('self')
+    assert own.is_Red() and own.go() and own.is_Green()
+    assert not hasattr(machine([]), 'go')
+
+
+def test_machines_keep_their_own_methods():
+    first, second = Lamp(), Lamp()
+    machine(first)
+    pt.Machine(second, states=['Off', 'On'], initial='Off', transitions=[['go', 'Off', 'On']])
+    first.go()
+    second.go()
+    assert (first.state, second.state) == ('Green', 'On')
+    assert not hasattr(first, 'is_On') and not hasattr(second, 'is_Red')
+
+
+def test_models_of_the_machine_class_are_served():
+    fsm = machine([])
+    Served = fsm.model_class(Lamp)
+    lamp = Served() # how MicroPython, which can't move a model to another class, gets them
+    fsm.add_model(lamp)
+    assert type(lamp) is Served
+    assert lamp.go() and lamp.is_Green()
+
+
+def test_removed_transitions_are_no_longer_served():
+    lamp = Lamp()
+    fsm = machine(lamp)
+    fsm.remove_transition('go')
+    assert not hasattr(lamp, 'go')
+    assert lamp.may_slow() is False
+
+
+def test_existing_attributes_are_kept():
+    class Busy(Lamp):
+        def go(self):
+            return 'own'
+
+    lamp = Busy()
+    machine(lamp)
+    assert lamp.go() == 'own'
+    assert lamp.trigger('go') and lamp.is_Green()
+
+
+def test_served_models_pickle():
+    lamp = Lamp()
+    lamp.machine = machine(lamp)
+    lamp.go()
+    copy = pickle.loads(pickle.dumps(lamp))
+    assert type(copy) is not type(lamp) and isinstance(copy, Lamp)
+    assert copy.is_Green() and copy.slow() and copy.state == 'Amber'
+    assert lamp.state == 'Green'
+
+
+@pytest.mark.skipif(sys.implementation.name != 'cpython', reason='models are moved to the served class on CPython')
+def test_machine_pickles_with_itself_as_model():
+    fsm = machine('self')
+    fsm.go()
+    copy = pickle.loads(pickle.dumps(fsm))
+    assert copy.state == 'Green' and copy.slow() and copy.is_Amber()
+    assert fsm.is_Green()
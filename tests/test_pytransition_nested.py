@@ -0,0 +1,122 @@
+""" Compound and parallel states of pytransition_nested.HierarchicalMachine: run with python -m pytest tests """
+
+import sys
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+sys.path.insert(0, pt_core.ROOT)
+
+from pytransition_nested import HierarchicalMachine, MachineError
+
+STATES = ['Red',
+          {'name': 'Green', 'parallel': [
+              {'name': 'Vehicle', 'children': ['Go', 'Turn']},
+              {'name': 'Ped', 'children': ['Walk', 'Flash', 'DontWalk']}]},
+          {'name': 'Yellow', 'children': ['Early', 'Late'], 'initial': 'Late'}]
+
+TRANSITIONS = [['go', 'Red', 'Green'],
+               ['turn', 'Green.Vehicle.Go', 'Green.Vehicle.Turn'],
+               ['flash', 'Green.Vehicle.Go', 'Green.Ped.Flash'],
+               ['hurry', 'Green.Ped', 'Green.Ped.DontWalk'],
+               ['ped_off', 'Green.Vehicle', 'Green.Ped'],
+               ['slow', 'Green', 'Yellow'],
+               ['early', 'Yellow.Late', 'Yellow.Early'],
+               ['stop', 'Yellow', 'Red']]
+
+
+class Lamp(object):
+
+    def __init__(self):
+        self.log = []
+
+
+def machine():
+    lamp = Lamp()
+    fsm = HierarchicalMachine(lamp, states=STATES, transitions=TRANSITIONS, initial='Red',
+                              auto_transitions=False)
+    for name in fsm.states:
+        state = fsm.get_state(name)
+        state.on_enter.append(lambda name=name: lamp.log.append('+' + name))
+        state.on_exit.append(lambda name=name: lamp.log.append('-' + name))
+    return lamp, fsm
+
+
+def test_parallel_state_enters_every_region():
+    lamp, fsm = machine()
+    lamp.go()
+    assert lamp.state == ['Green.Vehicle.Go', 'Green.Ped.Walk']
+    assert lamp.log == ['-Red', '+Green', '+Green.Vehicle', '+Green.Ped', '+Green.Vehicle.Go', '+Green.Ped.Walk']
+    assert fsm.is_state('Green', lamp) and fsm.is_state('Green.Ped', lamp)
+
+
+def test_transition_within_a_region_keeps_the_other():
+    lamp, _ = machine()
+    lamp.go()
+    del lamp.log[:]
+    lamp.turn()
+    assert lamp.state == ['Green.Vehicle.Turn', 'Green.Ped.Walk']
+    assert lamp.log == ['-Green.Vehicle.Go', '+Green.Vehicle.Turn']
+
+
+def test_cross_region_transition_only_changes_the_destination_region():
+    lamp, _ = machine()
+    lamp.go()
+    del lamp.log[:]
+    assert lamp.flash()
+    assert lamp.state == ['Green.Vehicle.Go', 'Green.Ped.Flash']
+    assert lamp.log == ['-Green.Ped.Walk', '-Green.Ped', '+Green.Ped', '+Green.Ped.Flash']
+
+
+def test_cross_region_transition_into_a_region_enters_its_initial():
+    lamp, _ = machine()
+    lamp.go()
+    lamp.hurry()
+    del lamp.log[:]
+    lamp.ped_off()
+    assert lamp.state == ['Green.Vehicle.Go', 'Green.Ped.Walk']
+    assert lamp.log == ['-Green.Ped.DontWalk', '-Green.Ped', '+Green.Ped', '+Green.Ped.Walk']
+
+
+def test_transition_of_a_region_ancestor():
+    lamp, _ = machine()
+    lamp.go()
+    del lamp.log[:]
+    lamp.hurry()
+    assert lamp.state == ['Green.Vehicle.Go', 'Green.Ped.DontWalk']
+    assert lamp.log == ['-Green.Ped.Walk', '-Green.Ped', '+Green.Ped', '+Green.Ped.DontWalk']
+
+
+def test_leaving_a_parallel_state_exits_every_region():
+    lamp, _ = machine()
+    lamp.go()
+    lamp.flash()
+    del lamp.log[:]
+    lamp.slow()
+    assert lamp.state == 'Yellow.Late'
+    assert lamp.log == ['-Green.Vehicle.Go', '-Green.Ped.Flash', '-Green.Vehicle', '-Green.Ped', '-Green',
+                        '+Yellow', '+Yellow.Late']
+
+
+def test_compound_state_transitions():
+    lamp, fsm = machine()
+    lamp.go()
+    lamp.slow()
+    del lamp.log[:]
+    lamp.early()
+    assert lamp.state == 'Yellow.Early'
+    assert lamp.log == ['-Yellow.Late', '+Yellow.Early']
+    assert fsm.is_state('Yellow', lamp) and not fsm.is_state('Green', lamp)
+    lamp.stop()
+    assert lamp.state == 'Red'
+    assert lamp.log[-3:] == ['-Yellow.Early', '-Yellow', '+Red']
+
+
+def test_invalid_trigger_raises():
+    lamp, _ = machine()
+    with pytest.raises(MachineError):
+        lamp.flash()
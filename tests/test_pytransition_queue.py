@@ -0,0 +1,118 @@
+""" Bounded transition queue of pytransition.Machine: run with python -m pytest tests """
+
+import pytest
+
+pytest.importorskip('transitions')
+
+import pt_core
+
+pt = pt_core.load()
+
+
+class Lamp(object):
+
+    def __init__(self):
+        self.ticks = []
+        self.storm = ()
+
+    def record(self, *args, **kwargs):
+        self.ticks.append((args[0], kwargs) if kwargs else args[0])
+
+    def raise_storm(self):
+        for args, kwargs in self.storm:
+            self.tick(*args, **kwargs)
+
+
+def machine(capacity=3, overflow=pt.OVERFLOW_REJECT, **kwargs):
+    lamp = Lamp()
+    fsm = pt.Machine(lamp, states=['Red', 'Green'], initial='Red', auto_transitions=False, queued=True,
+                     queue_capacity=capacity, queue_overflow=overflow,
+                     transitions=[dict(trigger='go', source='Red', dest='Green', after='raise_storm'),
+                                  dict(trigger='tick', source='*', dest=None, after='record')], **kwargs)
+    return lamp, fsm
+
+
+def ticks(*values):
+    return [((value, ), {}) for value in values]
+
+
+def test_reject_refuses_triggers_while_full():
+    lamp, fsm = machine()
+    lamp.storm = ticks(1, 2, 3)
+    assert lamp.go()
+    assert lamp.ticks == [1, 2]
+    queue = fsm._transition_queue
+    assert (queue.rejected, queue.dropped, queue.coalesced, queue.high_water) == (1, 0, 0, 3)
+
+
+def test_drop_oldest_keeps_the_newest_triggers():
+    lamp, fsm = machine(overflow=pt.OVERFLOW_DROP_OLDEST)
+    lamp.storm = ticks(1, 2, 3, 4)
+    lamp.go()
+    assert lamp.ticks == [3, 4]
+    assert lamp.state == 'Green' # the running trigger is never dropped
+    queue = fsm._transition_queue
+    assert (queue.rejected, queue.dropped) == (0, 2)
+
+
+def test_coalesce_merges_identical_pending_triggers():
+    lamp, fsm = machine(capacity=4, overflow=pt.OVERFLOW_COALESCE)
+    lamp.storm = ticks(1, 2, 1, 2, 1) + [((1, ), {'x': 1}), ((1, ), {'x': 1}), ((3, ), {})]
+    lamp.go()
+    assert lamp.ticks == [1, 2, (1, {'x': 1})]
+    queue = fsm._transition_queue
+    assert (queue.coalesced, queue.rejected, queue.high_water) == (4, 1, 4)
+
+
+def test_coalesce_keeps_triggers_of_other_models_apart():
+    lamp, fsm = machine(capacity=4, overflow=pt.OVERFLOW_COALESCE)
+    other = Lamp()
+    fsm.add_model(other)
+
+    def storm():
+        lamp.tick(1)
+        other.tick(1)
+        lamp.tick(1)
+
+    lamp.raise_storm = storm
+    lamp.go()
+    assert (lamp.ticks, other.ticks) == ([1], [1])
+    assert fsm._transition_queue.coalesced == 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(pt, 'ticks_ms', lambda: now[0])
+    return now
+
+
+def test_drain_stops_at_the_budget(clock):
+    lamp, fsm = machine(capacity=8, drain_budget_ms=25)
+
+    def record(value):
+        clock[0] += 10
+        lamp.ticks.append(value)
+
+    lamp.record = record
+    lamp.storm = ticks(1, 2, 3, 4, 5)
+    lamp.go() # go takes no time, 1 to 3 take 30 ms
+    assert lamp.ticks == [1, 2, 3]
+    assert fsm._transition_queue and len(fsm._transition_queue) == 2
+    assert fsm.drain(budget_ms=10) == 1
+    assert lamp.ticks == [1, 2, 3, 4]
+    assert fsm.drain() == 1
+    assert lamp.ticks == [1, 2, 3, 4, 5] and not fsm._transition_queue
+
+
+def test_unbudgeted_drain_empties_the_queue(clock):
+    lamp, fsm = machine(capacity=8)
+    lamp.storm = ticks(1, 2, 3, 4, 5)
+    lamp.go()
+    assert lamp.ticks == [1, 2, 3, 4, 5] and not fsm._transition_queue
+
+
+def test_extend_applies_the_policy():
+    queue = pt.TransitionQueue(2)
+    queue.extend(['a', 'b', 'c'])
+    assert list(queue) == ['a', 'b'] and queue.rejected == 1
@@ -0,0 +1,142 @@
+""" Restart of state_machine.py from its snapshot (snapshot.py) on a virtual clock: run with python -m pytest tests
+
+A reset is the controller module imported again on the same loop, with the RTC memory and the wall clock
+kept, like machine.reset() leaves them.
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import machine
+import network
+import snapshot
+import utime
+from test_preemption_latency import VirtualLoop
+
+GPIO_POOL = list(config.PINS['GPIO_POOL']) # a controller takes its lamps from the pool as it is imported
+EPOCH = 1700000000 # s, wall clock at the first start
+
+
+class Board(object):
+    """ The controller on a loop whose clock the RTC follows """
+
+    def __init__(self, patch):
+        self.patch = patch
+        self.loop = VirtualLoop()
+        patch.setattr(utime, 'clock', self.loop.time)
+        patch.setattr(utime, 'time_ns', lambda: int((EPOCH + self.loop.time()) * 10 ** 9) + self.rtc_shift)
+        self.rtc_shift = 0
+        self.module = None
+
+    def reset(self):
+        '''Stops the running controller and starts a fresh one, which resumes from the snapshot'''
+        if self.module is not None:
+            self._cancel()
+        self.patch.setitem(config.PINS, 'GPIO_POOL', list(GPIO_POOL))
+        sys.modules.pop('state_machine', None)
+
+        async def load():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                import state_machine
+            return state_machine
+
+        with contextlib.redirect_stdout(io.StringIO()): # the lamps print every switch
+            self.module = self.loop.run_until_complete(load())
+        self.fsm = self.module.fsm
+        self.loop.create_task(self.module.main())
+
+    def run(self, seconds):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def do(self, func, *args):
+        '''func(*args) on the controller's loop, as its own tasks would call it'''
+        async def call():
+            return func(*args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.loop.run_until_complete(call())
+
+    def remaining(self):
+        '''ms left of the running phase'''
+        return utime.ticks_diff(self.fsm._phase_end, utime.ticks_ms())
+
+    def states(self):
+        return {name: model.state.name for name, model in self.fsm.models.items()}
+
+    def _cancel(self):
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+    def close(self):
+        self._cancel()
+        self.loop.close()
+        sys.modules.pop('state_machine', None)
+
+
+@pytest.fixture
+def board(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path) # the controller logs errors to logging.log
+    monkeypatch.setattr(machine.RTC, '_memory', b'')
+    monkeypatch.setitem(config.SETTINGS, 'snapshot', 'rtc')
+    monkeypatch.setattr(network.WLAN, 'connected', False) # fixed-time plan
+    monkeypatch.delitem(sys.modules, 'state_machine', raising=False)
+    board = Board(monkeypatch)
+    board.reset()
+    yield board
+    board.close()
+
+
+def test_snapshot_round_trip():
+    data = snapshot.pack(7, EPOCH * 1000, 2000, snapshot.FLASHING, [(1, 0), (2, snapshot.NO_STATE)], [3, 4])
+    assert snapshot.unpack(data) == (7, EPOCH * 1000, 2000, snapshot.FLASHING, [(1, 0), (2, 255)], [3, 4])
+    data[10] ^= 1
+    assert snapshot.unpack(data) is None
+
+
+def test_green_resumes_with_the_time_it_had_left(board):
+    board.run(12)
+    states = board.states()
+    assert 'Green' in states.values()
+    left = board.remaining()
+    board.reset()
+    assert board.states() == states
+    assert left - 50 <= board.remaining() <= left
+    assert board.fsm.state_allotted_time == config.SETTINGS['fixed_green_time'] * 1000
+
+
+def test_all_red_clearance_resumes_with_its_own_time(board):
+    '''The all-red after flash has no state of its own setting state_allotted_time, the snapshot carries it'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        board.fsm.FlashMode('test')
+        board.fsm.NormalMode()
+    all_red = int(config.SETTINGS['all_red_time'] * 1000)
+    board.run(0.5)
+    board.reset()
+    assert set(board.states().values()) == {'Red'}
+    assert all_red - 550 <= board.remaining() <= all_red - 500
+    board.run(all_red / 1000 - 0.4)
+    assert 'Green' in board.states().values()
+
+
+def test_rtc_set_back_does_not_stretch_the_phase(board):
+    '''A phase end far ahead, the RTC having been set back meanwhile, is cut to the phase's allotted time'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        board.fsm.FlashMode('test')
+        board.fsm.NormalMode()
+    board.rtc_shift = -3600 * 10 ** 9
+    board.reset()
+    assert board.remaining() == int(config.SETTINGS['all_red_time'] * 1000)
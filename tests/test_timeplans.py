@@ -0,0 +1,187 @@
+""" Time-of-day plans of timeplans.py over a virtual week: run with python -m pytest tests
+
+The plans run on a virtual clock from Monday 00:00 to the next Monday 01:00, with the cycles of a fixed-time
+plan stepping the greens. The plan in force is checked against a reference that walks the calendar minute by
+minute; Wednesday is a holiday.
+"""
+
+import asyncio
+import datetime
+import os
+import sys
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import timeplans
+from test_preemption_latency import VirtualLoop
+
+PLANS = {'am_peak': {'North': 45, 'South': 45, 'Southx': 20, 'West': 25},
+         'pm_peak': {'North': 20, 'South': 50, 'West': 40},
+         'weekend': {'North': 25, 'South': 25, 'West': 15},
+         'night': {'flash': True}}
+CALENDAR = [('Mon-Fri', '07:00', 'am_peak'), ('Mon-Fri', '09:30', 'fixed'), ('Mon-Fri', '16:30', 'pm_peak'),
+            ('Mon-Fri', '19:00', 'fixed'), ('Sat-Sun', '10:00', 'weekend'), ('Sat-Sun', '18:00', 'fixed'),
+            ('All', '23:00', 'night'), ('All', '05:30', 'fixed')]
+MONDAY = datetime.datetime(2026, 10, 19) # a Monday
+HOLIDAY = (10, 21) # the Wednesday
+LOST_TIME = 7 # s per slot change, yellow and all-red
+
+
+class Machine(object):
+    """ What TimePlans uses of StateMachine """
+
+    def __init__(self):
+        self.fixed_wait_times = OrderedDict((name, config.SETTINGS['fixed_green_time'])
+                                            for name in ('North', 'South', 'Southx', 'West'))
+        self.flashing = False
+        self.modes = []
+
+    def FlashMode(self, reason):
+        self.flashing = True
+        self.modes.append('flash')
+
+    def NormalMode(self):
+        self.flashing = False
+        self.modes.append('normal')
+
+
+def rtc(when):
+    return (when.year, when.month, when.day, when.weekday(), when.hour, when.minute, when.second, 0)
+
+
+def reference(calendar, holidays, start, minutes):
+    '''Plan in force for each minute from start, walking the calendar forward from a week before. A holiday
+       runs its 'Hol' entries, or Sunday's without any'''
+    own = any(days == 'Hol' for days, _, _ in calendar)
+    entries = {}
+    for days, start_time, plan in calendar:
+        entries.setdefault(start_time, []).append((days, plan))
+    plan = timeplans.FIXED
+    result = []
+    for i in range(-7 * timeplans.MINUTES_PER_DAY, minutes):
+        when = start + datetime.timedelta(minutes=i)
+        holiday = (when.month, when.day) in holidays
+        weekday = timeplans.DAYS[6 if holiday and not own else when.weekday()]
+        for days, name in entries.get('%02d:%02d' % (when.hour, when.minute), []):
+            if days == 'Hol' and holiday or days != 'Hol' and not (holiday and own) and \
+                    (days == 'All' or weekday in expand(days)):
+                plan = name
+        if i >= 0:
+            result.append(plan)
+    return result
+
+
+def expand(days):
+    first, _, last = days.partition('-')
+    first = timeplans.DAYS.index(first)
+    last = timeplans.DAYS.index(last or days)
+    return [timeplans.DAYS[day % 7] for day in range(first, last + 1 if last >= first else last + 8)]
+
+
+def lookup(plans, when):
+    return plans.lookup(when.month, when.day, when.weekday(), when.hour * 60 + when.minute)
+
+
+@pytest.fixture
+def loop():
+    loop = VirtualLoop()
+    yield loop
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def make(loop, now=lambda: rtc(MONDAY), calendar=CALENDAR, holidays=(HOLIDAY,)):
+    machine = Machine()
+
+    async def create():
+        return timeplans.TimePlans(machine, now, calendar, PLANS, holidays)
+    return machine, loop.run_until_complete(create())
+
+
+def test_every_minute_of_the_week(loop):
+    '''The plan at each boundary and between them, before Monday's first boundary and on the holiday'''
+    machine, plans = make(loop)
+    minutes = 8 * timeplans.MINUTES_PER_DAY
+    expected = reference(CALENDAR, {HOLIDAY}, MONDAY, minutes)
+    for i in range(minutes):
+        when = MONDAY + datetime.timedelta(minutes=i)
+        assert lookup(plans, when) == expected[i], when
+    assert expected[0] == 'night' # Monday 00:00 still runs Sunday's 23:00 entry
+    assert lookup(plans, MONDAY + datetime.timedelta(hours=5, minutes=29)) == 'night'
+    assert lookup(plans, MONDAY + datetime.timedelta(hours=5, minutes=30)) == 'fixed'
+    wednesday = MONDAY + datetime.timedelta(days=2)
+    assert lookup(plans, wednesday + datetime.timedelta(hours=8)) == 'fixed' # Sunday's, not am_peak
+    assert lookup(plans, wednesday + datetime.timedelta(hours=12)) == 'weekend'
+
+
+def test_holiday_entries_fall_back_to_the_day_before(loop):
+    calendar = CALENDAR + [('Hol', '08:00', 'weekend'), ('Hol', '20:00', 'fixed'), ('Hol', '23:00', 'night')]
+    machine, plans = make(loop, calendar=calendar)
+    minutes = 8 * timeplans.MINUTES_PER_DAY
+    expected = reference(calendar, {HOLIDAY}, MONDAY, minutes)
+    for i in range(minutes):
+        when = MONDAY + datetime.timedelta(minutes=i)
+        assert lookup(plans, when) == expected[i], when
+    wednesday = MONDAY + datetime.timedelta(days=2)
+    assert lookup(plans, wednesday + datetime.timedelta(hours=7)) == 'night' # Tuesday's 23:00 entry holds
+    assert lookup(plans, wednesday + datetime.timedelta(hours=17)) == 'weekend' # no pm_peak
+    assert lookup(plans, wednesday + datetime.timedelta(hours=22)) == 'fixed' # Hol's, not Mon-Fri's 19:00
+
+
+def test_week_on_a_virtual_clock(loop):
+    '''The plan in force follows the calendar within time_plan_check, and a new plan moves every green by at
+       most plan_transition_step per cycle until it reaches its target'''
+    now = lambda: rtc(MONDAY + datetime.timedelta(seconds=loop.time()))
+    machine, plans = make(loop, now)
+    greens = machine.fixed_wait_times
+    step = config.SETTINGS['plan_transition_step']
+    fixed = config.SETTINGS['fixed_green_time']
+    assert config.SETTINGS['time_plan_check'] < 30 # a boundary is picked up before the middle of its minute
+    settle = max(abs(green - fixed) for plan in PLANS.values() for green in plan.values()) // step + 1
+    minutes = 7 * timeplans.MINUTES_PER_DAY + 60
+    expected = reference(CALENDAR, {HOLIDAY}, MONDAY, minutes)
+    stats = {'cycles': 0, 'settled': 0}
+
+    async def cycles(): # what StateMachine._run_transitions does as each cycle starts, but in flash
+        plan, since = None, 0
+        while True:
+            if plans.plan != plan:
+                plan, since = plans.plan, 0
+            if not machine.flashing:
+                before = dict(greens)
+                plans.step()
+                for name, green in greens.items():
+                    target = plans.target(name)
+                    assert abs(green - before[name]) <= step
+                    assert abs(green - target) <= abs(before[name] - target) # always towards the target
+                since += 1
+                if since > settle:
+                    assert greens == {name: plans.target(name) for name in greens}
+                    stats['settled'] += 1
+                stats['cycles'] += 1
+            await asyncio.sleep(sum(greens.values()) + LOST_TIME * len(greens) if not machine.flashing else 60)
+
+    async def week():
+        task = asyncio.create_task(cycles())
+        for minute in range(minutes):
+            await asyncio.sleep(minute * 60 + 30 - loop.time()) # the middle of every minute
+            assert plans.plan == expected[minute], MONDAY + datetime.timedelta(minutes=minute)
+            if task.done():
+                task.result()
+        task.cancel()
+
+    loop.run_until_complete(week())
+    boundaries = sum(1 for i in range(1, minutes) if expected[i] != expected[i - 1])
+    assert plans.changes == boundaries + 1
+    assert machine.modes == ['flash', 'normal'] * 7 + ['flash'] # every night, the holiday's included
+    assert machine.flashing
+    assert stats['settled'] > 0.8 * stats['cycles']
@@ -0,0 +1,165 @@
+""" NTP discipline of timesync.py against a synthetic drifting RTC: run with python -m pytest tests
+
+The RTC runs DRIFT slow and starts behind the server. Samples are the offsets it would measure, with a few ms
+of jitter, taken every time_sync_interval on a virtual clock that only moves when told to.
+"""
+
+import asyncio
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, os.path.dirname(HERE))
+
+import pytest
+
+import config
+import network
+import timesync
+from test_preemption_latency import VirtualLoop
+
+DRIFT = 5e-5 # 50 ppm slow, a cheap crystal
+JITTER = 2 # ms
+
+
+class Log(object):
+
+    def info(self, msg):
+        pass
+
+    debug = error = info
+
+
+class DriftingRTC(object):
+    """ Server time (true) and the RTC that loses DRIFT of every ms """
+
+    def __init__(self, behind):
+        self.true = 1700000000000
+        self.rtc = self.true - behind
+
+    def __call__(self):
+        return int(self.rtc)
+
+    def advance(self, ms):
+        self.true += ms
+        self.rtc += ms * (1 - DRIFT)
+
+    def offset(self):
+        return self.true - self.rtc
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    monkeypatch.setattr(network.WLAN, 'connected', False) # the sync task waits, the tests drive it
+    loop = VirtualLoop()
+    yield loop
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    loop.close()
+
+
+def make(loop, local, server='127.0.0.1'):
+    async def create():
+        return timesync.TimeSync(Log(), local=local, server=server)
+    return loop.run_until_complete(create())
+
+
+def test_offset_and_drift_converge_within_the_slew_limit(loop):
+    clock = DriftingRTC(behind=200)
+    sync = make(loop, clock)
+    rng = random.Random(49)
+    slew = config.SETTINGS['slew_rate']
+    interval = config.SETTINGS['time_sync_interval'] * 1000
+    last = None
+    errors = []
+    for second in range(7200):
+        if second == 3600: # the server's time moves, by less than time_step_threshold with the drift so far
+            clock.true += 300
+        if second * 1000 % interval == 0:
+            assert not sync.update(clock(), clock.offset() + rng.uniform(-JITTER, JITTER), 10)
+        now = sync.now()
+        if last is not None: # the correction moves by at most slew_rate ms per second
+            assert abs((now - last[1]) - (clock() - last[0])) <= slew * (clock() - last[0]) / 1000 + 1
+        last = (clock(), now)
+        errors.append(now - clock.true)
+        clock.advance(1000)
+    assert sync.synced and sync.steps == 0
+    assert abs(sync.drift - DRIFT) < 5e-6
+    assert abs(sync.offset + sync.drift * (clock() - sync.reference) - clock.offset()) < JITTER + 1
+    assert all(abs(error) <= 2 * JITTER + 1 for error in errors[600:3600])
+    assert errors[3678] <= -300 + 30 * slew + 2 * JITTER + 1 # slewed from the sample at 3648 s, not stepped
+    assert all(abs(error) <= 2 * JITTER + 1 for error in errors[-600:])
+
+
+def test_large_offsets_are_stepped_without_a_jump(loop):
+    '''The RTC drifts past time_step_threshold: it is set, and now() goes on as if it had not been'''
+    clock = DriftingRTC(behind=900)
+    sync = make(loop, clock)
+    step = sync.step
+
+    def set_rtc(delta):
+        step(delta)
+        clock.rtc += delta
+
+    sync.step = set_rtc
+    slew = config.SETTINGS['slew_rate']
+    interval = config.SETTINGS['time_sync_interval'] * 1000
+    last = None
+    for second in range(7200):
+        if second * 1000 % interval == 0:
+            sync.update(clock(), clock.offset(), 10)
+        now = sync.now()
+        if last is not None: # the RTC jumps, now() still follows the server's second within the slew
+            assert abs((now - last[1]) - (clock.true - last[0])) <= slew + 1
+        last = (clock.true, now)
+        clock.advance(1000)
+    assert sync.steps == 1
+    assert abs(clock.offset()) < DRIFT * 7200000 # the RTC itself is close again, but for the drift since
+    assert abs(sync.now() - clock.true) <= 1
+    assert abs(sync.drift - DRIFT) < 1e-6
+
+
+def test_server_is_resolved_once_per_association(loop, monkeypatch):
+    lookups = []
+    samples = []
+
+    def getaddrinfo(host, port):
+        lookups.append(host)
+        return [(2, 2, 17, '', ('192.168.100.204', port))]
+
+    monkeypatch.setattr(timesync.socket, 'getaddrinfo', getaddrinfo)
+    virtual = lambda: int(loop.time() * 1000)
+    sync = make(loop, virtual, server='ntp.example.org')
+
+    async def sample():
+        samples.append(sync._address)
+        return virtual(), 0.0, 5
+
+    sync.sample = sample
+
+    def run(seconds):
+        loop.run_until_complete(asyncio.sleep(seconds))
+
+    run(30)
+    assert lookups == [] and samples == [] # no lookup before the WiFi is up
+    monkeypatch.setattr(network.WLAN, 'connected', True)
+    run(600)
+    assert lookups == ['ntp.example.org'] and len(samples) > 30
+    assert set(samples) == {('192.168.100.204', timesync.NTP_PORT)}
+    monkeypatch.setattr(network.WLAN, 'connected', False)
+    run(2 * config.SETTINGS['time_sync_interval'])
+    monkeypatch.setattr(network.WLAN, 'connected', True)
+    run(100)
+    assert len(lookups) == 2
+
+
+def test_literal_addresses_are_not_looked_up(monkeypatch):
+    monkeypatch.setattr(timesync.socket, 'getaddrinfo', None)
+    sync = timesync.TimeSync.__new__(timesync.TimeSync)
+    sync.server = '192.168.100.204'
+    assert sync.resolve() == ('192.168.100.204', timesync.NTP_PORT)
+    assert not timesync.literal('ntp.ntsc.ac.cn') and not timesync.literal('300.1.1.1')
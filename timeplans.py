@@ -0,0 +1,158 @@
+# timeplans.py Time-of-day plans: green splits chosen by weekday, time of day and holidays
+# Usage:
+# plans = TimePlans(machine, clock.rtc.datetime)  # TIME_PLANS, CALENDAR and HOLIDAYS from config.py
+# plans.lookup(month, day, weekday, minute)        # name of the plan in force, minute of the day
+#
+# CALENDAR is compiled once into boundaries sorted by minute of the week, with the plan each one starts.
+# The plan in force is found by a binary search for the last boundary at or before now; before the first
+# boundary of the week the last one of the previous week still holds. Holidays use their own boundaries
+# ('Hol' entries) or, without any, Sunday's.
+# A new plan does not jump to its greens: each green moves towards its new length by at most
+# SETTINGS['plan_transition_step'] seconds per cycle, at the start of the cycle (see step).
+
+from array import array
+import uasyncio as asyncio
+
+from config import CALENDAR, HOLIDAYS, SETTINGS, TIME_PLANS
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun') # RTC weekday 0 is Monday
+FIXED = 'fixed' # plan with fixed_green_time for every approach, always defined
+MINUTES_PER_DAY = 1440
+
+
+def parse_days(days):
+    '''Weekday numbers of 'Mon', 'Mon-Fri' or 'All'. 'Hol' gives an empty list'''
+    if days == 'All':
+        return list(range(7))
+    if days == 'Hol':
+        return []
+    first, _, last = days.partition('-')
+    if first not in DAYS or (last and last not in DAYS):
+        raise ValueError("Unknown days {}, use Mon..Sun, a range like Mon-Fri, All or Hol".format(days))
+    first = DAYS.index(first)
+    last = DAYS.index(last) if last else first
+    return [day % 7 for day in range(first, last + 1 if last >= first else last + 8)]
+
+
+def parse_time(text):
+    hours, _, minutes = text.partition(':')
+    minute = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= minute < MINUTES_PER_DAY:
+        raise ValueError("Time {} is not within a day".format(text))
+    return minute
+
+
+def compile_calendar(calendar, plans):
+    '''Returns (names, week, holiday): week and holiday are (starts, plans) with starts an array of boundary
+       minutes in ascending order and plans a bytearray of indexes into names. A later entry for the same
+       minute replaces an earlier one'''
+    names = [FIXED] + [name for name in plans if name != FIXED]
+    if len(names) > 255:
+        raise ValueError("At most 254 time plans")
+    week, holiday = {}, {}
+    for days, start, plan in calendar:
+        if plan not in names:
+            raise ValueError("Calendar entry {} {} names unknown plan {}".format(days, start, plan))
+        minute = parse_time(start)
+        if days == 'Hol':
+            holiday[minute] = names.index(plan)
+        for day in parse_days(days):
+            week[day * MINUTES_PER_DAY + minute] = names.index(plan)
+
+    def table(boundaries):
+        starts = sorted(boundaries)
+        return array('H', starts), bytearray(boundaries[start] for start in starts)
+
+    return names, table(week), table(holiday)
+
+
+def find(starts, minute):
+    '''Index of the last boundary at or before minute, -1 if there is none'''
+    low, high = 0, len(starts)
+    while low < high:
+        middle = (low + high) // 2
+        if starts[middle] <= minute:
+            low = middle + 1
+        else:
+            high = middle
+    return low - 1
+
+
+class TimePlans(object):
+    """ Chooses the time-of-day plan and moves the fixed-time greens of the machine towards it.
+    Attributes:
+        plan (str): Name of the plan in force, None until the first check.
+        changes (int): Plans applied since start-up, the first one included.
+    """
+
+    def __init__(self, machine, now, calendar=CALENDAR, plans=TIME_PLANS, holidays=HOLIDAYS):
+        self.machine = machine
+        self.now = now # returns an RTC datetime tuple (year, month, day, weekday, hours, minutes, seconds, subseconds)
+        self.plans = plans
+        self.holidays = set(tuple(date) for date in holidays)
+        self.names, (self.week_starts, self.week_plans), (self.holiday_starts, self.holiday_plans) = \
+            compile_calendar(calendar, plans)
+        self.step_size = SETTINGS['plan_transition_step']
+        self.plan = None
+        self.changes = 0
+        self._flashed = False
+        self._task = asyncio.create_task(self._run()) if calendar else None
+
+    def lookup(self, month, day, weekday, minute):
+        if (month, day) in self.holidays:
+            if not self.holiday_starts:
+                weekday = 6 # holidays without their own entries run Sunday's plans
+            else:
+                i = find(self.holiday_starts, minute)
+                if i >= 0:
+                    return self.names[self.holiday_plans[i]]
+                weekday, minute = (weekday - 1) % 7, MINUTES_PER_DAY - 1 # still the plan of the day before
+        if not self.week_starts:
+            return FIXED
+        i = find(self.week_starts, weekday * MINUTES_PER_DAY + minute)
+        return self.names[self.week_plans[i]] # i == -1 wraps to the last boundary of the previous week
+
+    def current(self):
+        _, month, day, weekday, hours, minutes, _, _ = self.now()
+        return self.lookup(month, day, weekday, hours * 60 + minutes)
+
+    def target(self, name):
+        '''Green in seconds the plan in force gives approach name'''
+        return self.plans.get(self.plan, {}).get(name, SETTINGS['fixed_green_time'])
+
+    def step(self):
+        '''Moves the fixed-time greens one step towards the plan in force. Called once per cycle, as its first
+           slot starts'''
+        if self.plan is None:
+            return
+        greens = self.machine.fixed_wait_times
+        for name, green in greens.items():
+            target = self.target(name)
+            if green < target:
+                greens[name] = min(green + self.step_size, target)
+            elif green > target:
+                greens[name] = max(green - self.step_size, target)
+
+    def apply(self, plan):
+        machine = self.machine
+        first = self.plan is None
+        self.plan = plan
+        self.changes += 1
+        if self.plans.get(plan, {}).get('flash'):
+            if not machine.flashing: # a fault flash is not ended by the next plan
+                self._flashed = True
+                machine.FlashMode('({} plan)'.format(plan))
+            return
+        if self._flashed:
+            self._flashed = False
+            machine.NormalMode()
+        if first: # nothing to move from at start-up
+            for name in machine.fixed_wait_times:
+                machine.fixed_wait_times[name] = self.target(name)
+
+    async def _run(self):
+        while True:
+            plan = self.current()
+            if plan != self.plan:
+                self.apply(plan)
+            await asyncio.sleep(SETTINGS['time_plan_check'])
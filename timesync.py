@@ -0,0 +1,193 @@
+# timesync.py Wall clock disciplined by NTP, for the timing controllers have to agree on
+# Usage:
+# sync = TimeSync(log)  # background task, server SETTINGS['time_server']
+# sync.now()            # wall-clock ms, slewed: it never jumps once synchronised
+#
+# Every time_sync_interval seconds the task takes a burst of NTP samples over a non-blocking UDP socket and keeps
+# the one with the shortest round trip, whose offset is least disturbed by queueing. Offset and crystal drift
+# are the least-squares line through the last HISTORY kept samples. now() follows that line, but its correction
+# changes by at most slew_rate ms per second, so the cycle timing built on it is stretched, not stepped.
+# An offset above time_step_threshold (the first sync after a power-up, or the RTC drifting away over days)
+# is put into the RTC instead, and now() is shifted by the same amount so it stays continuous.
+# The RTC keeps local time, utc_offset hours from the server's UTC, as Clock and the time-of-day plans read it.
+# Any NTP server will do, e.g. chrony on the Rpi for round trips of a few ms on the LAN. The task waits for the
+# WiFi association and resolves the server once per association; getaddrinfo blocks the loop for the DNS round
+# trip, so a literal IP address in time_server, which is used as it is, keeps the lamps from ever waiting on it.
+
+import struct
+import uasyncio as asyncio
+import utime
+from machine import RTC
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+
+from config import SETTINGS
+
+NTP_PORT = 123
+NTP_DELTA = 2208988800 if utime.gmtime(0)[0] == 1970 else 3155673600 # seconds from 1900 to the utime epoch
+HISTORY = 8
+BURST = 4
+
+
+def local_ms():
+    '''RTC time in ms since the utime epoch, not disciplined'''
+    return utime.time_ns() // 1000000
+
+
+def ntp_ms(data, offset):
+    seconds, fraction = struct.unpack_from('!II', data, offset)
+    return (seconds - NTP_DELTA) * 1000 + (fraction * 1000 >> 32)
+
+
+def literal(host):
+    '''True if host is a dotted IPv4 address, which needs no DNS lookup'''
+    parts = host.split('.')
+    return len(parts) == 4 and all(part.isdigit() and int(part) < 256 for part in parts)
+
+
+def fit(times, offsets):
+    '''Least-squares line through (times, offsets): returns (offset at times[-1], slope in ms per ms)'''
+    n = len(times)
+    last = times[-1]
+    mean_t = sum(t - last for t in times) / n
+    mean_o = sum(offsets) / n
+    sxx = sum((t - last - mean_t) ** 2 for t in times)
+    if n < 3 or sxx == 0:
+        return offsets[-1], None
+    slope = sum((t - last - mean_t) * (o - mean_o) for t, o in zip(times, offsets)) / sxx
+    return mean_o - slope * mean_t, slope
+
+
+class TimeSync(object):
+    """ NTP time for the controller.
+    Attributes:
+        synced (bool): True once an offset was measured.
+        offset (float): ms the RTC is behind the server at reference, by the last fit.
+        drift (float): ms the RTC loses per ms, by the last fit (2e-5 is 20 ppm slow).
+        delay (int): Round trip of the last sample kept, ms.
+        steps (int): Times the RTC was set.
+    """
+
+    def __init__(self, log, local=local_ms, server=None):
+        self.log = log
+        self.local = local
+        self.server = server or SETTINGS['time_server']
+        self.synced = False
+        self.offset = 0
+        self.drift = 0.0
+        self.delay = None
+        self.steps = 0
+        self.reference = None
+        self.correction = None # applied to local(), follows offset and drift at slew_rate
+        self._last = None
+        self._times = []
+        self._offsets = []
+        self._address = None
+        self._task = asyncio.create_task(self._run())
+
+    def now(self):
+        raw = self.local()
+        if self.reference is None:
+            return raw
+        target = self.offset + self.drift * (raw - self.reference)
+        if self.correction is None:
+            self.correction = target
+        else:
+            limit = SETTINGS['slew_rate'] * (raw - self._last) / 1000
+            self.correction += max(-limit, min(limit, target - self.correction))
+        self._last = raw
+        return raw + int(self.correction)
+
+    def update(self, at, offset, delay):
+        '''Takes the offset measured at local time at. Returns True if it was put into the RTC'''
+        self.delay = delay
+        if abs(offset) > SETTINGS['time_step_threshold'] * 1000:
+            self.step(int(offset))
+            return True
+        self._times.append(at)
+        self._offsets.append(offset)
+        if len(self._times) > HISTORY:
+            self._times.pop(0)
+            self._offsets.pop(0)
+        self.offset, drift = fit(self._times, self._offsets)
+        if drift is not None:
+            self.drift = drift
+        self.reference = at
+        self.synced = True
+        return False
+
+    def step(self, delta):
+        '''Sets the RTC delta ms ahead and moves the estimate with it, so now() does not change'''
+        ms = self.local() + delta
+        tm = utime.gmtime(ms // 1000)
+        RTC().datetime((tm[0], tm[1], tm[2], tm[6], tm[3], tm[4], tm[5], ms % 1000 * 1000))
+        self._times = [t + delta for t in self._times]
+        self._offsets = [o - delta for o in self._offsets]
+        self.offset -= delta
+        if self.reference is not None:
+            self.reference += delta
+        if self.correction is not None:
+            self.correction -= delta
+            self._last += delta
+        self.steps += 1
+        self.log.info("RTC set {} ms ahead".format(delta))
+
+    def resolve(self):
+        '''Address of the server. A host name is looked up, which blocks until the DNS server answers'''
+        if literal(self.server):
+            return (self.server, NTP_PORT)
+        return socket.getaddrinfo(self.server, NTP_PORT)[0][-1]
+
+    async def sample(self):
+        '''One NTP exchange, (local time, offset, round trip) in ms. Waits on the socket without blocking the loop'''
+        packet = bytearray(48)
+        packet[0] = 0x1b # version 3, client
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            t1 = self.local()
+            sock.sendto(packet, self._address)
+            while True:
+                try:
+                    data = sock.recv(48)
+                    break
+                except OSError:
+                    if self.local() - t1 > SETTINGS['time_sync_timeout'] * 1000:
+                        raise OSError("NTP timeout")
+                    await asyncio.sleep_ms(1)
+            t4 = self.local()
+        finally:
+            sock.close()
+        if len(data) < 48 or data[1] == 0: # short or kiss-o'-death
+            raise OSError("NTP server refused")
+        zone = int(SETTINGS['utc_offset'] * 3600000)
+        t2 = ntp_ms(data, 32) + zone
+        t3 = ntp_ms(data, 40) + zone
+        return (t1 + t4) // 2, ((t2 - t1) + (t3 - t4)) / 2, (t4 - t1) - (t3 - t2)
+
+    async def _run(self):
+        import network
+        station = network.WLAN(network.STA_IF)
+        while True:
+            if not station.isconnected():
+                self._address = None # resolved again after the next association, the server may have moved
+                await asyncio.sleep_ms(500)
+                continue
+            interval = SETTINGS['time_sync_interval']
+            try:
+                if self._address is None:
+                    self._address = self.resolve()
+                best = None
+                for _ in range(BURST):
+                    sample = await self.sample()
+                    if best is None or sample[2] < best[2]:
+                        best = sample
+                    await asyncio.sleep_ms(200)
+                if self.update(*best):
+                    interval = 1 # measure again on the new RTC time
+            except OSError as e: # no server, no DNS
+                self.log.debug("Time sync: {}".format(e))
+                interval = min(interval, 10)
+            await asyncio.sleep(interval)